@@ -96,7 +96,7 @@ setup(
         packages     = packages,
         cmdclass     = cmdclasses,
         data_files   = data_files,
-        install_requires = ['redis>=2.0'],
+        install_requires = ['redis>=2.10'],
         classifiers = [
             'Development Status :: 4 - Beta',
             'Environment :: Plugins',
@@ -1,4 +1,8 @@
+from itertools import izip
+from threading import local
+
 from stdnet.exceptions import *
+from stdnet.utils import LRUCache
 from structures import pipelines, Structure
 
 novalue = object()
@@ -34,14 +38,139 @@ class Keys(object):
         self.value = value
     
 
+class QueryResult(object):
+    '''The result of a query executed on the server by
+:meth:`BackendDataServer.query`.
+
+.. attribute:: id
+
+    key of the temporary set holding the ids of matched objects.
+    
+.. attribute:: registry
+
+    key of the set holding all query results of the model.
+    
+.. attribute:: size
+
+    number of matched objects.
+    
+.. attribute:: query
+
+    optional backend specific data used to evaluate the query again when the
+    temporary set has expired or was deleted by a write to the model.
+'''
+    def __init__(self, cursor, id, registry, size, query = None):
+        self.cursor   = cursor
+        self.id       = id
+        self.registry = registry
+        self.size     = size
+        self.query    = query
+        
+    def __len__(self):
+        return self.size
+    
+    def ids(self, chunk_size = 1000):
+        '''Generator of matched ids fetched from the server in chunks
+of about *chunk_size*.'''
+        return self.cursor.query_ids(self, chunk_size)
+        
+
+def thread_local(name, factory):
+    '''A property stored in the per-thread ``_local`` attribute of a
+:class:`BackendDataServer` and created by calling *factory*
+the first time it is accessed in a thread.'''
+    def fget(self):
+        try:
+            return getattr(self._local,name)
+        except AttributeError:
+            value = factory()
+            setattr(self._local,name,value)
+            return value
+    def fset(self, value):
+        setattr(self._local,name,value)
+    return property(fget, fset)
+
+
+class IdentityMap(object):
+    '''A context manager which guarantees that, within the block,
+:meth:`BackendDataServer.get_object` returns the same instance
+for a given model and id. Maps are per-thread and nested maps
+share the outermost one::
+    
+    with cursor.identity_map():
+        ...
+'''
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.owner  = False
+        
+    def __enter__(self):
+        local = self.cursor._local
+        if getattr(local,'identity',None) is None:
+            local.identity = {}
+            self.owner = True
+        return local.identity
+    
+    def __exit__(self, type, value, traceback):
+        if self.owner:
+            self.cursor._local.identity = None
+            self.owner = False
+        
+
+class UsePrimary(object):
+    '''A context manager which sends, within the block, all reads
+of the current thread to the primary server rather than to replicas,
+so that they see the writes committed before them::
+    
+    with cursor.using_primary():
+        ...
+'''
+    def __init__(self, cursor):
+        self.cursor = cursor
+        
+    def __enter__(self):
+        self.cursor._primary += 1
+        return self.cursor
+    
+    def __exit__(self, type, value, traceback):
+        self.cursor._primary -= 1
+        
+
 class BackendDataServer(object):
     '''Generic interface for a backend database:
     
     * *name* name of database, such as **redis**, **couchdb**, etc..
     * *params* dictionary of configuration parameters
     * *pickler* calss for serializing and unserializing data. It must implement the *loads* and *dumps* methods.
+    
+    Recognised *params*:
+    
+    * *timeout* default expiry in seconds for keys. Default ``0`` (no expiry).
+    * *batch_size* maximum number of commands sent to the server in a single
+      request when committing. ``0`` means no limit. Default ``10000``.
+    * *query_timeout* number of seconds query results are kept in the server
+      for reuse by identical queries. Default ``10``.
+    * *cache_size* maximum number of objects data kept in the process
+      by :attr:`object_cache`. ``0`` disables the cache. Default ``0``.
+      
+.. attribute:: object_cache
+
+    A :class:`stdnet.utils.LRUCache` of objects data used by
+    :meth:`get_object`. Entries are invalidated when objects are saved
+    or deleted through this backend instance, therefore the cache should
+    be enabled only when no other process writes the same models.
     '''
     structure_module = None
+    # Pending writes are kept per thread since backend instances are
+    # shared by all models registered with the same uri.
+    _cachepipe = thread_local('cachepipe', dict)
+    _keys      = thread_local('keys', dict)
+    _queries   = thread_local('queries', set)
+    _discards  = thread_local('discards', list)
+    _objects   = thread_local('objects', list)
+    _saved     = thread_local('saved', set)
+    _primary   = thread_local('primary', int)
+    
     def __init__(self, name, params, pickler = None):
         self.__name = name
         timeout = params.get('timeout', 0)
@@ -50,8 +179,25 @@ class BackendDataServer(object):
         except (ValueError, TypeError):
             timeout = 0
         self.default_timeout = timeout
-        self._cachepipe = {}
-        self._keys      = {}
+        batch_size = params.get('batch_size', 10000)
+        try:
+            batch_size = int(batch_size)
+        except (ValueError, TypeError):
+            batch_size = 10000
+        self.batch_size = batch_size
+        query_timeout = params.get('query_timeout', 10)
+        try:
+            query_timeout = int(query_timeout)
+        except (ValueError, TypeError):
+            query_timeout = 10
+        self.query_timeout = query_timeout
+        cache_size = params.get('cache_size', 0)
+        try:
+            cache_size = int(cache_size)
+        except (ValueError, TypeError):
+            cache_size = 0
+        self.object_cache = LRUCache(cache_size)
+        self._local     = local()
         self.params     = params
         self.pickler    = pickler or default_pickler
 
@@ -78,17 +224,108 @@ an :class:`stdnet.exceptions.ObjectNotFund` exception.
 
     * *meta* :ref:`database metaclass <database-metaclass>` or model
     * *name* name of field (must be unique)
-    * *value* value of field to search.'''
+    * *value* value of field to search.
+    
+Objects data is read through :attr:`object_cache` and, within an
+:meth:`identity_map` block, the same instance is returned for the same id.'''
         if name != 'id':
             id = self._get(meta.basekey(name,value))
         else:
             id = value
         if id is None:
             raise ObjectNotFund
-        data = self.hash(meta.basekey()).get(id)
-        if value is None:
-            raise ObjectNotFund
-        return meta.make(id,data)
+        key = (meta.basekey(),str(id))
+        identity = getattr(self._local,'identity',None)
+        if identity is not None:
+            obj = identity.get(key)
+            if obj is not None:
+                return obj
+        data = self.object_cache.get(key)
+        if data is None:
+            fields, rows = self.get_rows(meta, (id,))
+            data = rows[0]
+            if data is None:
+                raise ObjectNotFund
+            self.object_cache.set(key,data)
+        obj = meta.make(id,data)
+        if identity is not None:
+            identity[key] = obj
+        return obj
+    
+    def get_objects(self, meta, ids):
+        '''Retrieve several objects with a single request to the server.
+Return a dictionary of objects keyed by id, which does not contain ids
+of missing objects. Like :meth:`get_object` it uses the
+:attr:`object_cache` and the current :meth:`identity_map`.'''
+        bkey     = meta.basekey()
+        cache    = self.object_cache
+        identity = getattr(self._local,'identity',None)
+        objs     = {}
+        missing  = []
+        for id in ids:
+            key = (bkey,str(id))
+            obj = identity.get(key) if identity is not None else None
+            if obj is None:
+                data = cache.get(key)
+                if data is None:
+                    missing.append(id)
+                    continue
+                obj = meta.make(id,data)
+                if identity is not None:
+                    identity[key] = obj
+            objs[id] = obj
+        if missing:
+            fields, rows = self.get_rows(meta, missing)
+            for id,data in izip(missing,rows):
+                if data is not None:
+                    key = (bkey,str(id))
+                    cache.set(key,data)
+                    obj = meta.make(id,data)
+                    if identity is not None:
+                        identity[key] = obj
+                    objs[id] = obj
+        return objs
+    
+    def get_ids(self, meta, name, values):
+        '''Return the list of ids of objects whose unique field *name* is equal
+to the serialized *values*, or ``None`` for values not matching any object.'''
+        if name == 'id':
+            return list(values)
+        bkey = meta.basekey
+        return [self._get(bkey(name,value)) for value in values]
+    
+    def get_rows(self, meta, ids, fields = None):
+        '''Fetch the serialized field values of objects *ids* with a single
+request. Return a two elements tuple containing the list of loaded fields
+and a list with, for each id, the list of values or ``None`` if the object
+does not exist. *fields* can be used to load a subset of fields when
+the model :attr:`stdnet.orm.base.Metaclass.storage` is ``"hash"``, otherwise
+all fields are loaded.'''
+        if not ids:
+            return meta.fields, []
+        if meta.storage == 'hash':
+            fields = fields or meta.fields
+            return fields, self._get_fields(meta, ids, fields)
+        else:
+            return meta.fields, list(meta.table().mget(ids))
+    
+    def identity_map(self):
+        '''Return an :class:`IdentityMap` context manager.'''
+        return IdentityMap(self)
+    
+    def using_primary(self):
+        '''Return a :class:`UsePrimary` context manager. Backends without
+replicas always read from the primary server.'''
+        return UsePrimary(self)
+    
+    def _forget(self, obj):
+        # Invalidate object cache and identity map entries for obj
+        key = (obj._meta.basekey(),str(obj.id))
+        self.object_cache.discard(key)
+        identity = getattr(self._local,'identity',None)
+        if identity is not None:
+            identity.pop(key,None)
+        return key
     
     def _get_pipe(self, id, typ, timeout):
         cache  = self._cachepipe
@@ -98,47 +335,107 @@ an :class:`stdnet.exceptions.ObjectNotFund` exception.
             cache[id] = cvalue
         return cvalue
             
-    def add_object(self, obj, data, indexes, commit = True):
+    def add_object(self, obj, data, indexes, commit = True, fields = None,
+                   discards = None, version = None, check_version = False):
         '''Add a model object to the database:
         
         * *obj* instance of :ref:`StdModel <model-model>` to add to database
+        * *data* list of serialized values of *fields*.
+        * *indexes* list of ``(field, value)`` of indexes to update.
         * *commit* If True, *obj* is saved to database, otherwise it remains in local cache.
+        * *fields* list of fields to save. By default all fields. A subset of fields
+          can be saved only when the model storage is ``"hash"``.
+        * *discards* optional list of ``(field, value)`` of index entries of
+          previous values to remove.
+        * *version* the new version of *obj* if the model is versioned.
+        * *check_version* if ``True`` the object is saved only if its version
+          in the server is ``version - 1``. It requires an atomic
+          compare-and-set, which is not available in this implementation.
         '''
+        if check_version:
+            raise NotImplementedError('Versioned saves are not supported by %s' % self)
         meta  = obj._meta
         timeout = meta.timeout
         cache = self._cachepipe
         hash  = meta.table()
         objid = obj.id
-        hash.add(objid, data)
+        if meta.storage == 'hash':
+            hash.add(objid, [])
+            names = (field.name for field in fields or meta.fields)
+            meta.object_table(objid).update(dict(izip(names,data)))
+        else:
+            hash.add(objid, data)
+        key = self._forget(obj)
+        self._saved.add(key)
+        identity = getattr(self._local,'identity',None)
+        if identity is not None:
+            identity[key] = obj
         
         # Create indexes if possible
         for field,value in indexes:
-            key     = meta.basekey(field.name,value)
-            if field.unique:
-                index = self.index_keys(key, timeout)
-            else:
-                if field.ordered:
-                    index = self.ordered_set(key, timeout, pickler = nopickle)
+            if field.index:
+                key = meta.basekey(field.name,value)
+                if field.unique:
+                    index = self.index_keys(key, timeout)
                 else:
                     index = self.unordered_set(key, timeout, pickler = nopickle)
-            index.add(objid)
+                index.add(objid)
+            if field.ordered and value is not None:
+                index = self.ordered_set(meta.basekey(field.name), timeout, pickler = nopickle)
+                index.add(objid, field.scorefun(value))
                 
+        # Remove index entries of previous values
+        new = dict(((field.name,value) for field,value in indexes))
+        for field,value in discards or ():
+            name = field.name
+            if field.index:
+                key = meta.basekey(name,value)
+                if key != meta.basekey(name,new.get(name)):
+                    self._discards.append(('unique' if field.unique else 'set',key,objid))
+            if field.ordered and value is not None and new.get(name) is None:
+                self._discards.append(('ordered',meta.basekey(name),objid))
+        
+        self._queries.add(meta.basekey('queries'))
         if commit:
             self.commit()
             
     def commit(self):
-        '''Commit cache objects to database'''
+        '''Commit cache objects to database. All pending structure writes and
+unique keys are queued into a single :meth:`batch` which is then executed,
+so that the whole commit requires as few server round-trips as possible.'''
         cache = self._cachepipe
         keys = self._keys
+        queries = self._queries
+        discards = self._discards
+        objects = self._objects
+        saved = self._saved
         # flush cache
         self._cachepipe = {}
         self._keys = {}
+        self._queries = set()
+        self._discards = []
+        self._objects = []
+        self._saved = set()
         # commit
+        batch = self.batch()
         for id,pipe in cache.iteritems():
             el = getattr(self,pipe.method)(id, pipeline = pipe)
-            el.save()
+            el.save(batch)
         if keys: 
-            self._set_keys(keys)
+            self._set_keys(keys, batch)
+        if discards:
+            self._discard_indexes(discards, batch)
+        if objects:
+            self._save_objects(objects, batch)
+        if queries:
+            self._invalidate(queries, batch)
+        try:
+            return batch.execute()
+        finally:
+            # saved objects may have been read, and cached, before the commit
+            cache = self.object_cache
+            for key in saved:
+                cache.discard(key)
             
     def delete_object(self, obj, deleted = None):
         '''Delete an object from the data server and clean up indices.'''
@@ -148,23 +445,34 @@ an :class:`stdnet.exceptions.ObjectNotFund` exception.
         hash    = meta.table()
         bkey    = meta.basekey
         objid   = obj.id
+        self._forget(obj)
         if not hash.delete(objid):
             return 0
+        if meta.storage == 'hash':
+            deleted.append(self.delete(meta.objkey(objid)))
+        dbdata  = obj.__dict__.get('_dbdata') or {}
         for field in meta.fields:
             name = field.name
             if field.index:
-                key   = bkey(name,field.serialize(getattr(obj,name,None)))
+                if name in dbdata:
+                    value = dbdata[name]
+                else:
+                    value = field.serialize(getattr(obj,field.attname,None))
+                key   = bkey(name,value)
                 if field.unique:
                     deleted.append(self.delete(key))
                 else:
-                    if field.ordered:
-                        idx = self.ordered_set(key, timeout, pickler = nopickle)
-                    else:
-                        idx = self.unordered_set(key, timeout, pickler = nopickle)
+                    idx = self.unordered_set(key, timeout, pickler = nopickle)
                     deleted.append(idx.discard(objid))
+            if field.ordered:
+                idx = self.ordered_set(bkey(name), timeout, pickler = nopickle)
+                deleted.append(idx.discard(objid))
             fid = field.id(obj)
             if fid:
                 deleted.append(self.delete(fid))
+        for field in meta.multifields:
+            deleted.append(self.delete(field.id(obj)))
+        self._invalidate((bkey('queries'),), self)
         return 1
         
     def set(self, id, value, timeout = None):
@@ -250,7 +558,90 @@ an :class:`stdnet.exceptions.ObjectNotFund` exception.
     def _get(self, id):
         raise NotImplementedError
     
-    def _set_keys(self):
+    def lock(self, id, timeout):
+        '''Acquire the lock *id* for *timeout* seconds, after which it is
+released automatically. Return a token, which must be passed to :meth:`unlock`,
+or ``None`` if the lock is held by someone else.'''
+        raise NotImplementedError
+    
+    def unlock(self, id, token):
+        '''Release the lock *id* acquired with *token*. Return ``True``
+if the lock was released, ``False`` if it had expired or was acquired by
+someone else.'''
+        raise NotImplementedError
+    
+    def query(self, meta, fargs, eargs, store = False):
+        '''Execute a query on the model *meta*. *fargs* and *eargs* are lists of
+``(field name, lookup, value)`` tuples, as returned by
+:meth:`stdnet.orm.query.QuerySet.aggregate`, for filtering and excluding objects.
+Objects match an ``"in"`` or a ``"unique"`` lookup if their field is equal to one
+of the values and a ``"range"`` lookup if the score of their field is within
+the bounds.
+It returns ``"all"`` if no filtering is required and *store* is ``False``,
+otherwise a :class:`QueryResult`.'''
+        raise NotImplementedError
+    
+    def query_ids(self, result, chunk_size):
+        '''Generator of ids in the :class:`QueryResult` *result*.'''
+        raise NotImplementedError
+    
+    def related_ids(self, meta, name, result):
+        '''Return a :class:`QueryResult` with the ids of the objects of model
+*meta* whose indexed field *name*, usually a :class:`stdnet.orm.ForeignKey`,
+is equal to one of the ids in the :class:`QueryResult` *result*. It is not
+added to the query results of the model, which are deleted when the model
+data changes.'''
+        raise NotImplementedError
+    
+    def delete_query(self, meta, result):
+        '''Delete the objects of model *meta* whose ids are in the
+:class:`QueryResult` *result*, together with their index entries,
+without loading them. Return the number of deleted objects.'''
+        raise NotImplementedError
+    
+    def increment(self, meta, ids, field, delta):
+        '''Increment the numeric *field* of objects of model *meta* by *delta*
+on the server, without loading them, and increment their version if the
+model is versioned. *ids* is a list of ids, a :class:`QueryResult` or
+``"all"``. Return a dictionary of the new serialized values keyed by id.'''
+        raise NotImplementedError
+    
+    def ordered_ids(self, meta, result, name, desc, start, stop):
+        '''Return a list of ids of objects in *result*, the value returned by
+:meth:`query`, sorted by the field *name*, which is either ``id`` or an
+:attr:`stdnet.orm.Field.ordered` field. Only ids from position *start* up to,
+but excluding, *stop* are returned. If *stop* is ``None`` all ids from
+*start* are returned.'''
+        raise NotImplementedError
+    
+    def _get_fields(self, meta, ids, fields):
+        '''Fetch *fields* of objects *ids* stored in separate hash tables.
+Return a list with, for each id, the list of field values or ``None`` if
+the object does not exist.'''
+        raise NotImplementedError
+    
+    def _discard_indexes(self, discards, batch):
+        '''Add commands removing index entries to *batch*. *discards* is a list of
+``(type, key, id)`` where *type* is ``"unique"``, ``"set"`` or ``"ordered"``.'''
+        raise NotImplementedError
+    
+    def _save_objects(self, objects, batch):
+        '''Add commands saving *objects* to *batch*. Backends which save
+objects with a single command queue them in the ``_objects`` list
+in :meth:`add_object`.'''
+        raise NotImplementedError
+    
+    def _invalidate(self, registries, batch):
+        '''Delete query results stored in *registries* since the model data
+has changed.'''
+        raise NotImplementedError
+    
+    def _set_keys(self, keys, batch):
+        raise NotImplementedError
+    
+    def batch(self):
+        '''Return an object which queues commands via its ``execute_command``
+method and sends them to the server when its ``execute`` method is called.'''
         raise NotImplementedError
             
     # DATASTRUCTURES
@@ -282,4 +673,10 @@ for a given *id*.'''
         pip = pipeline if pipeline is not None else self._get_pipe(id,'oset',timeout)
         return self.structure_module.OrderedSet(self, id, pip.pipe, **kwargs)
     
+    def ts(self, id, timeout = 0, pipeline = None, **kwargs):
+        '''Return an instance of :class:`stdnet.TS` structure
+for a given *id*.'''
+        pip = pipeline if pipeline is not None else self._get_pipe(id,'ts',timeout)
+        return self.structure_module.TS(self, id, pip.pipe, **kwargs)
+    
 
@@ -1,7 +1,8 @@
 from cgi import parse_qsl
+from threading import Lock
 
 from stdnet.conf import settings
-from stdnet.utils import import_module
+from stdnet.utils import import_module, HashRing
 from stdnet.exceptions import *
 
 
@@ -41,15 +42,57 @@ def parse_backend_uri(backend_uri):
     return scheme, host, params
 
 
-def getdb(backend_uri = None, pickler = None):
+_backends = {}
+_rings    = {}
+_lock     = Lock()
+
+
+def shard_uri(backend_uri, key):
+    '''If the host of *backend_uri* is a comma separated list of servers,
+return the uri of the server *key* is mapped to by consistent hashing,
+otherwise return *backend_uri*. For example, the key ``'stdnet:trade'`` is
+mapped to one of ``redis://10.0.0.1:6379/?db=1`` and ``redis://10.0.0.2:6379/?db=1``
+by::
+
+    shard_uri('redis://10.0.0.1:6379,10.0.0.2:6379/?db=1', 'stdnet:trade')
+'''
+    scheme, host, params = parse_backend_uri(backend_uri)
+    if ',' not in host:
+        return backend_uri
+    ring = _rings.get(host)
+    if ring is None:
+        ring = HashRing(s.strip() for s in host.split(',') if s.strip())
+        _rings[host] = ring
+    qpos  = backend_uri.find('?')
+    query = backend_uri[qpos:] if qpos != -1 else ''
+    return '%s://%s/%s' % (scheme,ring.get_node(key),query)
+
+
+def getdb(backend_uri = None, pickler = None, key = None):
+    '''Return a :class:`stdnet.BackendDataServer` for *backend_uri*.
+Backend instances are cached by uri and *pickler*, so that models
+registered with the same uri share the same instance and connections.
+Sharded uris, listing several servers, require a *key* used to
+select the server (see :func:`shard_uri`).'''
     backend_uri = backend_uri or settings.DEFAULT_BACKEND
     if not backend_uri:
         return None
-    scheme, host, params = parse_backend_uri(backend_uri)
-    if scheme in BACKENDS:
-        name = 'stdnet.backends.%s' % BACKENDS[scheme]
-    else:
-        name = scheme
-    module = import_module(name)
-    return getattr(module, 'BackendDataServer')(scheme, host, params, pickler = pickler)
+    if key is not None:
+        backend_uri = shard_uri(backend_uri, key)
+    key = (backend_uri,pickler)
+    _lock.acquire()
+    try:
+        backend = _backends.get(key)
+        if backend is None:
+            scheme, host, params = parse_backend_uri(backend_uri)
+            if scheme in BACKENDS:
+                name = 'stdnet.backends.%s' % BACKENDS[scheme]
+            else:
+                name = scheme
+            module = import_module(name)
+            backend = getattr(module, 'BackendDataServer')(scheme, host, params, pickler = pickler)
+            _backends[key] = backend
+        return backend
+    finally:
+        _lock.release()
 
@@ -1,6 +1,14 @@
+from hashlib import sha1
+from itertools import izip
+from uuid import uuid4
+from threading import Lock
+from timeit import default_timer
+
 import stdnet
-from stdnet.utils import jsonPickler
-from stdnet import BackendDataServer, ImproperlyConfigured, novalue
+from stdnet.utils import jsonPickler, chunks
+from stdnet import BackendDataServer, ImproperlyConfigured, FieldValueError,\
+                   StaleObjectError, novalue
+from stdnet.backends.base import QueryResult
 from stdnet.backends.structures import structredis
 
 try:
@@ -9,31 +17,790 @@ except:
     raise ImproperlyConfigured("Redis backend requires the 'redis' library. Do easy_install redis")
 
 
+# Evaluate a query and store the matched ids in the set KEYS[1], unless the set
+# is already available from an identical query. KEYS[2] is the set of query
+# results of the model and KEYS[3] the model table.
+# ARGV[1] is the expiry of the result, followed by the filter groups and the
+# exclude groups. Each group of lookups is encoded as the number of lookups
+# followed, for each lookup, by the number of index keys and the keys which
+# are united, by -1, an ordered index key and the minimum and maximum score
+# of a range, or by -2, the number of unique keys and the keys, whose ids are
+# united. Lookups in a group are intersected.
+QUERY_SCRIPT = '''
+local result, registry = KEYS[1], KEYS[2]
+local timeout = ARGV[1]
+if redis.call('exists', result) == 0 then
+    local pos, temps = 2, {}
+    local function lookups()
+        local keys = {}
+        local n = tonumber(ARGV[pos])
+        pos = pos + 1
+        for i = 1, n do
+            local m = tonumber(ARGV[pos])
+            local key = ARGV[pos + 1]
+            if m ~= 1 then
+                key = result .. ':' .. pos
+                temps[#temps + 1] = key
+                if m == -1 then
+                    local ids = redis.call('zrangebyscore', ARGV[pos + 1], ARGV[pos + 2], ARGV[pos + 3])
+                    for j = 1, #ids, 1000 do
+                        redis.call('sadd', key, unpack(ids, j, math.min(j + 999, #ids)))
+                    end
+                    m = 3
+                elseif m == -2 then
+                    -- unique keys are strings holding an id
+                    local n = tonumber(ARGV[pos + 1])
+                    if n > 0 then
+                        local ids = redis.call('mget', unpack(ARGV, pos + 2, pos + n + 1))
+                        for j = 1, n do
+                            if ids[j] then
+                                redis.call('sadd', key, ids[j])
+                            end
+                        end
+                    end
+                    m = n + 1
+                elseif m > 1 then
+                    redis.call('sunionstore', key, unpack(ARGV, pos + 1, pos + m))
+                end
+            end
+            keys[i] = key
+            pos = pos + m + 1
+        end
+        return keys
+    end
+    local filters = lookups()
+    local excludes = lookups()
+    if #filters > 0 then
+        redis.call('sinterstore', result, unpack(filters))
+    else
+        local ids = redis.call('hkeys', KEYS[3])
+        for i = 1, #ids, 1000 do
+            redis.call('sadd', result, unpack(ids, i, math.min(i + 999, #ids)))
+        end
+    end
+    if #excludes > 0 then
+        local exclude = result .. ':exclude'
+        temps[#temps + 1] = exclude
+        redis.call('sinterstore', exclude, unpack(excludes))
+        redis.call('sdiffstore', result, result, exclude)
+    end
+    if #temps > 0 then
+        redis.call('del', unpack(temps))
+    end
+    redis.call('sadd', registry, result)
+end
+redis.call('expire', result, timeout)
+redis.call('expire', registry, timeout)
+return redis.call('scard', result)
+'''
+
+# Delete the query results stored in the sets KEYS
+INVALIDATE_SCRIPT = '''
+for _, registry in ipairs(KEYS) do
+    local keys = redis.call('smembers', registry)
+    for i = 1, #keys, 1000 do
+        redis.call('del', unpack(keys, i, math.min(i + 999, #keys)))
+    end
+    redis.call('del', registry)
+end
+'''
+
+
+# Delete the lock KEYS[1] if it holds the token ARGV[1]
+UNLOCK_SCRIPT = '''
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+'''
+
+
+# Save or delete model instances in a single call. ARGV[1] is the model table
+# and ARGV[2] the number of instances which follow. Each instance is given by
+# its id, an action, either "save", "check" or "delete", the number of unique
+# index keys which follow and the keys. A check is a save which also fails
+# unless the version of the instance in the hash table given by the next
+# argument is equal to the one after it. Then come the number of commands and
+# the commands, each encoded as its name, the number of its arguments and the
+# arguments. Besides redis commands, "delif" deletes a unique index key if it
+# holds the id and "clear" deletes the query results stored in a registry.
+# Each instance is saved or deleted atomically: a save fails if one of its
+# unique keys holds the id of another instance, a delete does nothing if the
+# instance is not in the table. The commands of the instances are merged into
+# variadic commands, as long as the order of commands on each key is kept,
+# so that instances sharing index keys cost few commands. The number of saved
+# or deleted instances is returned, or the error of the first failed instance.
+OBJECT_SCRIPT = '''
+local tbl, n = ARGV[1], tonumber(ARGV[2])
+local objects, uniques = {}, {}
+local pos = 3
+for i = 1, n do
+    local obj = {id = ARGV[pos], action = ARGV[pos + 1]}
+    local m = tonumber(ARGV[pos + 2])
+    obj.first, obj.last = pos + 3, pos + 2 + m
+    for j = obj.first, obj.last do
+        uniques[#uniques + 1] = ARGV[j]
+    end
+    pos = obj.last + 1
+    if obj.action == 'check' then
+        obj.versions, obj.version = ARGV[pos], ARGV[pos + 1]
+        pos = pos + 2
+    end
+    m = tonumber(ARGV[pos])
+    pos = pos + 1
+    obj.ops = pos
+    for j = 1, m do
+        pos = pos + tonumber(ARGV[pos + 1]) + 2
+    end
+    obj.opsend = pos
+    objects[i] = obj
+end
+-- ids holding the unique keys
+local owners = {}
+for i = 1, #uniques, 1000 do
+    local last = math.min(i + 999, #uniques)
+    local ids = redis.call('mget', unpack(uniques, i, last))
+    for j = i, last do
+        owners[uniques[j]] = ids[j - i + 1]
+    end
+end
+local variadic = {sadd = 'sadd', srem = 'srem', zadd = 'zadd', zrem = 'zrem',
+                  hset = 'hmset', set = 'mset'}
+local commands, open, touched = {}, {}, {}
+local function queue(id, p)
+    local name, m = string.lower(ARGV[p]), tonumber(ARGV[p + 1])
+    local first, last = p + 2, p + 1 + m
+    local key = ARGV[first]
+    local vname = variadic[name]
+    local cmd
+    if vname then
+        local group = vname
+        if vname ~= 'mset' then
+            group = vname .. ':' .. key
+            first = first + 1
+        end
+        cmd = open[group]
+        if not cmd or (touched[key] or 0) > cmd.n or #cmd.args >= 2000 then
+            cmd = {name = vname, args = {}, n = #commands + 1}
+            if vname ~= 'mset' then
+                cmd.args[1] = key
+            end
+            commands[cmd.n] = cmd
+            open[group] = cmd
+        end
+        for j = first, last do
+            cmd.args[#cmd.args + 1] = ARGV[j]
+        end
+    else
+        cmd = {name = name, args = {unpack(ARGV, first, last)}, id = id, n = #commands + 1}
+        commands[cmd.n] = cmd
+        if name == 'delif' and owners[key] == id then
+            owners[key] = false
+        end
+    end
+    touched[key] = cmd.n
+    return p + m + 2
+end
+local done, err = 0, nil
+for i, obj in ipairs(objects) do
+    local id, ok = obj.id, true
+    if obj.action == 'delete' then
+        ok = redis.call('hdel', tbl, id) == 1
+    else
+        if obj.action == 'check' then
+            local version = redis.call('hget', obj.versions, id) or ''
+            if version ~= obj.version then
+                ok = false
+                err = err or 'VERSION ' .. tbl .. ':' .. id
+            end
+        end
+        for j = obj.first, obj.last do
+            local owner = owners[ARGV[j]]
+            if ok and owner and owner ~= id then
+                ok = false
+                err = err or 'UNIQUE ' .. ARGV[j]
+            end
+        end
+        if ok then
+            for j = obj.first, obj.last do
+                owners[ARGV[j]] = id
+            end
+        end
+    end
+    if ok then
+        done = done + 1
+        local p = obj.ops
+        while p < obj.opsend do
+            p = queue(id, p)
+        end
+    end
+end
+for i, cmd in ipairs(commands) do
+    local name, args = cmd.name, cmd.args
+    if name == 'delif' then
+        if redis.call('get', args[1]) == cmd.id then
+            redis.call('del', args[1])
+        end
+    elseif name == 'clear' then
+        local keys = redis.call('smembers', args[1])
+        for j = 1, #keys, 1000 do
+            redis.call('del', unpack(keys, j, math.min(j + 999, #keys)))
+        end
+        redis.call('del', args[1])
+    else
+        redis.call(name, unpack(args))
+    end
+end
+if err then
+    return redis.error_reply(err)
+end
+return done
+'''
+
+
+# Store in the set KEYS[1] the union of the index sets ARGV[1]..id for each
+# id in the set KEYS[2], that is the ids of objects referring to them by the
+# indexed field whose index keys start with ARGV[1]. ARGV[2] is the expiry
+# of KEYS[1]. Return the number of ids in KEYS[1].
+RELATED_SCRIPT = '''
+local ids = redis.call('smembers', KEYS[2])
+local keys = {}
+for i, id in ipairs(ids) do
+    keys[#keys + 1] = ARGV[1] .. id
+    if #keys == 1000 or i == #ids then
+        redis.call('sunionstore', KEYS[1], KEYS[1], unpack(keys))
+        keys = {}
+    end
+end
+redis.call('expire', KEYS[1], ARGV[2])
+return redis.call('scard', KEYS[1])
+'''
+
+# Delete the objects whose ids are in the set KEYS[1] from the model table
+# KEYS[2] and delete the query results of the model stored in KEYS[3].
+# ARGV[1] is the prefix of the keys of an object and ARGV[2] is "hash" if the
+# fields of an object are stored in the hash table ARGV[1]:id. Six groups
+# of arguments follow, each encoded as its size followed by its values:
+# the index fields to decode, each given by its name, its position in the row
+# and "u" if it is unique, the names of data-structure fields, the keys of
+# ordered indexes, the keys of hash tables keyed by id, the keys of index sets,
+# from which ids are removed by difference with KEYS[1], and the unique keys,
+# which are deleted if they hold one of the ids.
+# Values of index fields are decoded from rows of the binary row codec to
+# find more index sets and unique keys. If a value cannot be decoded the
+# script fails with an "UNDECODED" error before deleting anything.
+# KEYS[1] is deleted too. Return the number of deleted objects.
+DELETE_QUERY_SCRIPT = '''
+local victims, tbl, prefix = KEYS[1], KEYS[2], ARGV[1]
+local ids = redis.call('smembers', victims)
+local count, pos = 0, 3
+local function group()
+    local first, last = pos + 1, pos + tonumber(ARGV[pos])
+    pos = last + 1
+    return first, last
+end
+local sizes = {i = 'i4', q = 'i8', d = 'd', s = 'I2', S = 'I4', u = 'I2', U = 'I4', p = 'I4'}
+local strings = {s = true, S = true, u = true, U = true}
+local constants = {n = 'None', t = 'True', f = 'False'}
+-- the values of a binary row as formatted by python in index keys, false
+-- for values which cannot be formatted, or nil if the row is pickled
+local function decode(row)
+    if string.byte(row, 1) ~= 0 then
+        return nil
+    end
+    local n = string.byte(row, 2)
+    local codes, fmt = string.sub(row, 3, 2 + n), '>'
+    for i = 1, n do
+        fmt = fmt .. (sizes[string.sub(codes, i, i)] or '')
+    end
+    local packed = {struct.unpack(fmt, row, 3 + n)}
+    local p, j, values = table.remove(packed), 1, {}
+    for i = 1, n do
+        local code = string.sub(codes, i, i)
+        local value = packed[j]
+        if constants[code] then
+            values[i] = constants[code]
+        else
+            j = j + 1
+            if strings[code] then
+                values[i] = string.sub(row, p, p + value - 1)
+                p = p + value
+            elseif code == 'p' then
+                values[i] = false
+                p = p + value
+            elseif code == 'd' then
+                local s = string.format('%.12g', value)
+                if not string.find(s, '[%.eni]') then
+                    s = s .. '.0'
+                end
+                values[i] = s
+            elseif math.abs(value) < 2^53 then
+                values[i] = string.format('%d', value)
+            else
+                values[i] = false
+            end
+        end
+    end
+    return values
+end
+local sets, uniques = {}, {}
+local first, last = group()
+if last >= first then
+    for _, id in ipairs(ids) do
+        local row = redis.call('hget', tbl, id)
+        if row then
+            local values = ARGV[2] ~= 'hash' and decode(row)
+            for j = first, last, 3 do
+                local value
+                if ARGV[2] == 'hash' then
+                    local field = redis.call('hget', prefix .. ':' .. id, ARGV[j])
+                    value = field and decode(field)
+                    value = value and value[1]
+                    if field == false then
+                        value = 'None'
+                    end
+                elseif values then
+                    value = values[tonumber(ARGV[j + 1])]
+                    if value == nil then
+                        value = 'None'
+                    end
+                end
+                if not value then
+                    return redis.error_reply('UNDECODED ' .. id)
+                end
+                local key = tbl .. ':' .. ARGV[j] .. ':' .. value
+                if ARGV[j + 2] == 'u' then
+                    uniques[key] = true
+                else
+                    sets[key] = true
+                end
+            end
+        end
+    end
+end
+for i = 1, #ids, 1000 do
+    count = count + redis.call('hdel', KEYS[2], unpack(ids, i, math.min(i + 999, #ids)))
+end
+local first, last = group()
+for _, id in ipairs(ids) do
+    local key = prefix .. ':' .. id
+    if ARGV[2] == 'hash' then
+        redis.call('del', key)
+    end
+    for j = first, last do
+        redis.call('del', key .. ':' .. ARGV[j])
+    end
+end
+first, last = group()
+for j = first, last do
+    for i = 1, #ids, 1000 do
+        redis.call('zrem', ARGV[j], unpack(ids, i, math.min(i + 999, #ids)))
+    end
+end
+first, last = group()
+for j = first, last do
+    for i = 1, #ids, 1000 do
+        redis.call('hdel', ARGV[j], unpack(ids, i, math.min(i + 999, #ids)))
+    end
+end
+first, last = group()
+for j = first, last do
+    sets[ARGV[j]] = true
+end
+for key in pairs(sets) do
+    redis.call('sdiffstore', key, key, victims)
+end
+first, last = group()
+for j = first, last do
+    uniques[ARGV[j]] = true
+end
+for key in pairs(uniques) do
+    local owner = redis.call('get', key)
+    if owner and redis.call('sismember', victims, owner) == 1 then
+        redis.call('del', key)
+    end
+end
+local keys = redis.call('smembers', KEYS[3])
+for i = 1, #keys, 1000 do
+    redis.call('del', unpack(keys, i, math.min(i + 999, #keys)))
+end
+redis.call('del', KEYS[3], victims)
+return count
+'''
+
+
+# Increment numeric fields of objects encoded with the binary row codec.
+# ARGV[1] is the model table, ARGV[2] "hash" if the fields of an object are
+# stored in the hash table ARGV[3]:id, otherwise "row", ARGV[4] the set of
+# query results of the model, deleted when indexes change, or '', and ARGV[5]
+# the hash table of versions of objects, or ''. ARGV[6] is the number of
+# fields to increment, each given by six arguments: its name, its position
+# in the row, the increment, "d" for floats or "i" for integers, the key of
+# its ordered index, which is also the prefix of the keys of its index sets,
+# and a string containing "i" if it is indexed in sets and "o" if it is
+# ordered. The ids of the
+# objects follow, given by "all", by "set" and the key of a set of ids, or
+# by "ids" and the ids. All rows are checked before any is written.
+# Return a list of ids followed by the new value of the first field.
+INCREMENT_SCRIPT = '''
+local tbl, storage, prefix, registry, versions = ARGV[1], ARGV[2], ARGV[3], ARGV[4], ARGV[5]
+local sizes = {i = 'i4', q = 'i8', d = 'd', s = 'I2', S = 'I4', u = 'I2', U = 'I4', p = 'I4'}
+local numbers = {i = true, q = true, d = true, n = true}
+local function decode(row)
+    if not row then
+        return {codes = {}, values = {}, rest = ''}
+    end
+    if string.byte(row, 1) ~= 0 then
+        return nil
+    end
+    local n = string.byte(row, 2)
+    local codes, fmt = {}, '>'
+    for i = 1, n do
+        codes[i] = string.sub(row, 2 + i, 2 + i)
+        fmt = fmt .. (sizes[codes[i]] or '')
+    end
+    local packed = {struct.unpack(fmt, row, 3 + n)}
+    local rest = string.sub(row, table.remove(packed))
+    local values, j = {}, 1
+    for i = 1, n do
+        if sizes[codes[i]] then
+            values[i] = packed[j]
+            j = j + 1
+        end
+    end
+    return {codes = codes, values = values, rest = rest}
+end
+local function encode(row)
+    local fmt, packed = '>', {}
+    for i, code in ipairs(row.codes) do
+        if sizes[code] then
+            fmt = fmt .. sizes[code]
+            packed[#packed + 1] = row.values[i]
+        end
+    end
+    return '\0' .. string.char(#row.codes) .. table.concat(row.codes) ..
+           struct.pack(fmt, unpack(packed)) .. row.rest
+end
+-- the string of a value in index keys, as formatted by python
+local function pystr(value, code)
+    if code == 'n' then
+        return 'None'
+    elseif code == 'd' then
+        local s = string.format('%.12g', value)
+        if not string.find(s, '[%.eni]') then
+            s = s .. '.0'
+        end
+        return s
+    end
+    return string.format('%d', value)
+end
+local fields, pos = {}, 7
+for f = 1, tonumber(ARGV[6]) do
+    fields[f] = {name = ARGV[pos], pos = tonumber(ARGV[pos + 1]),
+                 delta = tonumber(ARGV[pos + 2]), code = ARGV[pos + 3],
+                 key = ARGV[pos + 4], index = string.find(ARGV[pos + 5], 'i') ~= nil,
+                 ordered = string.find(ARGV[pos + 5], 'o') ~= nil}
+    pos = pos + 6
+end
+local ids = {}
+if ARGV[pos] == 'all' then
+    ids = redis.call('hkeys', tbl)
+elseif ARGV[pos] == 'set' then
+    ids = redis.call('smembers', ARGV[pos + 1])
+else
+    for i = pos + 1, #ARGV do
+        ids[#ids + 1] = ARGV[i]
+    end
+end
+local objects = {}
+for _, id in ipairs(ids) do
+    if redis.call('hexists', tbl, id) == 1 then
+        local rows = {}
+        for f, field in ipairs(fields) do
+            local row
+            if storage == 'hash' then
+                row = decode(redis.call('hget', prefix .. ':' .. id, field.name))
+            else
+                row = rows[1] or decode(redis.call('hget', tbl, id))
+            end
+            if not row or not numbers[row.codes[field.pos] or 'n'] then
+                return redis.error_reply('NOTNUMERIC ' .. field.name .. ' ' .. id)
+            end
+            rows[f] = row
+        end
+        objects[#objects + 1] = {id = id, rows = rows}
+    end
+end
+local result = {}
+for _, obj in ipairs(objects) do
+    local id, first = obj.id, nil
+    for f, field in ipairs(fields) do
+        local row = obj.rows[f]
+        for i = #row.codes + 1, field.pos do
+            row.codes[i] = 'n'
+        end
+        local code = row.codes[field.pos]
+        local old = row.values[field.pos]
+        local value = (old or 0) + field.delta
+        local newcode = 'd'
+        if field.code ~= 'd' then
+            newcode = (value >= -2147483648 and value < 2147483648) and 'i' or 'q'
+        end
+        row.codes[field.pos] = newcode
+        row.values[field.pos] = value
+        if field.index then
+            redis.call('srem', field.key .. ':' .. pystr(old, code), id)
+            redis.call('sadd', field.key .. ':' .. pystr(value, newcode), id)
+        end
+        if field.ordered then
+            redis.call('zadd', field.key, value, id)
+        end
+        if storage == 'hash' then
+            redis.call('hset', prefix .. ':' .. id, field.name, encode(row))
+        end
+        first = first or value
+    end
+    if storage ~= 'hash' then
+        redis.call('hset', tbl, id, encode(obj.rows[1]))
+    end
+    if versions ~= '' then
+        redis.call('hincrby', versions, id, 1)
+    end
+    result[#result + 1] = id
+    result[#result + 1] = string.format('%.17g', first)
+end
+if registry ~= '' and #result > 0 then
+    local keys = redis.call('smembers', registry)
+    for i = 1, #keys, 1000 do
+        redis.call('del', unpack(keys, i, math.min(i + 999, #keys)))
+    end
+    redis.call('del', registry)
+end
+return result
+'''
+
+
+def scorebound(bound, default):
+    '''Convert a ``(score, inclusive)`` *bound* into a redis score interval limit'''
+    if bound is None:
+        return default
+    score,inclusive = bound
+    return repr(score) if inclusive else '(%r' % score
+
+
+class RedisBatch(object):
+    '''Queue redis commands into a pipeline which is sent to the server when
+:meth:`execute` is called. If *batch_size* is positive, the pipeline is
+flushed every *batch_size* commands so that huge commits are sent in chunks
+rather than buffered whole. When *transaction* is ``True`` each chunk is
+wrapped in a ``MULTI``/``EXEC`` block.'''
+    def __init__(self, redispy, transaction = False, batch_size = 0):
+        self.redispy    = redispy
+        self.pipe       = redispy.pipeline(transaction = transaction)
+        self.batch_size = batch_size
+        self.results    = []
+        self.scripts    = {}
+        self.size       = 0
+        
+    def execute_command(self, *args):
+        '''Queue a command. Its result is only available once the batch
+is executed, therefore ``0`` is returned.'''
+        self.pipe.execute_command(*args)
+        self.size += 1
+        if self.batch_size and self.size >= self.batch_size:
+            self.flush()
+        return 0
+        
+    def script(self, script, keys = (), args = ()):
+        '''Queue the ``EVALSHA`` of *script*, a script returned by the
+``register_script`` method of the redis client. Unlike ``EVAL``, the
+script source is sent to the server only when it is not already cached
+there.'''
+        self.scripts[script.sha] = script
+        return self.execute_command('EVALSHA', script.sha, len(keys),
+                                    *(tuple(keys) + tuple(args)))
+        
+    def flush(self):
+        if self.size:
+            commands = [args for args,options in self.pipe.command_stack]
+            results  = self.pipe.execute(raise_on_error = False)
+            self.size = 0
+            for n,result in enumerate(results):
+                if isinstance(result,redis.exceptions.NoScriptError):
+                    # load the script and run the command again
+                    args = commands[n]
+                    self.redispy.script_load(self.scripts[args[1]].script)
+                    try:
+                        results[n] = self.redispy.execute_command(*args)
+                    except redis.ResponseError, e:
+                        results[n] = e
+            self.results.extend(results)
+    
+    def execute(self):
+        '''Send queued commands to the server and return the list
+of results. The first error returned by the server, if any, is raised
+once all commands have been executed.'''
+        self.flush()
+        for result in self.results:
+            if isinstance(result,Exception):
+                raise result
+        return self.results
+
+
+_pools     = {}
+_pools_lock = Lock()
+
+
+def connection_pool(host, port, db, max_connections, socket_timeout):
+    '''Return a connection pool shared by backends connecting to the
+same redis database. The pool holds at most *max_connections* connections.
+Each command or pipeline checks out a connection and a thread waits for
+a connection to be released if all of them are in use.'''
+    key = (host,port,db,max_connections,socket_timeout)
+    _pools_lock.acquire()
+    try:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = redis.BlockingConnectionPool(max_connections = max_connections,
+                                                host = host, port = port, db = db,
+                                                socket_timeout = socket_timeout)
+            _pools[key] = pool
+        return pool
+    finally:
+        _pools_lock.release()
+
+
+def hostport(server):
+    '''Split *server* into host and port'''
+    servs = server.split(':')
+    port  = 6379
+    if len(servs) == 2:
+        port = int(servs[1])
+    return servs[0], port
+
+
+class Replicas(object):
+    '''Read-only replicas of a redis server. Reads are sent to a replica
+chosen in turn (*routing* ``"round_robin"``) or to the replica with
+the smallest average response time (*routing* ``"latency"``).'''
+    def __init__(self, clients, routing = 'round_robin'):
+        if routing not in ('round_robin','latency'):
+            raise ImproperlyConfigured('Unknown replica routing %s' % routing)
+        self.clients = clients
+        self.routing = routing
+        self.latency = [0.0]*len(clients)
+        self._next   = 0
+        self._lock   = Lock()
+        
+    def __len__(self):
+        return len(self.clients)
+        
+    def choose(self):
+        '''Return the index of the replica to use for the next read.'''
+        if self.routing == 'latency':
+            latency = self.latency
+            return min(xrange(len(latency)), key = latency.__getitem__)
+        self._lock.acquire()
+        try:
+            n = self._next
+            self._next = (n + 1) % len(self.clients)
+            return n
+        finally:
+            self._lock.release()
+        
+    def client(self):
+        return self.clients[self.choose()]
+    
+    def execute_command(self, *args):
+        n  = self.choose()
+        t1 = default_timer()
+        result = self.clients[n].execute_command(*args)
+        # exponentially weighted average of response times
+        dt = default_timer() - t1
+        latency = self.latency[n]
+        self.latency[n] = 0.8*latency + 0.2*dt if latency else dt
+        return result
+    
+
 class BackendDataServer(stdnet.BackendDataServer):
+    '''Redis backend. Besides the parameters of :class:`stdnet.BackendDataServer`
+it recognises:
 
+* *replicas* comma separated list of ``host:port`` of read-only replicas
+  of the server. Reads are sent to them unless in a :meth:`using_primary`
+  block.
+* *replica_routing* ``"round_robin"`` (default) or ``"latency"``, see :class:`Replicas`.
+'''
     structure_module = structredis
     def __init__(self, name, server, params, **kwargs):
         super(BackendDataServer,self).__init__(name,
                                                params,
                                                **kwargs)
-        servs = server.split(':')
-        server = servs[0]
-        port   = 6379
-        if len(server) == 2:
-            port = int(servs[1])
-        self.db              = self.params.pop('db',0)
-        redispy              = redis.Redis(host = server, port = port, db = self.db)
+        server, port         = hostport(server)
+        self.db              = int(self.params.pop('db',0))
+        self.transaction     = self.params.pop('transaction','0') not in ('0','false','False')
+        try:
+            self.variadic_size = int(self.params.pop('variadic_size',1000))
+        except (ValueError, TypeError):
+            self.variadic_size = 1000
+        max_connections      = int(self.params.pop('max_connections',50))
+        socket_timeout       = self.params.pop('socket_timeout',None)
+        if socket_timeout is not None:
+            socket_timeout   = float(socket_timeout)
+        pool = connection_pool(server, port, self.db, max_connections, socket_timeout)
+        redispy              = redis.Redis(connection_pool = pool)
+        replicas             = self.params.pop('replicas',None)
+        routing              = self.params.pop('replica_routing','round_robin')
+        self.replicas        = None
+        if replicas:
+            clients = []
+            for replica in replicas.split(','):
+                host, rport = hostport(replica.strip())
+                rpool = connection_pool(host, rport, self.db, max_connections, socket_timeout)
+                clients.append(redis.Redis(connection_pool = rpool))
+            self.replicas = Replicas(clients, routing)
         self.redispy         = redispy
         self.execute_command = redispy.execute_command
         self.incr            = redispy.incr
-        self.clear           = redispy.flushdb
         self.sinter          = redispy.sinter
         self.delete          = redispy.delete
         self.keys            = redispy.keys
+        self._query_script   = redispy.register_script(QUERY_SCRIPT)
+        self._unlock_script  = redispy.register_script(UNLOCK_SCRIPT)
+        self._object_script  = redispy.register_script(OBJECT_SCRIPT)
+        self._related_script = redispy.register_script(RELATED_SCRIPT)
+        self._delete_script  = redispy.register_script(DELETE_QUERY_SCRIPT)
+        self._incr_script    = redispy.register_script(INCREMENT_SCRIPT)
+        self._ts_add_script  = redispy.register_script(structredis.TS_ADD_SCRIPT)
     
     def __repr__(self):
         return '%s backend' % self.__name
     
+    def read_command(self, *args):
+        '''Execute the read-only command *args* on a replica, if available
+and not in a :meth:`using_primary` block, otherwise on the server.'''
+        if self.replicas is None or self._primary:
+            return self.execute_command(*args)
+        return self.replicas.execute_command(*args)
+    
+    def reader(self):
+        '''The redis client used for reads, see :meth:`read_command`.'''
+        if self.replicas is None or self._primary:
+            return self.redispy
+        return self.replicas.client()
+    
+    def batch(self):
+        return RedisBatch(self.redispy, self.transaction, self.batch_size)
+    
+    def script(self, script, keys = (), args = ()):
+        '''Run *script*, a script returned by the ``register_script`` method of
+the redis client, as :meth:`RedisBatch.script` does in a batch.'''
+        return script(keys = keys, args = args)
+    
+    def clear(self):
+        self.object_cache.clear()
+        return self.redispy.flushdb()
+    
     def set_timeout(self, id, timeout):
         timeout = timeout or self.default_timeout
         if timeout:
@@ -49,27 +816,433 @@ class BackendDataServer(stdnet.BackendDataServer):
             return self.execute_command('SET', id, value)
     
     def _get(self, id):
-        return self.execute_command('GET', id)
+        return self.read_command('GET', id)
+    
+    def lock(self, id, timeout):
+        token = uuid4().hex
+        if self.execute_command('SET', id, token, 'NX', 'EX', int(timeout)):
+            return token
+        
+    def unlock(self, id, token):
+        return bool(self._unlock_script(keys = (id,), args = (token,)))
+    
+    def add_object(self, obj, data, indexes, commit = True, fields = None,
+                   discards = None, version = None, check_version = False):
+        '''Save *obj*, see :meth:`stdnet.BackendDataServer.add_object`.
+The table row, the unique keys and the index entries of the object are
+written by a server script which checks first that unique keys are not
+taken by other objects. Therefore each object is saved atomically, even
+when its unique keys are in use, and a failed uniqueness check raises
+:class:`stdnet.FieldValueError` at commit. At commit, objects of a model are
+sent to the script in groups of ``variadic_size`` objects, whose index
+entries are written with variadic commands.
+Versions of objects are also kept in the hash table ``versions`` of the
+model, so that the script can compare them when *check_version* is ``True``
+and raise :class:`stdnet.StaleObjectError` on a mismatch.'''
+        meta    = obj._meta
+        timeout = meta.timeout
+        bkey    = meta.basekey
+        objid   = obj.id
+        codec   = meta.codec
+        uniques = []
+        ops     = []
+        if meta.storage == 'hash':
+            ops.append(('HSET', bkey(), objid, codec.dumps([])))
+            items = []
+            for field,value in izip(fields or meta.fields, data):
+                items.append(field.name)
+                items.append(codec.dumps_value(value))
+            if items:
+                ops.append(('HMSET', meta.objkey(objid)) + tuple(items))
+        else:
+            ops.append(('HSET', bkey(), objid, codec.dumps(data)))
+        check = ()
+        if version is not None:
+            ops.append(('HSET', bkey('versions'), objid, version))
+            if check_version:
+                check = (bkey('versions'), version - 1 if version > 1 else '')
+        key = self._forget(obj)
+        self._saved.add(key)
+        identity = getattr(self._local,'identity',None)
+        if identity is not None:
+            identity[key] = obj
+        
+        for field,value in indexes:
+            if field.index:
+                key = bkey(field.name,value)
+                if field.unique:
+                    uniques.append(key)
+                    ops.append(('SET', key, objid))
+                    if timeout:
+                        ops.append(('EXPIRE', key, timeout))
+                else:
+                    ops.append(('SADD', key, objid))
+            if field.ordered and value is not None:
+                ops.append(('ZADD', bkey(field.name), field.scorefun(value), objid))
+        
+        # Remove index entries of previous values
+        new = dict(((field.name,value) for field,value in indexes))
+        for field,value in discards or ():
+            name = field.name
+            if field.index:
+                key = bkey(name,value)
+                if key != bkey(name,new.get(name)):
+                    if field.unique:
+                        ops.append(('delif', key))
+                    else:
+                        ops.append(('SREM', key, objid))
+            if field.ordered and value is not None and new.get(name) is None:
+                ops.append(('ZREM', bkey(name), objid))
+        
+        action = 'check' if check else 'save'
+        # keep the snapshot of the server data taken before this save
+        self._objects.append((obj,self._script_args(objid, action, uniques, ops, check),
+                              obj.__dict__.get('_dbdata')))
+        self._queries.add(bkey('queries'))
+        if commit:
+            self.commit()
+            
+    def commit(self):
+        objects = self._objects
+        try:
+            return super(BackendDataServer,self).commit()
+        except redis.ResponseError, e:
+            msg = str(e)
+            if not msg.startswith('UNIQUE ') and not msg.startswith('VERSION '):
+                raise
+            # objects saved with the failed command are unknown. Restore the
+            # snapshots taken before they were saved so that saving them again
+            # writes their changes.
+            for obj,args,dbdata in reversed(objects):
+                self._forget(obj)
+                if dbdata is None:
+                    obj.__dict__.pop('_dbdata',None)
+                else:
+                    obj._dbdata = dbdata
+                version = obj._meta.version
+                if version is not None:
+                    setattr(obj,version.attname,dbdata.get(version.name) if dbdata else None)
+            if msg.startswith('VERSION '):
+                raise StaleObjectError('Object %s was saved by someone else' % msg[8:])
+            raise FieldValueError('Unique key %s is taken by another instance' % msg[7:])
+            
+    def delete_object(self, obj, deleted = None):
+        '''Delete *obj* and its index entries with a single atomic call
+of the script used by :meth:`add_object`.'''
+        meta   = obj._meta
+        bkey   = meta.basekey
+        objid  = obj.id
+        ops    = []
+        self._forget(obj)
+        if meta.storage == 'hash':
+            ops.append(('DEL', meta.objkey(objid)))
+        dbdata = obj.__dict__.get('_dbdata') or {}
+        for field in meta.fields:
+            name = field.name
+            if field.index:
+                if name in dbdata:
+                    value = dbdata[name]
+                else:
+                    value = field.serialize(getattr(obj,field.attname,None))
+                key = bkey(name,value)
+                if field.unique:
+                    ops.append(('delif', key))
+                else:
+                    ops.append(('SREM', key, objid))
+            if field.ordered:
+                ops.append(('ZREM', bkey(name), objid))
+            fid = field.id(obj)
+            if fid:
+                ops.append(('DEL', fid))
+        for field in meta.multifields:
+            ops.append(('DEL', field.id(obj)))
+        if meta.version is not None:
+            ops.append(('HDEL', bkey('versions'), objid))
+        ops.append(('clear', bkey('queries')))
+        args   = [bkey(),1] + self._script_args(objid, 'delete', (), ops)
+        result = self._object_script(args = args)
+        if deleted is not None:
+            deleted.append(result)
+        return result
+    
+    def _script_args(self, id, action, uniques, ops, check = ()):
+        args = [id, action, len(uniques)]
+        args.extend(uniques)
+        args.extend(check)
+        args.append(len(ops))
+        for op in ops:
+            args.append(op[0])
+            args.append(len(op) - 1)
+            args.extend(op[1:])
+        return args
+    
+    def get_ids(self, meta, name, values):
+        if name == 'id' or not values:
+            return super(BackendDataServer,self).get_ids(meta, name, values)
+        bkey = meta.basekey
+        return self.read_command('MGET', *[bkey(name,value) for value in values])
             
-    def query(self, meta, fargs, eargs):
-        '''Query a model table'''
-        qset = None
-        if fargs:
-            skeys = [meta.basekey(name,value) for name,value in fargs.iteritems()]
-            qset  = self.sinter(skeys)
-        if eargs:
-            skeys = [meta.basekey(name,value) for name,value in fargs.iteritems()]
-            eset  = self.sinter(skeys)
-            if not qset:
-                qset = set(hash(meta.basekey()).keys())
-            return qset.difference(eset)
+    def query(self, meta, fargs, eargs, store = False):
+        '''Query a model table. Intersections, unions and differences of index sets
+are evaluated on the server by a script which stores the result in a temporary
+set. The set expires after ``query_timeout`` seconds and is shared by identical
+queries until then or until the model data changes. If *store* is ``True``
+the temporary set is created even when no filtering is required.'''
+        if not fargs and not eargs and not store:
+            return 'all'
+        bkey = meta.basekey
+        args = []
+        for lookups in (fargs, eargs):
+            lookups = lookups or ()
+            args.append(len(lookups))
+            for name,lookup,value in sorted(lookups):
+                if lookup == 'range':
+                    low,high = value
+                    args.extend((-1,bkey(name),scorebound(low,'-inf'),scorebound(high,'+inf')))
+                else:
+                    keys = sorted(set((bkey(name,v) for v in value)))
+                    if lookup == 'unique':
+                        args.extend((-2,len(keys)))
+                    else:
+                        args.append(len(keys))
+                    args.extend(keys)
+        id       = bkey('queries',sha1(repr(args)).hexdigest())
+        registry = bkey('queries')
+        query    = ((id,registry,bkey()), [self.query_timeout] + args)
+        size     = self._query_script(keys = query[0], args = query[1])
+        return QueryResult(self, id, registry, size, query)
+    
+    def _renew(self, result, pipe):
+        '''Queue into the transaction *pipe* the commands which make sure the set
+of *result* is available. Writes to the model delete query results and they
+expire after ``query_timeout`` seconds: the query script reuses the set if it
+is still available, otherwise it evaluates the query again. The expiry of
+results without a query is renewed.'''
+        if result.query is not None:
+            keys, args = result.query
+            self._query_script(keys = keys, args = args, client = pipe)
+        else:
+            pipe.expire(result.id, self.query_timeout)
+    
+    def query_ids(self, result, chunk_size):
+        '''Page over the result set with ``SSCAN``. The set is renewed before
+every page, in the same transaction, so that long iterations and writes to
+the model do not lose the result.'''
+        id     = result.id
+        cursor = 0
+        while True:
+            pipe = self.redispy.pipeline(transaction = True)
+            self._renew(result, pipe)
+            pipe.sscan(id, cursor, count = chunk_size)
+            cursor, ids = pipe.execute()[1]
+            for oid in ids:
+                yield oid
+            if not cursor:
+                break
+    
+    def related_ids(self, meta, name, result):
+        '''The union of the index sets of field *name* is evaluated by a
+script when *result* is stored in the same server, otherwise ids are
+fetched in chunks and the union is sent with pipelined ``SUNIONSTORE``.'''
+        id = meta.basekey('queries',uuid4().hex)
+        if result.cursor is self:
+            size = self._related_script(keys = (id,result.id),
+                                        args = (meta.basekey(name,''),self.query_timeout))
+        else:
+            pipe = self.redispy.pipeline(transaction = False)
+            for ids in chunks(result.ids(1000),1000):
+                pipe.sunionstore(id, [id] + [meta.basekey(name,rid) for rid in ids])
+            pipe.expire(id, self.query_timeout)
+            pipe.scard(id)
+            size = pipe.execute()[-1]
+        return QueryResult(self, id, None, size)
+    
+    def delete_query(self, meta, result):
+        '''Objects are deleted by a single script call. With the
+:class:`stdnet.orm.BinaryRowCodec` the script decodes the values of index
+fields from the rows, or from the fields tables of objects for ``"hash"``
+storage, to find the index sets and the unique keys holding the ids, so
+that no object data is transferred. Rows pickled by previous versions
+cannot be decoded by the script: in this case, and with other codecs, the
+values of index fields are read first, in chunks, and the keys are passed
+to the script. Ordered indexes, data-structure fields and, for ``"hash"``
+storage, the fields tables of objects are cleaned up without reading any
+data.'''
+        from stdnet.orm.codec import BinaryRowCodec
+        bkey    = meta.basekey
+        indexes = [field for field in meta.fields if field.index]
+        keys    = (result.id,bkey(),bkey('queries'))
+        # deleted objects are not known, forget all objects of the model
+        table = bkey()
+        cache = self.object_cache
+        for key in [key for key in cache.keys() if key[0] == table]:
+            cache.discard(key)
+        identity = getattr(self._local,'identity',None)
+        if identity:
+            for key in [key for key in identity if key[0] == table]:
+                del identity[key]
+        if isinstance(meta.codec,BinaryRowCodec):
+            fields = []
+            for field in indexes:
+                pos = 1 if meta.storage == 'hash' else meta.fields.index(field) + 1
+                fields.extend((field.name, pos, 'u' if field.unique else ''))
+            try:
+                return self._delete_script(keys = keys,
+                                           args = self._delete_args(meta, fields))
+            except redis.ResponseError, e:
+                if not str(e).startswith('UNDECODED '):
+                    raise
+        sets    = set()
+        uniques = set()
+        if indexes:
+            with self.using_primary():
+                for ids in chunks(result.ids(1000),1000):
+                    fields, rows = self.get_rows(meta, ids, indexes)
+                    pos = [(field,fields.index(field)) for field in indexes]
+                    for row in rows:
+                        if row is not None:
+                            for field,n in pos:
+                                key = bkey(field.name,row[n])
+                                if field.unique:
+                                    uniques.add(key)
+                                else:
+                                    sets.add(key)
+        return self._delete_script(keys = keys,
+                                   args = self._delete_args(meta, (), sets, uniques))
+    
+    def _delete_args(self, meta, fields, sets = (), uniques = ()):
+        bkey = meta.basekey
+        args = [bkey('id'), meta.storage]
+        for group in (fields,
+                      [field.name for field in meta.multifields],
+                      [bkey(field.name) for field in meta.fields if field.ordered],
+                      [bkey('versions')] if meta.version is not None else [],
+                      sets, uniques):
+            args.append(len(group))
+            args.extend(group)
+        return args
+    
+    def increment(self, meta, ids, field, delta):
+        '''A script decodes the rows of objects, increments the field and
+writes them back, updating the indexes of the field, in a single
+atomic call. Integers are incremented as double precision numbers,
+exact up to 2**53.'''
+        bkey    = meta.basekey
+        hashed  = meta.storage == 'hash'
+        changes = [(field,delta)]
+        if meta.version is not None:
+            changes.append((meta.version,1))
+        args = [bkey(), meta.storage, bkey('id'),
+                bkey('queries') if field.index or field.ordered else '',
+                bkey('versions') if meta.version is not None else '',
+                len(changes)]
+        for fld,dt in changes:
+            flags = ('i' if fld.index else '') + ('o' if fld.ordered else '')
+            pos   = 1 if hashed else meta.fields.index(fld) + 1
+            args.extend((fld.name, pos, dt,
+                         'd' if fld.type == 'float' else 'i',
+                         bkey(fld.name), flags))
+        if ids == 'all':
+            args.append('all')
+        elif isinstance(ids,QueryResult):
+            args.extend(('set',ids.id))
+        else:
+            args.append('ids')
+            args.extend(ids)
+        try:
+            result = self._incr_script(args = args)
+        except redis.ResponseError, e:
+            if str(e).startswith('NOTNUMERIC '):
+                raise FieldValueError('Cannot increment non numeric value of %s' % str(e)[11:])
+            raise
+        table    = bkey()
+        identity = getattr(self._local,'identity',None)
+        values   = {}
+        for id,value in izip(result[::2],result[1::2]):
+            key = (table,id)
+            self.object_cache.discard(key)
+            if identity is not None:
+                identity.pop(key,None)
+            values[id] = field.serialize(float(value))
+        return values
+    
+    def ordered_ids(self, meta, result, name, desc, start, stop):
+        if stop is not None:
+            if stop <= start:
+                return []
+            end = stop - 1
         else:
-            if qset is None:
-                return 'all'
+            end = -1
+        if name == 'id':
+            if result == 'all':
+                result = self.query(meta, None, None, True)
+            count = end - start + 1 if stop is not None else -1
+            pipe  = self.redispy.pipeline(transaction = True)
+            self._renew(result, pipe)
+            pipe.sort(result.id, start = start, num = count, desc = desc)
+            return pipe.execute()[1]
+        zrange = 'ZREVRANGE' if desc else 'ZRANGE'
+        zkey   = meta.basekey(name)
+        if result == 'all':
+            return self.read_command(zrange, zkey, start, end)
+        # intersect the result with the ordered index keeping the index scores.
+        # The temporary key is private to the call and the transaction makes
+        # sure the result is available and does not expire between the commands.
+        id   = '%s:%s' % (result.id,uuid4().hex)
+        pipe = self.redispy.pipeline(transaction = True)
+        self._renew(result, pipe)
+        pipe.execute_command('ZINTERSTORE', id, 2, result.id, zkey, 'WEIGHTS', 0, 1)
+        pipe.execute_command(zrange, id, start, end)
+        pipe.execute_command('DEL', id)
+        return pipe.execute()[2]
+    
+    def _get_fields(self, meta, ids, fields):
+        table = meta.basekey()
+        names = [field.name for field in fields]
+        loads = meta.codec.loads_value
+        pipe  = self.reader().pipeline(transaction = False)
+        for id in ids:
+            pipe.hexists(table, id)
+            pipe.hmget(meta.objkey(id), names)
+        result = pipe.execute()
+        rows   = []
+        for exists,values in izip(result[::2],result[1::2]):
+            if exists:
+                rows.append([loads(v) if v is not None else None for v in values])
             else:
-                return qset
+                rows.append(None)
+        return rows
+    
+    def _discard_indexes(self, discards, batch):
+        for typ,key,id in discards:
+            if typ == 'unique':
+                batch.execute_command('DEL', key)
+            elif typ == 'set':
+                batch.execute_command('SREM', key, id)
+            else:
+                batch.execute_command('ZREM', key, id)
+    
+    def _save_objects(self, objects, batch):
+        script = self._object_script
+        tables = []
+        groups = {}
+        for obj,args,dbdata in objects:
+            table = obj._meta.basekey()
+            if table not in groups:
+                tables.append(table)
+                groups[table] = []
+            groups[table].append(args)
+        for table in tables:
+            for group in chunks(groups[table], self.variadic_size):
+                args = [table,len(group)]
+                for oargs in group:
+                    args.extend(oargs)
+                batch.script(script, args = args)
+    
+    def _invalidate(self, registries, batch):
+        batch.execute_command('EVAL', INVALIDATE_SCRIPT, len(registries), *registries)
     
-    def _set_keys(self, keys):
+    def _set_keys(self, keys, batch):
         items = []
         timeouts = {}
         for key,val in keys.iteritems():
@@ -78,9 +1251,9 @@ class BackendDataServer(stdnet.BackendDataServer):
                 timeouts[key] = timeout
             items.append(key)
             items.append(val.value)
-        self.execute_command('MSET', *items)
+        batch.execute_command('MSET', *items)
         for key,timeout in timeouts.iteritems():
-            self.execute_command('EXPIRE', key, timeout)
+            batch.execute_command('EXPIRE', key, timeout)
         
     
     
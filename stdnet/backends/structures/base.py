@@ -2,6 +2,8 @@
 
 from stdnet.utils import listPipeline, many2manyPipeline
 
+_novalue = object()
+
 
 __all__ = ['PipeLine',
            'pipelines',
@@ -9,7 +11,8 @@ __all__ = ['PipeLine',
            'List',
            'Set',
            'OrderedSet',
-           'HashTable']
+           'HashTable',
+           'TS']
 
 class keyconverter(object):
     
@@ -48,6 +51,10 @@ class ListPipe(PipeLine):
     def __init__(self, timeout):
         super(ListPipe,self).__init__(listPipeline(),'list',timeout)
         
+class TSPipe(PipeLine):
+    def __init__(self, timeout):
+        super(TSPipe,self).__init__({},'ts',timeout)
+        
 class Many2Many(PipeLine):
     def __init__(self, timeout):
         super(Many2Many,self).__init__(many2manyPipeline(),'unordered_set',timeout)
@@ -56,6 +63,7 @@ _pipelines = {'list':ListPipe,
               'hash': HashPipe,
               'set': SetPipe,
               'oset': OsetPipe,
+              'ts': TSPipe,
               'many2many': Many2Many}
 
 
@@ -133,9 +141,12 @@ class Structure(object):
             self._cache = self._all()
         return self._cache
     
-    def save(self):
+    def save(self, batch = None):
+        '''Write pending changes to the server. If *batch* is provided
+(see :meth:`stdnet.BackendDataServer.batch`), commands are queued into it
+rather than being executed straight away.'''
         if self._pipeline:
-            s = self._save()
+            s = self._save(batch or self.cursor)
             self._pipeline.clear()
             return s
         else:
@@ -143,7 +154,7 @@ class Structure(object):
         
     # PURE VIRTUAL METHODS
         
-    def _save(self):
+    def _save(self, batch):
         raise NotImplementedError("Could not save")
 
 
@@ -237,9 +248,12 @@ class OrderedSet(Set):
             for item in self.cache:
                 yield item
                 
-    def add(self, value):
-        '''Add *value* to the set'''
-        self._pipeline.add((value.score(),self.pickler.dumps(value)))
+    def add(self, value, score = None):
+        '''Add *value* to the set with *score*. If *score* is not provided,
+*value* must implement the ``score`` method.'''
+        if score is None:
+            score = value.score()
+        self._pipeline.add((score,self.pickler.dumps(value)))
 
 
 def itemcmp(x,y):
@@ -300,7 +314,7 @@ class HashTable(Structure):
         objs  = self._mget(ckeys)
         loads = self.pickler.loads
         for obj in objs:
-            yield loads(obj)
+            yield loads(obj) if obj is not None else None
     
     def keys(self, desc = False):
         tovalue  = self.converter.tovalue
@@ -318,6 +332,16 @@ class HashTable(Structure):
     def values(self):
         for key,value in self.items():
             yield value
+            
+    def scan(self, count = 1000):
+        '''Generator over key-value items which fetches data from the server
+in chunks of roughly *count* items, so that the whole hash table is never
+loaded in memory. An item may be returned more than once if the
+table is modified during the iteration.'''
+        loads    = self.pickler.loads
+        tovalue  = self.converter.tovalue
+        for key,val in self._scan(count):
+            yield tovalue(key),loads(val)
     
     def __iter__(self):
         return self.keys()
@@ -348,7 +372,150 @@ class HashTable(Structure):
     def _items(self):
         raise NotImplementedError
     
+    def _scan(self, count):
+        raise NotImplementedError
+    
     def _mget(self, keys):
         raise NotImplementedError
 
     
+
+
+def num2str(value):
+    '''String representation of the number *value* which keeps
+the full precision of floats.'''
+    if isinstance(value,(int,long)):
+        return str(value)
+    else:
+        return repr(float(value))
+    
+    
+def str2num(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+    
+
+class TS(Structure):
+    '''A timeseries :class:`stdnet.Structure`, a map of keys, usually dates,
+to values kept sorted by key in the server. Keys are converted into numbers
+by the *converter*, so that :meth:`range`, :meth:`first` and :meth:`last`
+fetch only the requested items.'''
+    def __init__(self, *args, **kwargs):
+        self.converter = kwargs.pop('converter',None) or keyconverter
+        super(TS,self).__init__(*args, **kwargs)
+        
+    def add(self, key, value):
+        '''Add *key* - *value* pair to the timeseries, replacing the value
+of *key* if already available.'''
+        self.update(((key,value),))
+    __setitem__ = add
+    
+    def update(self, items):
+        '''Add *items*, a dictionary or an iterable over key-value pairs,
+to the timeseries. Items are sent to the server in bulk when the structure
+is saved.'''
+        if isinstance(items,dict):
+            items = items.iteritems()
+        tokey = self.converter.tokey
+        dumps = self.pickler.dumps
+        p     = self._pipeline
+        for key,value in items:
+            p[tokey(key)] = dumps(value)
+            
+    def raw_update(self, items):
+        '''Add *items*, an iterable over key-value pairs where keys are
+already converted and values already pickled.'''
+        self._pipeline.update(items)
+        
+    def get(self, key, default = None):
+        score = num2str(self.converter.tokey(key))
+        for k,value in self._load(self._range(score, score)):
+            return value
+        return default
+    
+    def __getitem__(self, key):
+        v = self.get(key,_novalue)
+        if v is _novalue:
+            raise KeyError('%s not available' % key)
+        return v
+    
+    def __contains__(self, key):
+        return self.get(key,_novalue) is not _novalue
+    
+    def range(self, start = None, end = None, chunk_size = None):
+        '''Generator of sorted key-value pairs with keys between *start*
+and *end* included. If *start* or *end* is ``None`` the range is unbounded.
+If *chunk_size* is given, items are fetched from the server in chunks of
+*chunk_size* items, otherwise with a single request.'''
+        tokey = self.converter.tokey
+        low   = num2str(tokey(start)) if start is not None else '-inf'
+        high  = num2str(tokey(end)) if end is not None else '+inf'
+        if not chunk_size:
+            for item in self._load(self._range(low, high)):
+                yield item
+            return
+        while True:
+            members = self._range(low, high, chunk_size)
+            for item in self._load(members):
+                yield item
+            if len(members) < chunk_size:
+                break
+            # start the next chunk after the last key
+            low = '(%s' % members[-1].split(':',1)[0]
+            
+    def raw_range(self, start = None, end = None):
+        '''List of items between *start* and *end*, as stored in the
+server. Each item is a string containing the converted key and the
+pickled value separated by a colon.'''
+        tokey = self.converter.tokey
+        low   = num2str(tokey(start)) if start is not None else '-inf'
+        high  = num2str(tokey(end)) if end is not None else '+inf'
+        return self._range(low, high)
+    
+    def items(self):
+        '''Generator over sorted key-value pairs'''
+        return self.range()
+    
+    def keys(self):
+        for key,value in self.range():
+            yield key
+            
+    def values(self):
+        for key,value in self.range():
+            yield value
+    
+    def __iter__(self):
+        return self.keys()
+    
+    def first(self):
+        '''The key-value pair with the smallest key or ``None`` if the
+timeseries is empty.'''
+        for item in self._load(self._rank(0, 0)):
+            return item
+        
+    def last(self):
+        '''The key-value pair with the largest key or ``None`` if the
+timeseries is empty.'''
+        for item in self._load(self._rank(-1, -1)):
+            return item
+    
+    def _load(self, members):
+        # Each member is the key score and the pickled value separated by a colon
+        tovalue = self.converter.tovalue
+        loads   = self.pickler.loads
+        for member in members:
+            key,value = member.split(':',1)
+            yield tovalue(str2num(key)),loads(value)
+    
+    # PURE VIRTUAL METHODS
+    
+    def _range(self, low, high, count = None):
+        '''List of members with scores between *low* and *high*, at most
+*count* if provided.'''
+        raise NotImplementedError
+    
+    def _rank(self, start, stop):
+        '''List of members from position *start* to *stop* included.'''
+        raise NotImplementedError
@@ -1,14 +1,29 @@
 '''Two different implementation of a redis::map, a networked
 ordered associative container
 '''
+from stdnet.utils import chunks
+
 import base as structures
+from base import num2str
+
+
+# Add members to the timeseries KEYS[1], replacing members with the same
+# score. ARGV contains score and member pairs.
+TS_ADD_SCRIPT = '''
+local key = KEYS[1]
+for i = 1, #ARGV, 2 do
+    redis.call('zremrangebyscore', key, ARGV[i], ARGV[i])
+    redis.call('zadd', key, ARGV[i], ARGV[i + 1])
+end
+return redis.call('zcard', key)
+'''
 
 
 class List(structures.List):
     
     def _size(self):
         '''Size of map'''
-        return self.cursor.execute_command('LLEN', self.id)
+        return self.cursor.read_command('LLEN', self.id)
     
     def delete(self):
         return self.cursor.execute_command('DEL', self.id)
@@ -20,15 +35,16 @@ class List(structures.List):
         return self.pickler.loads(self.cursor.execute_command('LPOP', self.id))
     
     def _all(self):
-        return self.cursor.execute_command('LRANGE', self.id, 0, -1)
-    
-    def _save(self):
-        id = self.id
-        s  = 0
-        for value in self._pipeline.back:
-            s = self.cursor.execute_command('RPUSH', id, value)
-        for value in self._pipeline.front:
-            s = self.cursor.execute_command('LPUSH', id, value)
+        return self.cursor.read_command('LRANGE', self.id, 0, -1)
+    
+    def _save(self, batch):
+        id   = self.id
+        size = self.cursor.variadic_size
+        s    = 0
+        for values in chunks(self._pipeline.back, size):
+            s = batch.execute_command('RPUSH', id, *values)
+        for values in chunks(self._pipeline.front, size):
+            s = batch.execute_command('LPUSH', id, *values)
         return s
         
 
@@ -36,7 +52,7 @@ class Set(structures.Set):
     
     def _size(self):
         '''Size of set'''
-        return self.cursor.execute_command('SCARD', self.id)
+        return self.cursor.read_command('SCARD', self.id)
     
     def delete(self):
         return self.cursor.execute_command('DEL', self.id)
@@ -44,72 +60,118 @@ class Set(structures.Set):
     def discard(self, elem):
         return self.cursor.execute_command('SREM', self.id, elem)
     
-    def _save(self):
+    def _save(self, batch):
         id = self.id
         s  = 0
-        for value in self._pipeline:
-            s += self.cursor.execute_command('SADD', id, value)
+        for values in chunks(self._pipeline, self.cursor.variadic_size):
+            s += batch.execute_command('SADD', id, *values)
         return s
     
     def _contains(self, value):
-        return self.cursor.execute_command('SISMEMBER', self.id, value)
+        return self.cursor.read_command('SISMEMBER', self.id, value)
     
     def _all(self):
-        return self.cursor.execute_command('SMEMBERS', self.id)
+        return self.cursor.read_command('SMEMBERS', self.id)
     
     
 class OrderedSet(structures.OrderedSet):
     
     def _size(self):
         '''Size of set'''
-        return self.cursor.execute_command('ZCARD', self.id)
+        return self.cursor.read_command('ZCARD', self.id)
     
     def discard(self, elem):
         return self.cursor.execute_command('ZREM', self.id, elem)
     
-    def _contains(self):
-        return self.cursor.execute_command('ZSCORE', self.id, value) is not None
+    def _contains(self, value):
+        return self.cursor.read_command('ZSCORE', self.id, value) is not None
     
     def _all(self):
-        return self.cursor.redispy.zrange(self.id, 0, -1)
+        return self.cursor.reader().zrange(self.id, 0, -1)
     
-    def _save(self):
+    def _save(self, batch):
         id = self.id
         s  = 0
-        for score,value in self._pipeline:
-            s += self.cursor.execute_command('ZADD', id, score, value)
+        for values in chunks(self._pipeline, self.cursor.variadic_size):
+            args = []
+            [args.extend(item) for item in values]
+            s += batch.execute_command('ZADD', id, *args)
         return s
 
 
 class HashTable(structures.HashTable):
     
     def _size(self):
-        return self.cursor.execute_command('HLEN', self.id)
+        return self.cursor.read_command('HLEN', self.id)
     
     def delete(self):
         return self.cursor.execute_command('DEL', self.id)
     
     def _get(self, key):
-        return self.cursor.execute_command('HGET', self.id, key)
+        return self.cursor.read_command('HGET', self.id, key)
     
     def _mget(self, keys):
-        return self.cursor.execute_command('HMGET', self.id, *keys)
+        return self.cursor.read_command('HMGET', self.id, *keys)
     
     def delete(self, key):
         return self.cursor.execute_command('HDEL', self.id, key)
     
     def _keys(self):
-        return self.cursor.execute_command('HKEYS', self.id)
+        return self.cursor.read_command('HKEYS', self.id)
     
     def _items(self):
-        return self.cursor.execute_command('HGETALL', self.id)
+        return self.cursor.read_command('HGETALL', self.id)
+    
+    def _scan(self, count):
+        redispy = self.cursor.reader()
+        cursor  = 0
+        while True:
+            cursor, data = redispy.hscan(self.id, cursor, count = count)
+            for item in data.iteritems():
+                yield item
+            if not cursor:
+                break
 
     def values(self):
         for ky,val in self.items():
             yield val
             
-    def _save(self):
-        items = []
-        [items.extend(item) for item in self._pipeline.iteritems()]
-        return self.cursor.execute_command('HMSET',self.id,*items)
+    def _save(self, batch):
+        s = None
+        for values in chunks(self._pipeline.iteritems(), self.cursor.variadic_size):
+            items = []
+            [items.extend(item) for item in values]
+            s = batch.execute_command('HMSET',self.id,*items)
+        return s
     
+
+
+class TS(structures.TS):
+    '''Timeseries stored in a sorted set. Each member is the key, which is
+also the score, and the pickled value separated by a colon.'''
+    def _size(self):
+        return self.cursor.read_command('ZCARD', self.id)
+    
+    def delete(self):
+        return self.cursor.execute_command('DEL', self.id)
+    
+    def _range(self, low, high, count = None):
+        if count:
+            return self.cursor.read_command('ZRANGEBYSCORE', self.id, low, high,
+                                            'LIMIT', 0, count)
+        return self.cursor.read_command('ZRANGEBYSCORE', self.id, low, high)
+    
+    def _rank(self, start, stop):
+        return self.cursor.read_command('ZRANGE', self.id, start, stop)
+    
+    def _save(self, batch):
+        id = self.id
+        s  = 0
+        for values in chunks(self._pipeline.iteritems(), self.cursor.variadic_size):
+            args = []
+            for key,value in values:
+                key = num2str(key)
+                args.append(key)
+                args.append('%s:%s' % (key,value))
+            s = batch.script(self.cursor._ts_add_script, (id,), args)
+        return s
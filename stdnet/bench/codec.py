@@ -0,0 +1,50 @@
+'''Size and decoding speed of model rows encoded with
+:class:`stdnet.orm.PickleRowCodec` and :class:`stdnet.orm.BinaryRowCodec`.
+Usage::
+
+    python codec.py [number of rows]
+'''
+import sys
+from datetime import date
+from timeit import default_timer as timer
+
+from stdnet import orm
+from stdnet.utils import populate, date2timestamp
+
+
+class Trade(orm.StdModel):
+    code  = orm.SymbolField()
+    ccy   = orm.SymbolField()
+    dt    = orm.DateField()
+    size  = orm.FloatField()
+    price = orm.FloatField()
+    
+    class Meta:
+        app_label = 'bench'
+
+
+def rows(N):
+    codes  = populate('string', N, min_len = 5, max_len = 12)
+    ccys   = populate('choice', N, choice_from = ['EUR','GBP','USD','JPY'])
+    dates  = populate('date', N, start = date(2009,1,1), end = date(2010,1,1))
+    sizes  = populate('float', N)
+    return [[c,ccy,date2timestamp(dt),s,100.0] for c,ccy,dt,s in zip(codes,ccys,dates,sizes)]
+
+
+def run(N, codec):
+    data = rows(N)
+    encoded = [codec.dumps(row) for row in data]
+    size = sum((len(row) for row in encoded))
+    t1 = timer()
+    for row in encoded:
+        codec.loads(row)
+    dt = timer() - t1
+    print("%-16s %6.1f bytes/row %8.3f seconds to decode" %
+          (codec.__class__.__name__,float(size)/N,dt))
+
+
+if __name__ == '__main__':
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print("Encoding %s rows" % N)
+    run(N, orm.PickleRowCodec(Trade._meta))
+    run(N, orm.BinaryRowCodec(Trade._meta))
@@ -0,0 +1,75 @@
+'''Number of redis commands per object when saving models with indexes.
+
+Objects are saved with ``variadic_size=1``, one script call and one command
+per index entry for each object, with ``variadic_size=1000``, one script call
+for each 1000 objects writing index entries with variadic commands, and with
+``bulk_create``, which also reserves ids with a single ``INCRBY``. Commands
+executed by the scripts saving objects are counted as well. For 5000 objects
+these are about 7, 1.02 and 0.02 commands per object. Usage::
+
+    python commands.py [number of objects]
+'''
+import sys
+from timeit import default_timer as timer
+
+from stdnet import orm
+from stdnet.conf import settings
+from stdnet.utils import populate
+
+
+class Trade(orm.StdModel):
+    code = orm.SymbolField(unique = True)
+    ccy  = orm.SymbolField()
+    type = orm.SymbolField()
+    
+    class Meta:
+        app_label = 'bench'
+
+
+ccys  = ['EUR','GBP','AUD','USD','CHF','JPY']
+types = ['equity','bond','future','cash','option']
+
+
+def backend(**params):
+    uri = settings.DEFAULT_BACKEND
+    sep = '&' if '?' in uri else '?'
+    return '%s%s%s' % (uri,sep,'&'.join(('%s=%s' % kv for kv in params.items())))
+
+
+def commands_processed(redispy):
+    return int(redispy.info()['total_commands_processed'])
+
+
+def run(N, variadic_size, bulk = False):
+    orm.register(Trade, backend(variadic_size = variadic_size))
+    redispy = Trade._meta.cursor.redispy
+    codes = populate('string', N, min_len = 10, max_len = 20)
+    tccys = populate('choice', N, choice_from = ccys)
+    ttyps = populate('choice', N, choice_from = types)
+    try:
+        c1 = commands_processed(redispy)
+        t1 = timer()
+        trades = (Trade(code = '%s%s' % (code,n), ccy = tccys[n], type = ttyps[n])
+                  for n,code in enumerate(codes))
+        if bulk:
+            Trade.objects.bulk_create(trades)
+        else:
+            for trade in trades:
+                trade.save(False)
+            Trade.commit()
+        dt = timer() - t1
+        # remove the INFO command used for measuring
+        c = commands_processed(redispy) - c1 - 1
+        print("variadic_size=%-5s bulk=%-5s %8s commands %6.2f commands/object %8.3f seconds" %
+              (variadic_size,bulk,c,float(c)/N,dt))
+    finally:
+        orm.clearall()
+        orm.unregister(Trade)
+
+
+if __name__ == '__main__':
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print("Saving %s objects with two indexes" % N)
+    run(N, 1)
+    run(N, 1000)
+    run(N, 1000, True)
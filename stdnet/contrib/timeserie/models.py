@@ -1,6 +1,19 @@
+from __future__ import with_statement
+
+import time
+from datetime import timedelta
+from itertools import izip
+
 from stdnet import orm
+from stdnet.exceptions import ImproperlyConfigured
 from stdnet.utils import date2timestamp, timestamp2date
-from stdnet.contrib.timeserie.utils import default_parse_interval
+from stdnet.contrib.timeserie.utils import default_parse_interval, resample, rolling
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class DateTimeConverter(object):
     
@@ -21,23 +34,58 @@ class DateConverter(object):
     @classmethod
     def tovalue(cls, value):
         return timestamp2date(value).date()
+    
+    
+class FloatPickler(object):
+    '''Store values as the string representation of floats, so that
+they can be decoded in bulk by :meth:`TimeSerie.to_arrays`.'''
+    numeric = True
+    
+    @classmethod
+    def dumps(cls, value):
+        return repr(float(value))
+    
+    @classmethod
+    def loads(cls, value):
+        return float(value)
+    
+    
+class DatePickler(object):
+    '''Store dates as timestamps.'''
+    @classmethod
+    def dumps(cls, value):
+        return str(DateConverter.tokey(value))
+    
+    @classmethod
+    def loads(cls, value):
+        return DateConverter.tovalue(int(value))
 
 
-class TimeSerieField(orm.HashField):
-    '''A timeserie filed specializes :ref:`HashField <hashfield>` by
-    providing support for keys given by instances of ``datetime.date``'''
+class TimeSerieField(orm.MultiField):
+    '''A timeserie field holding a :class:`stdnet.TS` structure, a map of dates
+to values kept sorted in the server. By default keys are instances of
+``datetime.date`` and values are floats (see :class:`FloatPickler`).'''
     def __init__(self, *args, **kwargs):
         kwargs['converter'] = kwargs.pop('converter',None) or DateConverter
-        super(TimeSerieField,self).__init__(*args, **kwargs)      
+        kwargs['pickler'] = kwargs.pop('pickler',None) or FloatPickler
+        super(TimeSerieField,self).__init__(*args, **kwargs)
+        
+    def get_pipeline(self):
+        return 'ts'
 
 
 class TimeSerie(orm.StdModel):
-    data  = TimeSerieField()
+    '''Abstract model of timeseries. The :attr:`start` and :attr:`end`
+dates are stored with the model and updated by :meth:`storestartend`.
+The ``coverage`` field maps the start dates of the intervals for which data
+was fetched (see :meth:`cover`) to their end dates.'''
+    data     = TimeSerieField()
+    coverage = TimeSerieField(pickler = DatePickler)
+    start    = orm.DateField(index = False, required = False)
+    end      = orm.DateField(index = False, required = False)
     
-    def __init__(self, start = None, end = None, **kwargs):
-        super(TimeSerie,self).__init__(**kwargs)
-        self.start = start
-        self.end   = end
+    class Meta:
+        abstract = True
     
     def size(self):
         '''number of dates in timeseries'''
@@ -53,17 +101,169 @@ class TimeSerie(orm.StdModel):
         return self.fromto()
 
     def storestartend(self):
-        '''Store the start/end date of the timeseries'''
+        '''Save the timeserie and store its start/end dates. They are
+read from the two ends of the sorted timeserie, without fetching
+other dates.'''
         self.save()
-        dates = self.data.sortedkeys()
-        if dates:
-            self.start = dates[0]
-            self.end   = dates[-1]
+        first = self.data.first()
+        last  = self.data.last()
+        self.start = first[0] if first else None
+        self.end   = last[0] if last else None
+        return self.save()
+    
+    def to_arrays(self, start = None, end = None):
+        '''Return a two elements tuple containing the dates, as a ``datetime64``
+:mod:`numpy` array, and the values, as a ``float64`` array, of the timeserie
+between *start* and *end* included. Data is fetched with a single request
+and values stored by :class:`FloatPickler` are decoded in bulk.'''
+        if numpy is None:
+            raise ImproperlyConfigured('to_arrays requires numpy')
+        data    = self.data
+        tovalue = data.converter.tovalue
+        items   = data.raw_range(start, end)
+        if getattr(data.pickler,'numeric',False):
+            flat   = numpy.fromstring(' '.join(items).replace(':',' '), sep = ' ')
+            keys   = flat[0::2]
+            values = flat[1::2]
+        else:
+            items  = [item.split(':',1) for item in items]
+            keys   = numpy.array([int(k) for k,v in items], dtype = numpy.float64)
+            values = numpy.array([data.pickler.loads(v) for k,v in items],
+                                 dtype = numpy.float64)
+        dates = None
+        if data.converter is DateConverter:
+            # keys are timestamps of local midnights. Rounding the local
+            # standard time to days absorbs daylight saving offsets.
+            days  = numpy.round((0.001*keys - time.timezone)/86400)
+            dates = days.astype(numpy.int64).astype('datetime64[D]')
+            # check the ends for time zones which moved across the date line
+            if len(keys) and (dates[0] != tovalue(int(keys[0])) or
+                              dates[-1] != tovalue(int(keys[-1]))):
+                dates = None
+        if dates is None:
+            unit  = 'D' if data.converter is DateConverter else 'us'
+            dates = numpy.array([tovalue(int(k)) for k in keys],
+                                dtype = 'datetime64[%s]' % unit)
+        return dates, values
+    
+    def update_from_arrays(self, dates, values):
+        '''Add *dates* and *values*, two :mod:`numpy` arrays or sequences
+of the same length, to the timeserie and save it. Values stored by
+:class:`FloatPickler` are encoded in bulk and all items are written
+with a single :meth:`stdnet.BackendDataServer.commit`.'''
+        if numpy is None:
+            raise ImproperlyConfigured('update_from_arrays requires numpy')
+        dates  = numpy.asarray(dates)
+        values = numpy.asarray(values, dtype = numpy.float64)
+        if dates.shape != values.shape:
+            raise ValueError('dates and values must have the same length')
+        data  = self.data
+        tokey = data.converter.tokey
+        if dates.dtype.kind == 'M':
+            unit  = 'D' if data.converter is DateConverter else 'us'
+            dates = dates.astype('datetime64[%s]' % unit).astype(object)
+        keys = [tokey(dt) for dt in dates]
+        if getattr(data.pickler,'numeric',False):
+            data.raw_update(izip(keys,values.astype(str)))
         else:
-            self.start = None
-            self.end   = None
+            data.update(izip(dates,values.tolist()))
         return self.save()
     
+    def resample(self, period, how = 'last', start = None, end = None,
+                 chunk_size = 1000):
+        '''Generator of date-value pairs aggregating the timeserie between
+*start* and *end* over each *period*, for example weekly closes with
+``ts.resample('week')``. Data is read in chunks of *chunk_size* dates.
+See :func:`stdnet.contrib.timeserie.utils.resample` for the parameters.'''
+        items = self.data.range(start, end, chunk_size)
+        return resample(items, period, how, start)
+    
+    def rolling(self, window, how = 'mean', start = None, end = None,
+                min_periods = 1, chunk_size = 1000):
+        '''Generator of date-value pairs aggregating, for each date between
+*start* and *end*, the values of the last *window* days, for example
+30 days moving averages with ``ts.rolling(30)``. Data is read in chunks of
+*chunk_size* dates, starting *window* days before *start* so that windows
+of the first dates are complete.
+See :func:`stdnet.contrib.timeserie.utils.rolling` for the parameters.'''
+        begin = start - timedelta(window - 1) if start is not None else None
+        items = rolling(self.data.range(begin, end, chunk_size), window, how, min_periods)
+        for dt,value in items:
+            if start is None or dt >= start:
+                yield dt,value
+    
+    def missing_intervals(self, startdate, enddate, parseinterval = default_parse_interval):
+        '''Given a *start* and an *end* date, evaluate the date intervals
+not covered by the coverage map, including holes between covered intervals.
+It returns a sorted list of two-dimensional tuples containing start and end
+date of the intervals.'''
+        startdate = parseinterval(startdate,0)
+        enddate   = max(startdate,parseinterval(enddate,0))
+        missing   = []
+        current   = startdate
+        for start,end in self.coverage.range(end = enddate):
+            if end < current:
+                continue
+            if start > current:
+                gap_end = min(parseinterval(start,-1),enddate)
+                if gap_end >= current:
+                    missing.append((current,gap_end))
+            current = max(current,parseinterval(end,1))
+            if current > enddate:
+                break
+        if current <= enddate:
+            missing.append((current,enddate))
+        return missing
+    
+    def cover(self, startdate, enddate, commit = True):
+        '''Record in the coverage map that data between *startdate* and
+*enddate* is available. If *commit* is ``True`` the timeserie is saved.'''
+        covered = self.coverage.get(startdate)
+        if covered is None or covered < enddate:
+            self.coverage.add(startdate,enddate)
+        if commit:
+            self.save()
+            
+    def claim(self, timeout = 300):
+        '''Claim the timeserie for *timeout* seconds, so that other workers
+do not fetch its data at the same time. Claiming the whole timeserie, rather
+than intervals, makes sure that overlapping requests never fetch the same
+dates. Return a token for :meth:`release` or ``None`` if the timeserie is
+already claimed.'''
+        return self._meta.cursor.lock(self._claimkey(), timeout)
+    
+    def release(self, token):
+        '''Release a claim acquired with :meth:`claim`.'''
+        return self._meta.cursor.unlock(self._claimkey(), token)
+    
+    def backfill(self, startdate, enddate, fetch, timeout = 300,
+                 parseinterval = default_parse_interval):
+        '''Fetch data missing between *startdate* and *enddate*. Nothing is
+fetched if another worker has claimed the timeserie (see :meth:`claim`).
+Otherwise missing intervals (see :meth:`missing_intervals`) are evaluated,
+once the claim is acquired, from the coverage map on the server, so that
+intervals fetched by other workers are not fetched again. For each of them
+``fetch(start, end)`` is called. It returns a dictionary or an iterable over
+date-value pairs which are added to the timeserie, and the interval is covered,
+with a single commit. Return the list of fetched intervals.'''
+        token = self.claim(timeout)
+        if token is None:
+            return []
+        try:
+            with self._meta.cursor.using_primary():
+                missing = self.missing_intervals(startdate, enddate, parseinterval)
+            fetched = []
+            for start,end in missing:
+                self.data.update(fetch(start,end))
+                self.cover(start, end)
+                fetched.append((start,end))
+            return fetched
+        finally:
+            self.release(token)
+    
+    def _claimkey(self):
+        return self._meta.basekey('id',self.id,'claim')
+    
     def intervals(self, startdate, enddate, parseinterval = default_parse_interval):
         '''Given a *start* and an *end* date, evaluate the date intervals
 from which data is not available. It return a list of two-dimensional tuples
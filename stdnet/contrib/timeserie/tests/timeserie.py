@@ -1,13 +1,19 @@
 from itertools import izip
-from datetime import date
+from datetime import date, timedelta
 from random import uniform
 
 from stdnet.test import TestCase
 from stdnet.contrib.timeserie.utils import dategenerator, default_parse_interval
+from stdnet.contrib.timeserie.utils import resample, rolling
 from stdnet.utils import populate
 
 from models import TimeSerie
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 NUM_DATES = 300
 
@@ -54,9 +60,9 @@ class TestTimeSerie(TestCase):
         ts = self.filldata()
         keyp = None
         data = testdata.copy()
-        for key in ts.data.sortedkeys():
+        for key in ts.data.keys():
             if keyp:
-                self.assertTrue(key,keyp)
+                self.assertTrue(key > keyp)
             keyp = key
             data.pop(key)
         self.assertEqual(len(data),0)
@@ -65,9 +71,9 @@ class TestTimeSerie(TestCase):
         ts = self.filldata()
         keyp = None
         data = testdata.copy()
-        for key,value in ts.data.sorteditems():
+        for key,value in ts.data.items():
             if keyp:
-                self.assertTrue(key,keyp)
+                self.assertTrue(key > keyp)
             keyp = key
             self.assertEqual(data.pop(key),value)
         self.assertEqual(len(data),0)
@@ -146,3 +152,180 @@ class TestTimeSerie(TestCase):
             self.fail('KeyError')
         self.assertEqual(ts.data.get(date(2010,3,1)),None)
         
+        
+    def testRange(self):
+        ts = self.filldata()
+        sdates = sorted(testdata)
+        a, b = sdates[50], sdates[120]
+        items = list(ts.data.range(a,b))
+        self.assertEqual([k for k,v in items],sdates[50:121])
+        for k,v in items:
+            self.assertEqual(v,testdata[k])
+        self.assertEqual(list(ts.data.range(a,b,chunk_size = 7)),items)
+        self.assertEqual(len(list(ts.data.range(end = b))),121)
+        self.assertEqual(len(list(ts.data.range(start = a, chunk_size = 40))),len(testdata)-50)
+        
+    def testFirstLast(self):
+        ts = self.get()
+        self.assertEqual(ts.data.first(),None)
+        self.assertEqual(ts.data.last(),None)
+        ts = self.filldata()
+        sdates = sorted(testdata)
+        self.assertEqual(ts.data.first(),(sdates[0],testdata[sdates[0]]))
+        self.assertEqual(ts.data.last(),(sdates[-1],testdata[sdates[-1]]))
+        ts.storestartend()
+        ts = self.get()
+        self.assertEqual(ts.start,sdates[0])
+        self.assertEqual(ts.end,sdates[-1])
+        
+    def testReplace(self):
+        ts = self.filldata()
+        dt = sorted(testdata)[10]
+        ts.data.update([(dt,-1.0),(date(1990,1,1),5.0)])
+        ts.save()
+        self.assertEqual(ts.data.size(),len(testdata)+1)
+        self.assertEqual(ts.data[dt],-1.0)
+        self.assertEqual(ts.data.first(),(date(1990,1,1),5.0))
+        
+    def testDelete(self):
+        ts = self.filldata()
+        cursor = TimeSerie._meta.cursor
+        key = TimeSerie._meta.dfields['data'].id(ts)
+        self.assertTrue(cursor.redispy.exists(key))
+        ts.delete()
+        self.assertFalse(cursor.redispy.exists(key))
+        
+    def testToArrays(self):
+        if numpy is None:
+            return
+        ts = self.filldata()
+        sdates = sorted(testdata)
+        dates, values = ts.to_arrays()
+        self.assertEqual(dates.dtype,numpy.dtype('datetime64[D]'))
+        self.assertEqual(values.dtype,numpy.float64)
+        self.assertEqual(dates.tolist(),sdates)
+        self.assertEqual(values.tolist(),[testdata[dt] for dt in sdates])
+        dates, values = ts.to_arrays(sdates[10],sdates[19])
+        self.assertEqual(dates.tolist(),sdates[10:20])
+        dates, values = ts.to_arrays(date(1900,1,1),date(1900,2,1))
+        self.assertEqual(len(dates),0)
+        self.assertEqual(len(values),0)
+        
+    def testUpdateFromArrays(self):
+        if numpy is None:
+            return
+        ts = self.get()
+        sdates = sorted(testdata)
+        dates  = numpy.array(sdates, dtype = 'datetime64[D]')
+        values = numpy.array([testdata[dt] for dt in sdates])
+        ts.update_from_arrays(dates, values)
+        self.assertEqual(ts.data.size(),len(testdata))
+        self.assertEqual(list(ts.data.items()),[(dt,testdata[dt]) for dt in sdates])
+        # replace values
+        ts.update_from_arrays(dates[:5], numpy.zeros(5))
+        self.assertEqual(ts.data.size(),len(testdata))
+        self.assertEqual(ts.to_arrays()[1][:6].tolist(),[0.0]*5 + [testdata[sdates[5]]])
+        self.assertRaises(ValueError, ts.update_from_arrays, dates, values[:3])
+        
+    def testMissingIntervals(self):
+        ts = self.get()
+        A, B = date(2010,5,1), date(2010,5,31)
+        self.assertEqual(ts.missing_intervals(A,B),[(A,B)])
+        ts.cover(date(2010,5,10),date(2010,5,12))
+        ts.cover(date(2010,5,20),date(2010,6,10))
+        ts = self.get()
+        self.assertEqual(ts.missing_intervals(A,B),[(A,date(2010,5,9)),
+                                                   (date(2010,5,13),date(2010,5,19))])
+        self.assertEqual(ts.missing_intervals(date(2010,5,11),date(2010,5,25)),
+                         [(date(2010,5,13),date(2010,5,19))])
+        self.assertEqual(ts.missing_intervals(date(2010,5,21),date(2010,6,1)),[])
+        # covering a longer interval from the same start
+        ts.cover(date(2010,5,10),date(2010,5,19))
+        self.assertEqual(ts.missing_intervals(A,B),[(A,date(2010,5,9))])
+        ts.cover(date(2010,5,10),date(2010,5,11))
+        self.assertEqual(ts.missing_intervals(A,B),[(A,date(2010,5,9))])
+        
+    def testClaim(self):
+        ts = self.get()
+        token = ts.claim()
+        self.assertTrue(token)
+        self.assertEqual(self.get().claim(),None)
+        self.assertFalse(ts.release('wrong'))
+        self.assertTrue(ts.release(token))
+        self.assertTrue(ts.claim())
+        
+    def testBackfill(self):
+        ts = self.get()
+        calls = []
+        def fetch(start, end):
+            calls.append((start,end))
+            return ((dt,1.0) for dt in dategenerator(start,end))
+        A, B = date(2010,5,1), date(2010,5,31)
+        ts.cover(date(2010,5,10),date(2010,5,20))
+        self.assertEqual(ts.backfill(A,B,fetch),[(A,date(2010,5,9)),
+                                                (date(2010,5,21),B)])
+        self.assertEqual(len(calls),2)
+        self.assertEqual(ts.data.size(),20)
+        self.assertEqual(ts.missing_intervals(A,B),[])
+        self.assertEqual(self.get().backfill(A,B,fetch),[])
+        self.assertEqual(len(calls),2)
+        # a claimed timeserie is skipped
+        C = date(2010,6,30)
+        token = ts.claim()
+        self.assertEqual(ts.backfill(A,C,fetch),[])
+        ts.release(token)
+        self.assertEqual(ts.backfill(A,C,fetch),[(date(2010,6,1),C)])
+        
+    def testOverlappingBackfill(self):
+        ts1, ts2 = self.get(), self.get()
+        A, B, C = date(2010,5,1), date(2010,5,31), date(2010,6,30)
+        calls = []
+        def fetch(start, end):
+            # another worker backfilling an overlapping interval
+            calls.append(ts2.backfill(date(2010,5,15),C,fetch2))
+            return ((dt,1.0) for dt in dategenerator(start,end))
+        def fetch2(start, end):
+            calls.append((start,end))
+            return ((dt,2.0) for dt in dategenerator(start,end))
+        # the missing intervals of ts2 are computed before ts1 covers May
+        self.assertEqual(ts2.missing_intervals(date(2010,5,15),C),[(date(2010,5,15),C)])
+        self.assertEqual(ts1.backfill(A,B,fetch),[(A,B)])
+        self.assertEqual(calls,[[]])
+        # only dates not fetched by ts1 are fetched
+        self.assertEqual(ts2.backfill(date(2010,5,15),C,fetch2),[(date(2010,6,1),C)])
+        self.assertEqual(calls,[[],(date(2010,6,1),C)])
+        self.assertEqual(ts1.data.get(date(2010,5,20)),1.0)
+        
+    def testResample(self):
+        items = [(date(2010,5,d),float(d)) for d in range(1,32)]
+        # 2010-5-1 is a saturday
+        weeks = list(resample(items,'week'))
+        self.assertEqual(weeks[0],(date(2010,5,2),2.0))
+        self.assertEqual(weeks[1],(date(2010,5,9),9.0))
+        self.assertEqual(weeks[-1],(date(2010,5,31),31.0))
+        self.assertEqual(list(resample(items,'month','sum')),[(date(2010,5,31),496.0)])
+        self.assertEqual(list(resample(items,10,'mean',date(2010,5,1))),
+                         [(date(2010,5,10),5.5),(date(2010,5,20),15.5),
+                          (date(2010,5,30),25.5),(date(2010,5,31),31.0)])
+        self.assertEqual(list(resample(items,'week','first'))[1],(date(2010,5,9),3.0))
+        
+    def testRolling(self):
+        items = [(date(2010,5,d),float(d)) for d in range(1,11) if d != 5]
+        self.assertEqual(list(rolling(items,3,'sum')),
+                         [(date(2010,5,1),1.0),(date(2010,5,2),3.0),(date(2010,5,3),6.0),
+                          (date(2010,5,4),9.0),(date(2010,5,6),10.0),(date(2010,5,7),13.0),
+                          (date(2010,5,8),21.0),(date(2010,5,9),24.0),(date(2010,5,10),27.0)])
+        self.assertEqual(list(rolling(items,3,'max',3))[0],(date(2010,5,3),3.0))
+        self.assertEqual(len(list(rolling(items,3,'mean',3))),5)
+        
+    def testTimeSerieAggregates(self):
+        ts = self.filldata()
+        sdates = sorted(testdata)
+        months = list(ts.resample('month', chunk_size = 17))
+        self.assertEqual(months,list(resample(((d,testdata[d]) for d in sdates),'month')))
+        start = sdates[100]
+        means = list(ts.rolling(30, start = start, chunk_size = 13))
+        self.assertEqual(means[0][0],start)
+        window = [testdata[d] for d in sdates if start - timedelta(30) < d <= start]
+        self.assertAlmostEqual(means[0][1],sum(window)/len(window))
+        self.assertEqual(len(means),len(sdates)-100)
@@ -1,3 +1,4 @@
+from collections import deque
 from datetime import date, timedelta
 
 
@@ -21,4 +22,82 @@ def default_parse_interval(dt, delta = 0):
         return dt + timedelta(delta)
     else:
         return dt
-    
\ No newline at end of file
+    
+
+
+def _mean(values):
+    return sum(values)/float(len(values))
+
+aggregators = {'first': lambda values : values[0],
+               'last': lambda values : values[-1],
+               'mean': _mean,
+               'sum': sum,
+               'min': min,
+               'max': max}
+
+
+def periodkey(period, start = None):
+    '''Return a function mapping a date to the key of its *period*,
+``"week"``, ``"month"``, ``"year"`` or a number of days. Periods of
+days are aligned with :func:`dategenerator` steps from *start*.'''
+    if period == 'week':
+        return lambda dt : dt.isocalendar()[:2]
+    elif period == 'month':
+        return lambda dt : (dt.year,dt.month)
+    elif period == 'year':
+        return lambda dt : dt.year
+    step = int(period)
+    if step <= 0:
+        raise ValueError('Period must be a positive number of days')
+    if start is None:
+        return lambda dt : dt.toordinal() // step
+    origin = start.toordinal()
+    return lambda dt : (dt.toordinal() - origin) // step
+
+
+def resample(items, period, how = 'last', start = None):
+    '''Generator of date-value pairs obtained by aggregating sorted date-value
+*items* over each *period* (see :func:`periodkey`) with *how*, one of
+``"first"``, ``"last"``, ``"mean"``, ``"sum"``, ``"min"`` and ``"max"``.
+Each pair is labelled with the last date of the period in *items*.
+Only the values of one period are kept in memory.'''
+    agg    = aggregators[how]
+    key    = periodkey(period, start)
+    values = []
+    current = None
+    last   = None
+    for dt,value in items:
+        k = key(dt)
+        if values and k != current:
+            yield last,agg(values)
+            values = []
+        current = k
+        last    = dt
+        values.append(value)
+    if values:
+        yield last,agg(values)
+        
+
+def rolling(items, window, how = 'mean', min_periods = 1):
+    '''Generator of date-value pairs obtained by aggregating, for each date
+of sorted date-value *items*, the values of the last *window* days, the date
+included, with *how* (see :func:`resample`). Dates whose window
+contains less than *min_periods* values are skipped. Only the values
+in the window are kept in memory.'''
+    agg    = aggregators[how]
+    delta  = timedelta(window)
+    buffer = deque()
+    total  = 0.0
+    for dt,value in items:
+        buffer.append((dt,value))
+        total += value
+        while buffer[0][0] <= dt - delta:
+            total -= buffer.popleft()[1]
+        if len(buffer) < min_periods:
+            continue
+        if how == 'sum':
+            yield dt,total
+        elif how == 'mean':
+            yield dt,total/len(buffer)
+        else:
+            yield dt,agg([v for d,v in buffer])
@@ -26,6 +26,11 @@ class FieldValueError(FieldError):
     '''Raised when passing a wrong value to a field method'''
     pass
 
+class StaleObjectError(StdNetException):
+    '''Raised when saving an instance with ``check_version`` if the
+instance was saved by someone else since it was loaded.'''
+    pass
+
 class QuerySetError(StdNetException):
     '''Raised when queryset is malformed.'''
     pass
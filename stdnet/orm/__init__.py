@@ -2,4 +2,5 @@
 from models import *
 from mapper import *
 from fields import *
-from std import *
\ No newline at end of file
+from std import *
+from codec import *
\ No newline at end of file
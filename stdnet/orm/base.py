@@ -1,15 +1,17 @@
 import sys
 import copy
 from itertools import izip
-from fields import Field, AutoField
+from fields import Field, AutoField, IntegerField
 from stdnet.exceptions import *
 from query import UnregisteredManager 
+from related import register_pending
+from codec import BinaryRowCodec, ValuePickler
 
 def get_fields(bases, attrs):
     fields = {}
     for base in bases:
-        if hasattr(base, '_meta'):
-            fields.update(copy.deepcopy(base._meta.fields))
+        if hasattr(base, '_meta') and base._meta.abstract:
+            fields.update(copy.deepcopy(base._meta.dfields))
     
     for name,field in attrs.items():
         if isinstance(field,Field):
@@ -31,7 +33,12 @@ An instance is initiated when :class:`stdnet.orm.StdModel` class is created:
     
 .. attribute:: fields
 
-    dictionary of :class:`stdnet.orm.Field` instances.
+    list of :class:`stdnet.orm.Field` instances stored in the model table.
+    
+.. attribute:: multifields
+
+    list of :class:`stdnet.orm.MultiField` instances, whose data is stored
+    in separate structures.
     
 .. attribute:: abstract
 
@@ -47,24 +54,57 @@ An instance is initiated when :class:`stdnet.orm.StdModel` class is created:
 .. attribute:: pk
 
     primary key ::class:`stdnet.orm.Field`
+    
+.. attribute:: codec
+
+    the :class:`stdnet.orm.RowCodec` used for storing instances in the model table.
+    By default it is a :class:`stdnet.orm.BinaryRowCodec`.
+    
+.. attribute:: storage
+
+    How instances are stored. If ``"row"`` (the default) each instance is
+    a single entry, containing all fields, of the model table. If ``"hash"``
+    each instance is stored in its own :class:`stdnet.HashTable` with one entry
+    per field, so that fields can be loaded (see
+    :meth:`stdnet.orm.query.QuerySet.only`) and saved separately, while the model
+    table only keeps track of ids.
+    
+.. attribute:: version
+
+    The :class:`stdnet.orm.IntegerField` holding the version of instances,
+    or ``None``. It is set with the ``version`` ``Meta`` option, the name of
+    the field, which is added to the model if not declared. The version is
+    incremented every time an instance is saved and
+    ``save(check_version = True)`` fails if the instance was saved by
+    someone else since it was loaded.
 
 '''
     def __init__(self, model, fields,
                  abstract = False, keyprefix = None,
-                 app_label = None, **kwargs):
+                 app_label = None, codec = None, storage = None,
+                 version = None, **kwargs):
         self.abstract  = abstract
         self.keyprefix = keyprefix
         self.model     = model
         self.app_label = app_label
         self.name      = model.__name__.lower()
         self.fields    = []
+        self.multifields = []
         self.dfields   = {}
         self.timeout   = 0
         self.related   = {}
         self.maker     = lambda : model.__new__(model)
+        self.codec     = (codec or BinaryRowCodec)(self)
+        self.storage   = storage or 'row'
+        self.version   = None
+        if self.storage not in ('row','hash'):
+            raise FieldError('Unknown storage "%s" for model %s' % (storage,self))
         model._meta    = self
         
-        if not abstract:
+        if abstract:
+            # keep fields so that they are inherited by subclasses
+            self.dfields = fields
+        else:
             try:
                 pk = fields['id']
             except:
@@ -80,6 +120,15 @@ An instance is initiated when :class:`stdnet.orm.StdModel` class is created:
                 field.register_with_model(name,model)
                 if field.primary_key:
                     raise FieldError("Primary key already available %s." % name)
+            if version:
+                field = self.dfields.get(version)
+                if field is None:
+                    field = IntegerField(required = False, index = False)
+                    field.register_with_model(version,model)
+                elif not isinstance(field,IntegerField) or field.index:
+                    raise FieldError('Version field %s must be an IntegerField without index' % field)
+                self.version = field
+            register_pending(model)
             
         self.cursor = None
         self.keys  = None
@@ -119,20 +168,38 @@ An instance is initiated when :class:`stdnet.orm.StdModel` class is created:
 the model table'''
         if not self.cursor:
             raise ModelNotRegistered('%s not registered. Call orm.register(model_class) to solve the problem.' % self)
-        return self.cursor.hash(self.basekey(),self.timeout)
+        return self.cursor.hash(self.basekey(),self.timeout,pickler=self.codec)
+    
+    def objkey(self, id):
+        '''Key of the :class:`stdnet.HashTable` holding the fields of instance
+*id* when :attr:`storage` is ``"hash"``.'''
+        return self.basekey('id',id)
+    
+    def object_table(self, id):
+        '''Return an instance of :class:`stdnet.HashTable` holding
+the fields of instance *id* when :attr:`storage` is ``"hash"``.'''
+        return self.cursor.hash(self.objkey(id),self.timeout,
+                                pickler=ValuePickler(self.codec))
     
-    def related_objects(self):
+    def related_objects(self, obj):
+        '''List of objects referring to instance *obj*'''
         objs = []
-        for rel in self.related.itervalues():
-            objs.extend(rel.all())
+        for name,manager in self.related.iteritems():
+            # models not registered cannot have instances
+            if manager.related._meta.cursor:
+                objs.extend(getattr(obj,name).all())
         return objs
     
-    def make(self, id, data):
-        '''Create a model instance from server data'''
+    def make(self, id, data, fields = None):
+        '''Create a model instance from server *data*, the list of
+serialized values of *fields* (all fields by default).'''
         obj = self.maker()
         setattr(obj,'id',id)
-        for field,value in izip(self.fields,data):
-            setattr(obj,field.name,field.to_python(value))
+        fields = fields or self.fields
+        for field,value in izip(fields,data):
+            setattr(obj,field.attname,field.to_python(value))
+        # snapshot of server data used for saving only changed fields
+        obj._dbdata = dict(izip((field.name for field in fields),data))
         return obj
 
 
@@ -169,7 +236,15 @@ class StdNetType(type):
 
 def meta_options(abstract = False,
                  keyprefix = None,
+                 app_label = None,
+                 codec = None,
+                 storage = None,
+                 version = None,
                  **kwargs):
     return {'abstract': abstract,
-            'keyprefix': keyprefix}
+            'keyprefix': keyprefix,
+            'app_label': app_label,
+            'codec': codec,
+            'storage': storage,
+            'version': version}
     
\ No newline at end of file
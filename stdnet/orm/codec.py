@@ -0,0 +1,196 @@
+'''Row codecs convert the list of serialized field values of a
+:class:`stdnet.orm.StdModel` instance into the string stored in the model
+:class:`stdnet.HashTable` and back. A codec is specified in the model ``Meta``
+class::
+
+    class Instrument(orm.StdModel):
+        name = orm.SymbolField(unique = True)
+
+        class Meta:
+            codec = orm.PickleRowCodec
+'''
+import struct
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+__all__ = ['RowCodec',
+           'PickleRowCodec',
+           'BinaryRowCodec',
+           'ValuePickler']
+
+
+class RowCodec(object):
+    '''Base class for row codecs. A codec is initialised with the model
+:class:`stdnet.orm.base.Metaclass` and implements the ``dumps`` and ``loads``
+methods, so that it can be used as the pickler of the model table.'''
+    def __init__(self, meta):
+        self.meta = meta
+
+    def dumps(self, data):
+        '''Encode the list of serialized field values *data*'''
+        raise NotImplementedError
+
+    def loads(self, row):
+        '''Decode *row* into a list of serialized field values'''
+        raise NotImplementedError
+    
+    def dumps_value(self, value):
+        '''Encode a single serialized field value. Used when each field
+is stored separately (see :attr:`stdnet.orm.base.Metaclass.storage`).'''
+        return self.dumps([value])
+    
+    def loads_value(self, s):
+        '''Decode a single serialized field value'''
+        return self.loads(s)[0]
+        
+        
+class ValuePickler(object):
+    '''Adapter for using the single value encoding of a :class:`RowCodec`
+as the pickler of a :class:`stdnet.HashTable`.'''
+    def __init__(self, codec):
+        self.dumps = codec.dumps_value
+        self.loads = codec.loads_value
+
+
+class PickleRowCodec(RowCodec):
+    '''Rows are pickled python lists. This was the only
+format available before :class:`BinaryRowCodec`.'''
+    def dumps(self, data):
+        return pickle.dumps(data)
+
+    def loads(self, row):
+        return pickle.loads(row)
+
+
+# Type codes of values in a binary row and their struct format.
+# Strings are stored after the struct-packed part and only their length
+# is packed.
+NONE, TRUE, FALSE   = 'n', 't', 'f'
+INT, LONG, FLOAT    = 'i', 'q', 'd'
+STR, LSTR           = 's', 'S'
+UNICODE, LUNICODE   = 'u', 'U'
+PICKLE              = 'p'
+formats  = {NONE:'', TRUE:'', FALSE:'',
+            INT:'i', LONG:'q', FLOAT:'d',
+            STR:'H', LSTR:'I', UNICODE:'H', LUNICODE:'I',
+            PICKLE:'I'}
+strings  = (STR,LSTR,UNICODE,LUNICODE,PICKLE)
+constants = {NONE:None, TRUE:True, FALSE:False}
+MAGIC    = '\x00'
+MAXINT   = 2**31
+MAXLONG  = 2**63
+MAXSHORT = 2**16
+
+
+class BinaryRowCodec(RowCodec):
+    '''A compact binary format. Values are stored in the order of the
+model fields as:
+
+* a magic byte, ``\\x00``, which never starts a pickle,
+* the number of values, therefore a model can have at most 255 fields,
+* one type code for each value,
+* numbers and string lengths packed with :mod:`struct`,
+* the strings.
+
+Rows which do not start with the magic byte are unpickled, so that
+tables written with :class:`PickleRowCodec` can still be read. They are
+converted to the binary format when changed objects are saved.'''
+    def __init__(self, meta):
+        super(BinaryRowCodec,self).__init__(meta)
+        self._structs  = {}
+        self._decoders = {}
+
+    def struct(self, codes):
+        '''Compiled :class:`struct.Struct` for the type *codes* of a row.
+They are cached since rows of a model usually share the same codes.'''
+        s = self._structs.get(codes)
+        if s is None:
+            s = struct.Struct('>' + ''.join((formats[c] for c in codes)))
+            self._structs[codes] = s
+        return s
+
+    def dumps(self, data):
+        codes  = []
+        values = []
+        blobs  = []
+        for value in data:
+            if value is None:
+                codes.append(NONE)
+            elif value is True:
+                codes.append(TRUE)
+            elif value is False:
+                codes.append(FALSE)
+            elif isinstance(value,(int,long)) and -MAXLONG <= value < MAXLONG:
+                codes.append(INT if -MAXINT <= value < MAXINT else LONG)
+                values.append(value)
+            elif isinstance(value,float):
+                codes.append(FLOAT)
+                values.append(value)
+            else:
+                if isinstance(value,str):
+                    code = STR
+                elif isinstance(value,unicode):
+                    code  = UNICODE
+                    value = value.encode('utf-8')
+                else:
+                    code  = PICKLE
+                    value = pickle.dumps(value,2)
+                if code != PICKLE and len(value) >= MAXSHORT:
+                    code = code.upper()
+                codes.append(code)
+                values.append(len(value))
+                blobs.append(value)
+        codes = ''.join(codes)
+        return ''.join((MAGIC,chr(len(codes)),codes,
+                        self.struct(codes).pack(*values))) + ''.join(blobs)
+
+    def decoder(self, codes):
+        '''Function decoding rows with type *codes*. It is compiled, and cached,
+the first time *codes* are found, so that numbers and string lengths are
+unpacked at once and values are placed without branching on their types.'''
+        decode = self._decoders.get(codes)
+        if decode is None:
+            s     = self.struct(codes)
+            pos   = 2 + len(codes)
+            lines = ['def decode(row):',
+                     '    v = unpack_from(row,%s)' % pos,
+                     '    p = %s' % (pos + s.size)]
+            data  = []
+            n     = 0
+            for i,code in enumerate(codes):
+                if code in constants:
+                    data.append(repr(constants[code]))
+                    continue
+                if code in strings:
+                    if code == UNICODE or code == LUNICODE:
+                        value = 'row[p:e].decode("utf-8")'
+                    elif code == PICKLE:
+                        value = 'loads(row[p:e])'
+                    else:
+                        value = 'row[p:e]'
+                    lines.extend(('    e = p + v[%s]' % n,
+                                  '    s%s = %s' % (i,value),
+                                  '    p = e'))
+                    data.append('s%s' % i)
+                else:
+                    data.append('v[%s]' % n)
+                n += 1
+            lines.append('    return [%s]' % ', '.join(data))
+            namespace = {'unpack_from': s.unpack_from, 'loads': pickle.loads}
+            exec(compile('\n'.join(lines),'<row %s>' % codes,'exec'), namespace)
+            decode = namespace['decode']
+            self._decoders[codes] = decode
+        return decode
+        
+    def loads(self, row):
+        if row[:1] != MAGIC:
+            return pickle.loads(row)
+        codes  = row[2:2+ord(row[1])]
+        decode = self._decoders.get(codes)
+        if decode is None:
+            decode = self.decoder(codes)
+        return decode(row)
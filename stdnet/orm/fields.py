@@ -54,7 +54,13 @@ Each field is specified as a :class:`stdnet.orm.StdModel` class attribute.
 
 .. attribute:: ordered
 
-    If ``True``, the field is ordered. if :attr:`Field.unique` is ``True`` this has no effect.
+    If ``True``, the field maintains an ordered index, implemented as
+    a :class:`stdnet.OrderedSet` of object ids scored by the field value,
+    which is used to sort querysets efficiently
+    (see :meth:`stdnet.orm.query.QuerySet.order_by`) and for range lookups
+    (``__gt``, ``__gte``, ``__lt``, ``__lte`` and ``__range``).
+    Only fields with numeric serialized values, such as :class:`IntegerField`,
+    :class:`FloatField`, :class:`DateField` and :class:`DateTimeField`, can be ordered.
     
     Default ``False``.
     
@@ -81,6 +87,11 @@ Each field is specified as a :class:`stdnet.orm.StdModel` class attribute.
 
     Field name, created by the ``orm`` at runtime.
     
+.. attribute:: attname
+
+    Name of the instance attribute holding the field serialized value.
+    It is the same as :attr:`name` except for :class:`ForeignKey` fields.
+    
 .. attribute:: model
 
     The :class:`stdnet.orm.StdModel` holding the field.
@@ -102,6 +113,7 @@ Each field is specified as a :class:`stdnet.orm.StdModel` class attribute.
         self.ordered  = ordered
         self.meta     = None
         self.name     = None
+        self.attname  = None
         self.model    = None
         self.default  = default if default is not NoValue else self.default
         
@@ -125,9 +137,10 @@ class when :class:`stdnet.orm.base.Metaclass` is initialised. It fills
 function users should never call.'''
         if self.name:
             raise FieldError('Field %s is already registered with a model' % self)
-        self.name  = name
-        self.model = model
-        self.meta  = model._meta
+        self.name    = name
+        self.attname = name
+        self.model   = model
+        self.meta    = model._meta
         self.meta.dfields[name] = self
         if name is not 'id':
             self.meta.fields.append(self)
@@ -145,6 +158,15 @@ an object to the remote data server. It return s a serializable representation o
 If an error occurs it raises :class:`stdnet.exceptions.FieldValueError`'''
         return value
     
+    def scorefun(self, value):
+        '''Convert the serialized *value* into the number used as score
+in the ordered index of the field. It raises :class:`stdnet.exceptions.FieldValueError`
+if this is not possible.'''
+        try:
+            return float(value)
+        except (ValueError, TypeError):
+            raise FieldValueError('Field %s cannot be ordered. %s is not a number' % (self,value))
+    
     def isvalid(self):
         '''Return ``True`` if Field is valid otherwise raise a ``FieldError`` exception.'''
         name    = self.name
@@ -213,7 +235,7 @@ of other entities.'''
 class IntegerField(AtomField):
     '''An integer :class:`AtomField`.'''
     type = 'integer'
-    def serialise(self, value):
+    def serialize(self, value):
         if value is not None:
             try:
                 return int(value)
@@ -225,7 +247,7 @@ class IntegerField(AtomField):
 class BooleanField(AtomField):
     '''An boolean :class:`AtomField`'''
     type = 'bool'
-    def serialise(self, value):
+    def serialize(self, value):
         return True if value else False
         
     
@@ -238,7 +260,7 @@ if you don't specify otherwise.
     def serialize(self, value):
         if not value:
             value = self.meta.cursor.incr(self.meta.autoid())
-        return super(AutoField,self).serialise(value)
+        return super(AutoField,self).serialize(value)
 
 
 class FloatField(AtomField):
@@ -286,7 +308,7 @@ a :class:`datetime.datetime` instance.'''
     def serialize(self, value):
         if value is not None:
             if isinstance(value,date):
-                value = timestamp2date(value)
+                value = date2timestamp(value)
             else:
                 raise FieldValueError('Field %s is not a valid datetime' % self)
         return value
@@ -343,26 +365,55 @@ back to self. For example::
                                model,
                                relmanager = RelatedManager,
                                related_name = related_name)
-        self.__value_obj = _novalue
         self.index = True
+        
+    def register_with_model(self, name, related):
+        # The field is a descriptor of the model holding it and the
+        # related manager a descriptor of the referred model, which
+        # is kept in the model attribute.
+        model = self.model
+        Field.register_with_model(self, name, related)
+        self.model = model
+        self.attname   = '%s_id' % name
+        self.cachename = '_%s_cache' % name
+        setattr(related,name,self)
+        self.register_related(name, related)
+        
+    def register_related(self, name, related):
+        manager = self.register_with_related_model(name, related)
+        if manager is not None:
+            setattr(self.model,self.related_name,manager)
+        
+    def __get__(self, instance, instance_type = None):
+        if instance is None:
+            return self
+        return self.get_full_value(instance)
     
-    def set_value(self, name, obj, value):
-        value = super(ForeignKey,self).set_value(name,obj,value)
+    def __set__(self, instance, value):
         if isinstance(value,self.model):
-            self.__value_obj = value
-            self._value = value.id
-    
-    def get_full_value(self):
-        v = self.__value_obj
-        if isinstance(v,NoValue):
-            if self._value:
-                meta    = self.model._meta
-                hash    = meta.cursor.hash(meta.basekey())
-                v       = hash.get(self._value)
-            else:
+            instance.__dict__[self.cachename] = value
+            value = value.id
+        else:
+            instance.__dict__.pop(self.cachename,None)
+        instance.__dict__[self.attname] = value
+    
+    def get_full_value(self, instance):
+        '''Return the related object, fetching it from the server
+the first time it is accessed.'''
+        try:
+            return instance.__dict__[self.cachename]
+        except KeyError:
+            id = getattr(instance,self.attname,None)
+            if id is None:
                 v = None
-            self.__value_obj = v
-        return v
+            else:
+                meta = self.model._meta
+                v    = meta.cursor.get_object(meta,'id',id)
+            instance.__dict__[self.cachename] = v
+            return v
+    
+    def serialize(self, value):
+        return self.get_value(value)
     
     def get_value(self, value):
         if isinstance(value,self.model):
@@ -8,7 +8,9 @@ def clearall():
         meta.cursor.clear()
 
 def register(model, backend = None, keyprefix = None, timeout = 0):
-    '''Register a :class:`stdnet.rom.StdNet` model with a backend data server.'''
+    '''Register a :class:`stdnet.rom.StdNet` model with a backend data server.
+If *backend* lists several servers, the model is stored in the server
+its base key is mapped to by consistent hashing.'''
     global _registry
     from stdnet.conf import settings
     backend = backend or settings.DEFAULT_BACKEND
@@ -24,7 +26,7 @@ def register(model, backend = None, keyprefix = None, timeout = 0):
     else:
         objects = copy.copy(objects)
     model.objects    = objects
-    meta.cursor      = getdb(backend)
+    meta.cursor      = getdb(backend, key = meta.basekey())
     objects.model    = model
     objects._meta    = meta
     objects.cursor   = meta.cursor
@@ -3,6 +3,7 @@ from itertools import izip
 
 from base import StdNetType
 from fields import _novalue
+from query import delete_instance, increment_field
 from stdnet.exceptions import *
 
 
@@ -78,28 +79,132 @@ the :attr:`StdModel._meta` attribute.
         else:
             self.__dict__[name] = value
     
-    def save(self, commit = True):
+    def __getattr__(self, name):
+        # Called when name is not an attribute of the instance, which
+        # is the case for fields not loaded (see QuerySet.only).
+        meta = self._meta
+        if not name.startswith('__') and self.__dict__.get('id'):
+            for field in meta.fields:
+                if field.attname == name:
+                    fields, rows = meta.cursor.get_rows(meta, (self.id,), (field,))
+                    if rows[0] is not None:
+                        value = rows[0][fields.index(field)]
+                        self.__dict__.setdefault('_dbdata',{})[field.name] = value
+                        value = field.to_python(value)
+                        setattr(self,name,value)
+                        return value
+        raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__,name))
+    
+    def save(self, commit = True, update_fields = None, check_version = False):
         '''Save the instance in the remote :class:`stdnet.HashTable`
 The model must be registered with a backend
-otherwise a ``ModelNotRegistered`` exception will be raised.'''
+otherwise a ``ModelNotRegistered`` exception will be raised.
+
+* *commit* if ``False`` the instance is sent to the server with the next
+  model ``commit``.
+* *update_fields* optional list of names of fields to save.
+* *check_version* if ``True`` the save fails with :class:`stdnet.StaleObjectError`
+  if the instance was saved by someone else since it was loaded. It requires
+  a model with a :attr:`stdnet.orm.base.Metaclass.version` field.
+
+Instances loaded from the server keep a snapshot of the server data, so that
+only changed fields are saved and only the indexes of changed fields are updated.
+If nothing has changed no data is sent to the server.
+If the model :attr:`stdnet.orm.base.Metaclass.storage` is ``"hash"`` only
+changed fields are written, and fields which were not loaded
+(see :meth:`stdnet.orm.query.QuerySet.only`) are never saved.
+Otherwise the whole row is rewritten, with server values for fields
+not in *update_fields*.'''
         meta = self._meta
         if not meta.cursor:
             raise ModelNotRegistered('Model %s is not registered with a backend database. Cannot save any instance.' % meta.name)
-        data = []
-        indexes = []
+        if update_fields is not None:
+            for name in update_fields:
+                if name not in meta.dfields:
+                    raise FieldError('Cannot update unknown field %s' % name)
+        version  = meta.version
+        if check_version and version is None:
+            raise FieldError('Cannot check version of %s. Model is not versioned.' % meta)
+        dbdata   = self.__dict__.get('_dbdata')
+        hashed   = meta.storage == 'hash'
+        fields   = []
+        data     = []
+        indexes  = []
+        discards = []
+        changed  = False
+        newversion = None
         for field in meta.fields:
-            name = field.name
-            value = getattr(self,name,None)
-            serializable = field.serialize(value)
-            if serializable is None and field.required:
+            name  = field.name
+            if field is version:
+                # the version is always written and does not count as a change
+                newversion = (dbdata.get(name) if dbdata else None) or 0
+                newversion += 1
+                fields.append(field)
+                data.append(newversion)
+                continue
+            saved = update_fields is None or name in update_fields
+            if hashed:
+                if not saved or field.attname not in self.__dict__:
+                    continue
+            elif not saved and dbdata and name in dbdata:
+                # keep the server value
+                fields.append(field)
+                data.append(dbdata[name])
+                continue
+            value = field.serialize(getattr(self,field.attname,None))
+            if value is None and field.required:
                 raise FieldError('Field %s has no value for %s' % (field,self))
-            data.append(serializable)
-            if field.index:
-                indexes.append((field,serializable))
+            old = dbdata.get(name,_novalue) if dbdata is not None else _novalue
+            if old is _novalue or old != value:
+                changed = True
+                if field.index or field.ordered:
+                    indexes.append((field,value))
+                    if old is not _novalue:
+                        discards.append((field,old))
+            elif hashed:
+                continue
+            fields.append(field)
+            data.append(value)
+        if dbdata is not None and not changed:
+            if commit and meta.multifields:
+                # send pending changes of data-structure fields
+                meta.cursor.commit()
+            return self
         self.id = meta.pk.serialize(self.id)
-        meta.cursor.add_object(self, data, indexes, commit = commit)
+        meta.cursor.add_object(self, data, indexes, commit = commit,
+                               fields = fields, discards = discards,
+                               version = newversion, check_version = check_version)
+        dbdata = dict(dbdata or ())
+        dbdata.update(izip((field.name for field in fields),data))
+        self._dbdata = dbdata
+        if version is not None:
+            setattr(self,version.attname,newversion)
         return self
     
+    def increment(self, name, delta = 1):
+        '''Increment the numeric field *name* by *delta* on the server and return
+its new value, which is also set on the instance. Unlike changing the field
+and saving, no data is read and concurrent increments are never lost
+(see :meth:`stdnet.orm.query.QuerySet.increment`).'''
+        meta  = self._meta
+        if not self.id:
+            raise StdNetException('Cannot increment field. Object was never saved.')
+        field  = increment_field(meta, name)
+        values = meta.cursor.increment(meta, (self.id,), field, field.serialize(delta))
+        value  = values.get(str(self.id))
+        if value is None:
+            raise ObjectNotFund
+        dbdata = self.__dict__.get('_dbdata')
+        changes = [(field,value)]
+        version = meta.version
+        if version is not None and dbdata and dbdata.get(version.name) is not None:
+            changes.append((version,dbdata[version.name]+1))
+        for fld,v in changes:
+            setattr(self,fld.attname,fld.to_python(v))
+            if dbdata is not None:
+                dbdata[fld.name] = v
+        return getattr(self,field.attname)
+    
     def isvalid(self):
         return self.meta.isvalid()
         
@@ -117,16 +222,15 @@ otherwise a ``ModelNotRegistered`` exception will be raised.'''
         
     def delete(self):
         '''Delete an instance from database. If the instance is not available (it does not have an id) and
-``StdNetException`` exception will raise.'''
-        meta = self._meta
+``StdNetException`` exception will raise. Objects referring to the instance
+are deleted in cascade, without loading them (see
+:meth:`stdnet.orm.query.QuerySet.delete`). Return the number of
+deleted objects.'''
         if not self.id:
             raise StdNetException('Cannot delete object. It was never saved.')
-        # Gather related objects to delete
-        objs = meta.related_objects()
-        T = 0
-        for obj in objs:
-            T += obj.delete()
-        return T + meta.cursor.delete_object(self)
+        deleted = {}
+        delete_instance(self, deleted)
+        return sum(deleted.itervalues())
     
     def todict(self):
         odict = self.__dict__.copy()
@@ -2,41 +2,127 @@ from copy import copy
 from itertools import izip
 
 from stdnet.exceptions import *
+from stdnet.utils import chunks
+from related import RelatedObject
 
 
-class svset(object):
+range_lookups = ('gt','gte','lt','lte','range')
+
+
+def delete_instance(obj, deleted):
+    '''Delete *obj* and, in cascade, the objects referring to it.
+The number of deleted objects of each model is added to the *deleted*
+dictionary.'''
+    meta = obj._meta
+    for name,manager in meta.related.iteritems():
+        # models not registered cannot have instances
+        if manager.related._meta.cursor:
+            getattr(obj,name).all()._delete(deleted)
+    n = meta.cursor.delete_object(obj)
+    deleted[meta.model] = deleted.get(meta.model,0) + n
     
+    
+def delete_query(meta, result, deleted):
+    '''Delete the objects of model *meta* whose ids are in the server set
+*result* and, in cascade, the objects referring to them. Ids of related
+objects are found via the index sets of their foreign keys before
+*result* is deleted.'''
+    related = []
+    for manager in meta.related.itervalues():
+        rmeta = manager.related._meta
+        if rmeta.cursor:
+            related.append((rmeta,rmeta.cursor.related_ids(rmeta, manager.fieldname, result)))
+    n = meta.cursor.delete_query(meta, result)
+    deleted[meta.model] = deleted.get(meta.model,0) + n
+    for rmeta,rresult in related:
+        if len(rresult):
+            delete_query(rmeta, rresult, deleted)
+
+
+def increment_field(meta, name):
+    '''Return the field *name* of model *meta* if it can be incremented
+on the server, otherwise raise :class:`stdnet.FieldError`.'''
+    from fields import IntegerField, FloatField, AutoField
+    from codec import BinaryRowCodec
+    field = meta.dfields.get(name)
+    if field is None:
+        raise FieldError('Cannot increment unknown field %s' % name)
+    if not isinstance(field,(IntegerField,FloatField)) or isinstance(field,AutoField)\
+            or field.unique or field is meta.version:
+        raise FieldError('Cannot increment field %s. Only numeric fields which are not unique can be incremented.' % field)
+    if not isinstance(meta.codec,BinaryRowCodec):
+        raise FieldError('Cannot increment field %s. It requires the binary row codec.' % field)
+    return field
+
+
+def lookups(kwargs):
+    '''Return the lookup parameters *kwargs*, a dictionary or a sequence
+of ``(lookup, value)`` pairs, as a tuple of pairs.'''
+    if not kwargs:
+        return ()
+    if isinstance(kwargs,dict):
+        kwargs = kwargs.iteritems()
+    return tuple(kwargs)
+
+
+class svset(object):
+    '''Result of a lookup on a unique field: a single object or ``None``.'''
     def __init__(self, result):
         self.result = result
         
     def __len__(self):
-        return 1
+        return 0 if self.result is None else 1
     
 
 
 class QuerySet(object):
-    '''Queryset manager'''
+    '''Queryset manager. A queryset is lazy: no request is sent to the server
+until objects, or their number, are needed. Methods such as :meth:`filter`
+and :meth:`exclude` return a new queryset and never change the queryset
+they are called on. Once evaluated, a queryset keeps its result, so that
+:meth:`count`, ``len``, :meth:`exists` and iteration on the same queryset
+reuse the data already fetched.'''
     
-    def __init__(self, meta, fargs = None, eargs = None):
+    def __init__(self, meta, fargs = None, eargs = None, ordering = None,
+                 related = None, fields = None):
         '''A query set is  initialized with
         
         * *meta* an model instance meta attribute,
-        * *fargs* dictionary containing the lookup parameters to include.
-        * *eargs* dictionary containing the lookup parameters to exclude.
+        * *fargs* dictionary or sequence of ``(lookup, value)`` pairs containing
+          the lookup parameters to include.
+        * *eargs* dictionary or sequence of ``(lookup, value)`` pairs containing
+          the lookup parameters to exclude.
+        * *ordering* optional name of the field used to sort the queryset.
+          If it starts with ``-`` the ordering is descending.
+        * *related* optional tuple of :class:`stdnet.orm.ForeignKey` names
+          whose related objects are loaded with the queryset
+          (see :meth:`select_related`).
+        * *fields* optional tuple of names of the fields to load
+          (see :meth:`only` and :meth:`defer`).
         '''
-        self._meta  = meta
-        self.fargs  = fargs
-        self.eargs  = eargs
-        self.qset   = None
-        self._seq   = None
+        self._meta    = meta
+        self.fargs    = lookups(fargs)
+        self.eargs    = lookups(eargs)
+        self.ordering = ordering
+        self.related  = related
+        self.fields   = fields
+        self.qset     = None
+        self._seq     = None
+        self._count   = None
         
     def __repr__(self):
         if self._seq is None:
             s = self.__class__.__name__
             if self.fargs:
-                s = '%s.filter(%s)' % (s,self.fargs)
+                s = '%s.filter(%s)' % (s,', '.join(('%s=%r' % l for l in self.fargs)))
             if self.eargs:
-                s = '%s.exclude(%s)' % (s,self.eargs)
+                s = '%s.exclude(%s)' % (s,', '.join(('%s=%r' % l for l in self.eargs)))
+            if self.ordering:
+                s = '%s.order_by(%s)' % (s,self.ordering)
+            if self.related:
+                s = '%s.select_related(%s)' % (s,', '.join(self.related))
+            if self.fields:
+                s = '%s.only(%s)' % (s,', '.join(self.fields))
             return s
         else:
             return str(self._seq)
@@ -44,19 +130,97 @@ class QuerySet(object):
     def __str__(self):
         return self.__repr__()
     
-    def get(self, index):
+    def __getitem__(self, index):
+        '''Return the object at *index* or, if *index* is a slice, a list of objects.
+If the queryset is sorted on the server (see :meth:`order_by`) and its results
+are not cached, only the requested objects are fetched.'''
+        if self._seq is None and self._ordering()[2]:
+            if isinstance(index,slice):
+                start = index.start or 0
+                stop  = index.stop
+                if start >= 0 and (stop is None or stop >= 0) and index.step in (None,1):
+                    return list(self._items(None, start, stop))
+            elif index >= 0:
+                for obj in self._items(None, index, index+1):
+                    return obj
+                raise IndexError('QuerySet index out of range')
         return self._unwind()[index]
-    __getitem__ = get
+    
+    def _clone(self, **kwargs):
+        params = {'fargs':self.fargs,
+                  'eargs':self.eargs,
+                  'ordering':self.ordering,
+                  'related':self.related,
+                  'fields':self.fields}
+        params.update(kwargs)
+        return self.__class__(self._meta, **params)
     
     def filter(self,**kwargs):
-        '''Returns a new ``QuerySet`` containing objects that match the given lookup parameters.'''
-        kwargs.update(self.fargs)
-        return self.__class__(self._meta,fargs=kwargs,eargs=self.eargs)
+        '''Returns a new ``QuerySet`` containing objects that match the given lookup
+parameters and the lookup parameters of ``self``.'''
+        return self._clone(fargs = self.fargs + lookups(kwargs))
     
     def exclude(self,**kwargs):
-        '''Returns a new ``QuerySet`` containing objects that do not match the given lookup parameters.'''
-        kwargs.update(self.eargs)
-        return self.__class__(self._meta,fargs=self.fargs,eargs=kwargs)
+        '''Returns a new ``QuerySet`` which also excludes objects matching all
+the given lookup parameters and the exclude parameters of ``self``.'''
+        return self._clone(eargs = self.eargs + lookups(kwargs))
+    
+    def order_by(self, name):
+        '''Returns a new ``QuerySet`` sorted by the field *name*. If *name* starts with
+``-`` the ordering is descending. Sorting by ``id`` or by an
+:attr:`stdnet.orm.Field.ordered` field is performed on the server and slicing
+fetches only the requested objects, for example::
+
+    Position.objects.all().order_by('-size')[:50]
+    
+Sorting by any other field requires fetching all objects in the queryset.'''
+        fname = name[1:] if name.startswith('-') else name
+        if fname not in self._meta.dfields:
+            raise QuerySetError("Could not order. Field %s not defined." % fname)
+        return self._clone(ordering = name)
+    
+    def select_related(self, *names):
+        '''Returns a new ``QuerySet`` which loads the objects related by the
+:class:`stdnet.orm.ForeignKey` fields *names* together with its own objects.
+For each page of results, the related ids are collected and fetched with a single
+request per related model, so that accessing the fields does not
+hit the server again::
+
+    for p in Position.objects.all().select_related('instrument','fund'):
+        print p.instrument, p.fund
+'''
+        for name in names:
+            field = self._meta.dfields.get(name)
+            if not isinstance(field,RelatedObject):
+                raise QuerySetError("Could not select related. %s is not a foreign key." % name)
+        related = tuple(self.related or ()) + tuple(n for n in names if n not in (self.related or ()))
+        return self._clone(related = related)
+    
+    def only(self, *names):
+        '''Returns a new ``QuerySet`` which loads only the fields *names*
+of its objects. Other fields are loaded, one at a time, when accessed.
+Partial loading requires models with ``"hash"``
+:attr:`stdnet.orm.base.Metaclass.storage`, where only the requested
+fields are fetched from the server. For models stored in rows
+all fields are loaded.'''
+        dfields = self._meta.dfields
+        for name in names:
+            if name not in dfields:
+                raise QuerySetError("Could not load. Field %s not defined." % name)
+        # the version is needed for saving
+        version = self._meta.version
+        fields = tuple(f.name for f in self._meta.fields if f.name in names or f is version)
+        return self._clone(fields = fields)
+    
+    def defer(self, *names):
+        '''Returns a new ``QuerySet`` which does not load the fields *names*.
+It is the complement of :meth:`only`.'''
+        dfields = self._meta.dfields
+        for name in names:
+            if name not in dfields:
+                raise QuerySetError("Could not defer. Field %s not defined." % name)
+        loaded = self.fields or [f.name for f in self._meta.fields]
+        return self.only(*[name for name in loaded if name not in names])
     
     #def getid(self, id):
     #    meta = self._meta
@@ -64,118 +228,322 @@ class QuerySet(object):
     
     def count(self):
         '''Return the number of objects in ``self`` without
-fetching objects.'''
-        self.buildquery()
-        if self.qset == 'all':
-            meta = self._meta
-            return meta.table().size()
-        else:
-            return len(self.qset)
+fetching objects. The number is evaluated once, with the query, or taken
+from the objects already fetched.'''
+        if self._seq is not None:
+            return len(self._seq)
+        if self._count is None:
+            self.buildquery()
+            if self.qset == 'all':
+                self._count = self._meta.table().size()
+            else:
+                self._count = len(self.qset)
+        return self._count
         
     def __len__(self):
         return self.count()
     
+    def exists(self):
+        '''Return ``True`` if the queryset contains at least one object, without
+fetching objects. If the queryset has not been evaluated yet, the query result
+is stored in the server and reused when objects are fetched, unless it was
+deleted by a write to the model, in which case the query is evaluated again.'''
+        if self._seq is not None:
+            return bool(self._seq)
+        if self._count is not None:
+            return self._count > 0
+        self.buildquery()
+        if self.qset == 'all':
+            return self.count() > 0
+        return len(self.qset) > 0
+    
     def buildquery(self):
         '''Build a queryset'''
         if self.qset is not None:
             return
         meta = self._meta
-        unique, fargs = self.aggregate(self.fargs)
+        unique, fargs, eargs = self._lookups()
         if unique:
-            self.qset = svset(meta.cursor.get_object(meta, fargs[0], fargs[1]))
+            try:
+                obj = meta.cursor.get_object(meta, unique[0], unique[1])
+            except ObjectNotFund:
+                obj = None
+            self.qset = svset(obj)
         else:
-            if self.eargs:
-                unique, eargs = self.aggregate(self.eargs, False)
-            else:
-                eargs = None
             self.qset = self._meta.cursor.query(meta, fargs, eargs)
         
+    def _lookups(self):
+        '''Aggregate the lookups of the queryset. If the only lookup is an exact
+lookup on a unique field, return its ``(field name, value)`` tuple, which
+is resolved to a single id, otherwise ``None`` followed by the aggregated
+filter and exclude lookups.'''
+        unique, fargs = self.aggregate(self.fargs, not self.eargs)
+        if unique:
+            return fargs, None, None
+        eargs = self.aggregate(self.eargs, False)[1] if self.eargs else None
+        return None, fargs, eargs
+        
     def aggregate(self, kwargs, filter = True):
-        '''Aggregate lookup parameters.'''
-        unique  = False
-        meta    = self._meta
-        fields  = meta.dfields
-        result  = {}
+        '''Aggregate lookup parameters *kwargs*, a dictionary or a sequence of
+``(lookup, value)`` pairs, into a list of ``(field name, lookup, value)``
+tuples. *lookup* is either ``"in"``, in which case *value* is a list of serialized values,
+``"unique"``, the same for a unique field, or ``"range"``, in which case *value* is a two elements tuple with the lower and
+upper bounds of the field score. Each bound is ``None`` (unbounded) or a
+``(score, inclusive)`` tuple. Several range lookups on the same field are merged.
+If *filter* is ``True`` and the only lookup is an exact lookup on a unique
+field, it returns ``True`` and the ``(field name, value)`` tuple.'''
+        fields  = self._meta.dfields
+        result  = []
+        ranges  = {}
+        kwargs  = lookups(kwargs)
         # Loop over 
-        for name,value in kwargs.items():
+        for name,value in kwargs:
             names = name.split('__')
             N = len(names)
+            field = fields.get(names[0],None)
+            if not field:
+                raise QuerySetError("Could not filter. Field %s not defined." % names[0])
             # simple lookup for example filter(name = 'pippo')
             if N == 1:
-                field = fields.get(name,None)
-                if not field:
-                    raise QuerySetError("Could not filter. Field %s not defined." % name)
                 value = field.serialize(value)
-                unique = field.unique
-            # group lookup filter(name_in ['pippo','luca'])
+                if field.unique and filter and len(kwargs) == 1:
+                    return True, (name,value)
+                if not field.index and field.ordered:
+                    score = field.scorefun(value)
+                    self._range(ranges, field, (score,True), (score,True))
+                    continue
+                values = [value]
+            # group lookup filter(name__in = ['pippo','luca'])
             elif N == 2 and names[1] == 'in':
-                field = meta.fields.get(names[0],None)
-                if not field:
-                    raise QuerySetError("Could not filter. Field %s not defined." % names[0])
-                value = field.hash(value)
+                values = [field.serialize(v) for v in value]
+            # range lookup filter(dt__gte = date(2010,1,1))
+            elif N == 2 and names[1] in range_lookups:
+                if not field.ordered:
+                    raise QuerySetError("Could not filter. Field %s is not ordered." % names[0])
+                score = lambda v : field.scorefun(field.serialize(v))
+                lookup = names[1]
+                if lookup == 'range':
+                    self._range(ranges, field, (score(value[0]),True), (score(value[1]),True))
+                elif lookup in ('gt','gte'):
+                    self._range(ranges, field, (score(value),lookup == 'gte'), None)
+                else:
+                    self._range(ranges, field, None, (score(value),lookup == 'lte'))
+                continue
             else: 
                 # Nested lookup. Not available yet!
                 raise NotImplementedError("Nested lookup is not yet available")
-                      
-            if unique:
-                result[name] = value
-                if filter:
-                    result = name,value
-                    unique = True
-                    break
-                else:
-                    result[name] = value   
-            elif field.index:
-                result[name] = value
-            else:
-                raise ValueError("Field %s is not an index" % name)
-        return unique, result
+            if not field.index:
+                raise ValueError("Field %s is not an index" % names[0])
+            result.append((field.name,'unique' if field.unique else 'in',values))
+        for name,bounds in ranges.iteritems():
+            result.append((name,'range',bounds))
+        return False, result
+    
+    def _range(self, ranges, field, low, high):
+        '''Narrow the score range of *field* in *ranges* with bounds *low* and *high*'''
+        clow, chigh = ranges.get(field.name,(None,None))
+        if low is not None and clow is not None:
+            # the larger bound is the tighter, exclusive bounds are tighter than inclusive ones
+            low = max(low, clow, key = lambda b : (b[0],not b[1]))
+        if high is not None and chigh is not None:
+            high = min(high, chigh)
+        ranges[field.name] = (low if low is not None else clow,
+                              high if high is not None else chigh)
     
     def get(self):
         self.buildquery()
-        if len(self.qset) == 1:
-            try:
-                return self.qset.result
-            except:
-                id = tuple(self.qset)[0]
-                meta = self._meta
-                return meta.cursor.hash(meta.basekey()).get(id)
+        N = len(self.qset)
+        if N == 1:
+            for obj in self.items():
+                return obj
+        elif not N:
+            raise ObjectNotFund
         else:
             raise QuerySetError('Get query yielded non unique results')
         
     def items(self):
         '''Generator of instances in queryset.'''
+        return self._items(None)
+    
+    def iterator(self, chunk_size = 1000):
+        '''Generator of instances in queryset which, unlike iterating over
+the queryset, does not cache results. Data is fetched from the server
+in chunks of *chunk_size* objects so that memory usage does not depend
+on the size of the model table.'''
+        return self._items(chunk_size)
+    
+    def _ordering(self):
+        '''Return a tuple containing the name of the field used for sorting,
+``True`` if the ordering is descending and ``True`` if sorting
+is performed on the server.'''
+        name = self.ordering
+        if not name:
+            return None, False, False
+        desc = name.startswith('-')
+        if desc:
+            name = name[1:]
+        return name, desc, name == 'id' or self._meta.dfields[name].ordered
+    
+    def _items(self, chunk_size, start = 0, stop = None):
+        items = self._sorted_items(chunk_size, start, stop)
+        if self.related:
+            items = self._related_items(items, chunk_size)
+        return items
+    
+    def _related_items(self, items, chunk_size):
+        '''Attach related objects to pages of *items*, using one request
+for each related model.'''
+        fields = [self._meta.dfields[name] for name in self.related]
+        for page in chunks(items, chunk_size or 1000):
+            ids = {}
+            for field in fields:
+                rids = ids.setdefault(field.model,set())
+                for obj in page:
+                    rid = getattr(obj,field.attname,None)
+                    if rid is not None:
+                        rids.add(rid)
+            related = {}
+            for model,rids in ids.iteritems():
+                meta = model._meta
+                related[model] = meta.cursor.get_objects(meta, rids)
+            for obj in page:
+                for field in fields:
+                    rid = getattr(obj,field.attname,None)
+                    if rid is not None:
+                        # the id is kept even if the related object is missing
+                        obj.__dict__[field.cachename] = related[field.model].get(rid)
+                yield obj
+        
+    def _sorted_items(self, chunk_size, start = 0, stop = None):
         self.buildquery()
+        name, desc, server = self._ordering()
+        if name is None or isinstance(self.qset,svset):
+            items = self._unordered_items(chunk_size)
+            if start or stop is not None:
+                items = iter(list(items)[start:stop])
+            return items
+        elif server:
+            return self._ordered_items(chunk_size, name, desc, start, stop)
+        else:
+            items = sorted(self._unordered_items(chunk_size),
+                           key = lambda obj : getattr(obj,name,None),
+                           reverse = desc)
+            return iter(items[start:stop])
+        
+    def _unordered_items(self, chunk_size):
         meta  = self._meta
         model = meta.make
         ids   = self.qset
         if isinstance(ids,svset):
-            yield ids.result
+            if ids.result is not None:
+                yield ids.result
         else:
             hash = meta.table()
             if ids == 'all':
-                for id,val in hash.items():
-                    yield model(id,val)
+                items = hash.scan(chunk_size) if chunk_size else hash.items()
+                if meta.storage == 'row':
+                    for id,val in items:
+                        yield model(id,val)
+                else:
+                    for cids in chunks((id for id,val in items),chunk_size or 1000):
+                        for obj in self._load(cids):
+                            yield obj
             else:
-                for id,val in izip(ids,hash.mget(ids)):
-                    yield model(id,val)
-    
+                chunk_size = chunk_size or 1000
+                for cids in chunks(ids.ids(chunk_size),chunk_size):
+                    for obj in self._load(cids):
+                        yield obj
+                        
+    def _ordered_items(self, chunk_size, name, desc, start, stop):
+        meta  = self._meta
+        ids   = meta.cursor.ordered_ids(meta, self.qset, name, desc, start, stop)
+        for cids in chunks(ids,chunk_size or 1000):
+            for obj in self._load(cids):
+                yield obj
+                
+    def _load(self, ids):
+        '''Generator of instances with *ids* fetched with a single request'''
+        meta = self._meta
+        fields = None
+        if self.fields:
+            fields = [meta.dfields[name] for name in self.fields]
+        fields, rows = meta.cursor.get_rows(meta, ids, fields)
+        for id,data in izip(ids,rows):
+            if data is not None:
+                yield meta.make(id,data,fields)
+        
     def __iter__(self):
         if self._seq is None:
             self._seq = list(self.items())
         return self._seq.__iter__()
                 
     def _unwind(self):
-        if not self._seq:
+        if self._seq is None:
             self._seq = list(self)
         return self._seq
     
     def delete(self):
-        '''Delete all the element in the queryset'''
-        T = 0
-        for el in self:
-            T += el.delete()
-        return T
+        '''Delete all the objects in the queryset and, in cascade, the objects
+referring to them via :class:`stdnet.orm.ForeignKey` fields. Objects are not
+loaded: their ids are selected on the server, as in :meth:`count`, and the
+ids of related objects are found from the index sets of the foreign keys.
+Rows of the :class:`stdnet.orm.BinaryRowCodec` are decoded on the server to
+find the index entries of the objects, while rows of other codecs, and rows
+pickled by previous versions, are read by the backend.
+Return the number of deleted objects. The number of deleted objects
+of each model is available in the :attr:`deleted` dictionary afterwards::
+
+    qs = Instrument.objects.filter(ccy = 'EUR')
+    n  = qs.delete()
+    positions = qs.deleted.get(Position,0)
+'''
+        deleted = {}
+        self._delete(deleted)
+        self.deleted = deleted
+        return sum(deleted.itervalues())
+    
+    def increment(self, **kwargs):
+        '''Increment a numeric field of all the objects in the queryset on the
+server, without loading them. The field and the increment are given as a
+keyword argument::
+
+    Position.objects.filter(fund = fund).increment(size = 10.5)
+    
+The increment is atomic, therefore concurrent increments are never lost,
+and it requires a single request. Indexes of the field are updated and,
+for versioned models, versions are incremented.
+Return a dictionary of the new values keyed by id.'''
+        if len(kwargs) != 1:
+            raise QuerySetError('Increment requires one field')
+        name,delta = kwargs.items()[0]
+        meta  = self._meta
+        field = increment_field(meta, name)
+        delta = field.serialize(delta)
+        unique, fargs, eargs = self._lookups()
+        if unique:
+            self.buildquery()
+            obj = self.qset.result
+            ids = (obj.id,) if obj is not None else ()
+        else:
+            ids = meta.cursor.query(meta, fargs, eargs)
+        self.qset = None
+        self._seq = None
+        self._count = None
+        values = meta.cursor.increment(meta, ids, field, delta)
+        return dict(((id,field.to_python(value)) for id,value in values.iteritems()))
+    
+    def _delete(self, deleted):
+        meta = self._meta
+        unique, fargs, eargs = self._lookups()
+        if unique:
+            self.buildquery()
+            if self.qset.result is not None:
+                delete_instance(self.qset.result, deleted)
+        else:
+            delete_query(meta, meta.cursor.query(meta, fargs, eargs, True), deleted)
+        self.qset = None
+        self._seq = None
+        self._count = None
     
 
 class Manager(object):
@@ -195,6 +563,90 @@ class Manager(object):
             created = True
         return res,created
     
+    def in_bulk(self, values, field = 'id'):
+        '''Retrieve the objects whose *field*, ``id`` or a unique field,
+is in *values*. Unique keys are resolved with a single request and objects are
+fetched with another one, so that many lookups cost two round-trips
+rather than two per lookup::
+    
+    instruments = Instrument.objects.in_bulk(['EURUSD','GBPUSD'], 'name')
+    
+Return a dictionary of objects keyed by value, which does not contain
+values not matching any object.'''
+        meta  = self._meta
+        fld   = meta.dfields.get(field,None)
+        if fld is None:
+            raise QuerySetError("Could not load. Field %s not defined." % field)
+        if field != 'id' and not fld.unique:
+            raise QuerySetError("Could not load. Field %s is not unique." % field)
+        values = list(values)
+        if field == 'id':
+            ids = values
+        else:
+            ids = meta.cursor.get_ids(meta, field, [fld.serialize(v) for v in values])
+        objs   = meta.cursor.get_objects(meta, [id for id in ids if id is not None])
+        result = {}
+        for value,id in izip(values,ids):
+            obj = objs.get(id) if id is not None else None
+            if obj is not None:
+                result[value] = obj
+        return result
+    
+    def bulk_create(self, objs, batch_size = None):
+        '''Save several new instances of the model with as few server
+round-trips as possible. Instances are processed in batches of *batch_size*
+objects (all at once if not provided). For each batch, ids are reserved with a single
+increment of the model id counter and all objects and indexes are written with
+a single :meth:`stdnet.BackendDataServer.commit`. Return the number of saved
+objects.'''
+        from fields import AutoField
+        meta    = self._meta
+        batches = chunks(objs,batch_size) if batch_size else (list(objs),)
+        N       = 0
+        for batch in batches:
+            new = [obj for obj in batch if not obj.id]
+            if new and isinstance(meta.pk,AutoField):
+                last = meta.cursor.incr(meta.autoid(),len(new))
+                for id,obj in izip(xrange(last-len(new)+1,last+1),new):
+                    obj.id = id
+            for obj in batch:
+                obj.save(False)
+            meta.cursor.commit()
+            N += len(batch)
+        return N
+        
+    def update_atomic(self, id, fn, retries = 10):
+        '''Update the object *id* of a versioned model (see
+:attr:`stdnet.orm.base.Metaclass.version`) with optimistic concurrency.
+The object is loaded from the primary server, bypassing caches, and passed
+to *fn*, which changes it. It is then saved with ``check_version = True``.
+If someone else saved the object in the meantime, it is loaded again and
+*fn* is called again, up to *retries* times before
+:class:`stdnet.StaleObjectError` is raised::
+
+    def buy(position):
+        position.size += 10
+        
+    Position.objects.update_atomic(pid, buy)
+    
+Return the saved object.'''
+        meta   = self._meta
+        cursor = meta.cursor
+        if meta.version is None:
+            raise FieldError('Cannot update %s atomically. Model is not versioned.' % meta)
+        for n in xrange(retries + 1):
+            with cursor.using_primary():
+                fields, rows = cursor.get_rows(meta, (id,))
+            if rows[0] is None:
+                raise ObjectNotFund
+            obj = meta.make(id, rows[0], fields)
+            fn(obj)
+            try:
+                return obj.save(check_version = True)
+            except StaleObjectError:
+                if n == retries:
+                    raise
+        
     def filter(self, **kwargs):
         return QuerySet(self._meta, fargs = kwargs)
     
@@ -204,14 +656,44 @@ class Manager(object):
     def all(self):
         return self.filter()
     
+    def order_by(self, name):
+        return self.all().order_by(name)
     
-class RelatedManager(Manager):
+    def select_related(self, *names):
+        return self.all().select_related(*names)
+    
+    def only(self, *names):
+        return self.all().only(*names)
+    
+    def defer(self, *names):
+        return self.all().defer(*names)
     
+    def using_primary(self):
+        '''Context manager which reads from the primary server, rather than
+from replicas, within its block. Use it to read objects just written::
+        
+    with Instrument.objects.using_primary():
+        inst = Instrument.objects.get(name = 'EURUSD')
+'''
+        return self._meta.cursor.using_primary()
+    
+    
+class RelatedManager(Manager):
+    '''Manager of the objects of model *related* which refer to an instance
+via the :class:`stdnet.orm.ForeignKey` field *fieldname*. It is
+a descriptor of the referred model, bound to the instance when accessed.'''
     def __init__(self, related, fieldname):
         self.related    = related
         self.fieldname  = fieldname
         self.obj        = None
         
+    def __get__(self, instance, instance_type = None):
+        if instance is None:
+            return self
+        manager = copy(self)
+        manager.obj = instance
+        return manager
+        
     def filter(self, **kwargs):
         if self.obj:
             kwargs[self.fieldname] = self.obj.id
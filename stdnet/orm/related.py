@@ -1,5 +1,14 @@
 import stdnet
 
+_pending = {}
+
+
+def register_pending(model):
+    '''Register pending relationships referring to *model* by name'''
+    for field,name,related in _pending.pop(model.__name__.lower(),()):
+        field.model = model
+        field.register_related(name,related)
+
 
 class RelatedObject(object):
     
@@ -20,11 +29,13 @@ class RelatedObject(object):
         if model == 'self':
             model = related
         if isinstance(model,basestring):
-            raise NotImplementedError
+            # model not yet defined, register when available
+            _pending.setdefault(model.lower(),[]).append((self,name,related))
+            return
         self.model = model
         meta  = model._meta
         related_name = self.related_name or '%s_set' % related._meta.name
-        if related_name not in meta.related and related_name not in meta.fields:
+        if related_name not in meta.related and related_name not in meta.dfields:
             self.related_name = related_name
             manager = self.relmanager(related,name)
             meta.related[related_name] = manager
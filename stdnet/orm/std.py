@@ -23,7 +23,10 @@ class MultiField(Field):
                 @classmethod
                 def tovalue(cls, value):
                     return value
-            
+    
+    Data-structure fields are not stored in the model table. They are descriptors
+    returning, for a saved instance, the :class:`stdnet.Structure` holding the field
+    data. Changes are sent to the server when the instance is saved.
     '''
     _pipeline = None
     
@@ -32,9 +35,9 @@ class MultiField(Field):
                  pickler = None,
                  converter = None,
                  **kwargs):
-        self.model       = model
         super(MultiField,self).__init__(required = False,
                                         **kwargs)
+        self.model       = model
         self.index       = False
         self.unique      = False
         self.primary_key = False
@@ -42,33 +45,36 @@ class MultiField(Field):
         self.converter   = converter
         
     def register_with_model(self, name, related):
-        if not self.model:
-            return
+        # the model attribute is the model of the structure values
+        model = self.model
+        Field.register_with_model(self, name, related)
+        self.model = model
+        self.meta.fields.remove(self)
+        self.meta.multifields.append(self)
+        setattr(related,name,self)
         if self.model == 'self':
             self.model = related
+        if self.model and not self.pickler:
+            self.pickler = ModelFieldPickler(self.model)
         
-    def get_full_value(self):
-        meta  = self.meta
-        objid = self.obj.id
-        if not objid:
-            raise FieldError('Object not saved. cannot access %s %s' % (self.__class__.__name__,self.name))
-        id = meta.basekey('id',self.obj.id,self.name)
-        return self.structure(id,
-                              timeout = meta.timeout,
-                              pickler = self.pickler,
-                              converter = self.converter)
+    def __get__(self, instance, instance_type = None):
+        if instance is None:
+            return self
+        return self.get_full_value(instance)
     
-    def _set_value(self, name, obj, value):
-        v = super(MultiField,self)._set_value(name, obj, value)
-        self.set_structure()
-        return v
+    def __set__(self, instance, value):
+        raise FieldError('Cannot set data-structure field %s' % self)
         
-    def set_structure(self):
+    def get_full_value(self, instance):
+        '''Return the structure holding the field data of *instance*.'''
         meta = self.meta
-        pipe = pipelines(self.get_pipeline(),meta.timeout)
-        self.structure = getattr(meta.cursor,pipe.method,None)
-        if self.model and not self.pickler:
-            self.pickler = ModelFieldPickler(self.model)
+        if not instance.id:
+            raise FieldError('Object not saved. cannot access %s %s' % (self.__class__.__name__,self.name))
+        method = pipelines(self.get_pipeline(),meta.timeout).method
+        return getattr(meta.cursor,method)(self.id(instance),
+                                           timeout = meta.timeout,
+                                           pickler = self.pickler,
+                                           converter = self.converter)
     
     def serialize(self):
         return None
@@ -84,8 +90,8 @@ class MultiField(Field):
                     related.save(commit)
     
     def id(self, obj):
-        '''Delete field.'''
-        return meta.basekey('id',obj.id,self.name)
+        '''Key of the structure holding the field data of *obj*.'''
+        return self.meta.basekey('id',obj.id,self.name)
 
 
 class SetField(MultiField):
@@ -2,9 +2,22 @@
 #from backend_tests import *
 
 #from strings import *
-#from manager import *
-#from finance import *
+from manager import *
+from finance import *
 from fktest import *
+from pipeline import *
+from query import *
+from ordering import *
+from cache import *
+from codec import *
+from storage import *
+from update import *
+from connections import *
+from sharding import *
+from replicas import *
+from unique import *
+from versions import *
+from increment import *
 #from atomfields import *
 
 # Data-structure Fields
@@ -17,4 +30,4 @@ from fktest import *
 #from testme import *
 
 # Contrib
-#from stdnet.contrib.timeserie.tests import *
\ No newline at end of file
+from stdnet.contrib.timeserie.tests import *
\ No newline at end of file
@@ -0,0 +1,101 @@
+from __future__ import with_statement
+
+from stdnet.test import TestCase
+from stdnet.exceptions import ObjectNotFund
+from stdnet.utils import LRUCache, populate
+
+from examples.models import SimpleModel
+
+NUM_OBJECTS = 20
+codes = list(set(populate('string', NUM_OBJECTS, min_len = 10, max_len = 20)))
+
+
+class TestLRUCache(TestCase):
+    
+    def testEviction(self):
+        cache = LRUCache(3)
+        for n in range(3):
+            cache.set(n,n)
+        self.assertEqual(cache.get(0),0)
+        cache.set(3,3)
+        self.assertEqual(len(cache),3)
+        self.assertFalse(1 in cache)
+        self.assertTrue(0 in cache)
+        self.assertEqual(cache.get(1),None)
+        self.assertEqual(cache.stats()['hits'],1)
+        self.assertEqual(cache.stats()['misses'],1)
+        self.assertEqual(cache.keys(),[2,0,3])
+        
+    def testDisabled(self):
+        cache = LRUCache()
+        cache.set(1,1)
+        self.assertEqual(len(cache),0)
+        self.assertEqual(cache.get(1,'x'),'x')
+        
+
+class TestObjectCache(TestCase):
+    
+    def setUp(self):
+        self.orm.register(SimpleModel)
+        self.cursor = SimpleModel._meta.cursor
+        self.cursor.object_cache = LRUCache(100)
+        for code in codes:
+            SimpleModel(code = code).save(False)
+        SimpleModel.commit()
+        
+    def unregister(self):
+        self.cursor.object_cache = LRUCache()
+        self.orm.unregister(SimpleModel)
+        
+    def testReadThrough(self):
+        cache = self.cursor.object_cache
+        for code in codes:
+            self.assertEqual(SimpleModel.objects.get(code = code).code,code)
+        self.assertEqual(cache.misses,len(codes))
+        self.assertEqual(cache.hits,0)
+        for code in codes:
+            self.assertEqual(SimpleModel.objects.get(code = code).code,code)
+        self.assertEqual(cache.hits,len(codes))
+        
+    def testInvalidation(self):
+        cache = self.cursor.object_cache
+        obj = SimpleModel.objects.get(code = codes[0])
+        self.assertEqual(len(cache),1)
+        obj.code = 'changed'
+        obj.save()
+        self.assertEqual(len(cache),0)
+        self.assertEqual(SimpleModel.objects.get(id = obj.id).code,'changed')
+        obj.delete()
+        self.assertEqual(len(cache),0)
+        self.assertRaises(ObjectNotFund,SimpleModel.objects.get,id = obj.id)
+        
+    def testReadBeforeCommit(self):
+        obj = SimpleModel.objects.get(code = codes[0])
+        obj.code = 'changed'
+        obj.save(False)
+        # the server still has the old data
+        self.assertEqual(SimpleModel.objects.get(id = obj.id).code,codes[0])
+        SimpleModel.commit()
+        self.assertEqual(SimpleModel.objects.get(id = obj.id).code,'changed')
+        
+    def testDeleteQuery(self):
+        cache = self.cursor.object_cache
+        cache.set(('other','1'),'data')
+        for code in codes[:2]:
+            SimpleModel.objects.get(code = code)
+        self.assertEqual(len(cache),3)
+        SimpleModel.objects.filter(code__in = codes[:2]).delete()
+        self.assertEqual(cache.keys(),[('other','1')])
+        
+    def testIdentityMap(self):
+        obj1 = SimpleModel.objects.get(code = codes[0])
+        obj2 = SimpleModel.objects.get(code = codes[0])
+        self.assertFalse(obj1 is obj2)
+        with self.cursor.identity_map():
+            obj1 = SimpleModel.objects.get(code = codes[0])
+            obj2 = SimpleModel.objects.get(id = obj1.id)
+            self.assertTrue(obj1 is obj2)
+            obj3 = SimpleModel(code = 'new').save()
+            self.assertTrue(SimpleModel.objects.get(code = 'new') is obj3)
+        obj4 = SimpleModel.objects.get(code = codes[0])
+        self.assertFalse(obj1 is obj4)
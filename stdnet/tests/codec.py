@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import cPickle as pickle
+
+from stdnet import orm
+from stdnet.test import TestCase
+from stdnet.utils import populate
+
+from examples.models import SimpleModel
+
+NUM_OBJECTS = 50
+codes = list(set(populate('string', NUM_OBJECTS, min_len = 10, max_len = 20)))
+
+
+class TestBinaryRowCodec(TestCase):
+    
+    def setUp(self):
+        self.codec = orm.BinaryRowCodec(SimpleModel._meta)
+        
+    def testRoundTrip(self):
+        rows = [[],
+                [None, True, False],
+                [0, -1, 2**31, -2**40, 2**70, 3.5, -1e300],
+                ['', 'EUR', 'x'*70000, u'caf\xe9', u'€'*40000],
+                [(1,2), {'a':1}, None, 'end']]
+        for row in rows:
+            data = self.codec.loads(self.codec.dumps(row))
+            self.assertEqual(data,row)
+            for a,b in zip(data,row):
+                self.assertEqual(type(a),type(b))
+                
+    def testDecoders(self):
+        row = ['EUR', 3, None, 4.5, u'caf\xe9']
+        s = self.codec.dumps(row)
+        self.assertEqual(self.codec.loads(s),row)
+        decode = self.codec.decoder(s[2:2+ord(s[1])])
+        self.assertEqual(decode(s),row)
+        self.assertTrue(self.codec.decoder(s[2:7]) is decode)
+        self.assertEqual(self.codec.loads(self.codec.dumps(['GBP', 4, None, 1.5, u'x'])),
+                         ['GBP', 4, None, 1.5, u'x'])
+        
+    def testLegacyRows(self):
+        row = ['EUR', 3, 4.5, None]
+        self.assertEqual(self.codec.loads(pickle.dumps(row)),row)
+        self.assertEqual(self.codec.loads(pickle.dumps(row,2)),row)
+        
+    def testSize(self):
+        row = [1277942400000, 'EUR', 1500.0]
+        self.assertTrue(len(self.codec.dumps(row)) < len(pickle.dumps(row)))
+        
+
+class TestCodecMigration(TestCase):
+    
+    def setUp(self):
+        self.orm.register(SimpleModel)
+        self.meta = SimpleModel._meta
+        
+    def unregister(self):
+        self.meta.codec = orm.BinaryRowCodec(self.meta)
+        self.orm.unregister(SimpleModel)
+        
+    def testReadPickledRows(self):
+        self.meta.codec = orm.PickleRowCodec(self.meta)
+        for code in codes:
+            SimpleModel(code = code).save(False)
+        SimpleModel.commit()
+        self.meta.codec = orm.BinaryRowCodec(self.meta)
+        objs = list(SimpleModel.objects.all())
+        self.assertEqual(sorted((obj.code for obj in objs)),sorted(codes))
+        obj = SimpleModel.objects.get(code = codes[0])
+        obj.code = 'converted'
+        obj.save()
+        table = self.meta.cursor.redispy.hgetall(self.meta.basekey())
+        self.assertEqual(table[str(obj.id)][0],'\x00')
+        self.assertEqual(SimpleModel.objects.get(id = obj.id).code,'converted')
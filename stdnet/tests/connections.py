@@ -0,0 +1,69 @@
+import threading
+
+from stdnet import getdb
+from stdnet.conf import settings
+from stdnet.test import TestCase
+
+from examples.models import SimpleModel, Trade
+
+
+def backend_uri(**params):
+    uri = settings.DEFAULT_BACKEND
+    sep = '&' if '?' in uri else '?'
+    return '%s%s%s' % (uri,sep,'&'.join(('%s=%s' % kv for kv in params.items())))
+
+
+class TestConnections(TestCase):
+    
+    def setUp(self):
+        self.uri = backend_uri(max_connections = 3, socket_timeout = 5)
+        self.orm.register(SimpleModel, self.uri)
+        self.orm.register(Trade, self.uri)
+        
+    def unregister(self):
+        self.orm.unregister(SimpleModel)
+        self.orm.unregister(Trade)
+        
+    def testSharedBackend(self):
+        cursor = SimpleModel._meta.cursor
+        self.assertTrue(cursor is Trade._meta.cursor)
+        self.assertTrue(cursor is getdb(self.uri))
+        self.assertFalse(cursor is getdb(backend_uri(max_connections = 4)))
+        
+    def testPoolParameters(self):
+        pool = SimpleModel._meta.cursor.redispy.connection_pool
+        self.assertEqual(pool.max_connections,3)
+        self.assertEqual(pool.connection_kwargs['socket_timeout'],5.0)
+        other = getdb(backend_uri(socket_timeout = 5, max_connections = 3, batch_size = 10))
+        self.assertTrue(other.redispy.connection_pool is pool)
+        
+    def testThreads(self):
+        errors = []
+        def save(n):
+            try:
+                for i in range(20):
+                    SimpleModel(code = 'thread%s-%s' % (n,i)).save(False)
+                SimpleModel.commit()
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target = save, args = (n,)) for n in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors,[])
+        self.assertEqual(SimpleModel.objects.all().count(),200)
+        pool = SimpleModel._meta.cursor.redispy.connection_pool
+        self.assertTrue(len(pool._connections) <= 3)
+        
+    def testPendingWritesPerThread(self):
+        SimpleModel(code = 'main').save(False)
+        def other():
+            SimpleModel(code = 'other').save(False)
+            SimpleModel.commit()
+        t = threading.Thread(target = other)
+        t.start()
+        t.join()
+        self.assertEqual([obj.code for obj in SimpleModel.objects.all()],['other'])
+        SimpleModel.commit()
+        self.assertEqual(SimpleModel.objects.all().count(),2)
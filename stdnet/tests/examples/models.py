@@ -82,6 +82,56 @@ class TestDateModel(orm.StdModel):
     name = orm.SymbolField()
     dt = orm.DateField()
     
+
+class Trade(orm.StdModel):
+    '''A model with ordered fields'''
+    code = orm.SymbolField()
+    dt   = orm.DateField(ordered = True)
+    size = orm.FloatField(ordered = True)
+    
+    def __str__(self):
+        return '%s %s' % (self.code,self.size)
+
+
+class Issuer(orm.StdModel):
+    '''A model stored with one hash table per instance'''
+    name        = orm.SymbolField(unique = True)
+    ccy         = orm.SymbolField()
+    description = orm.CharField()
+    rating      = orm.IntegerField(index = False, ordered = True)
+    
+    class Meta:
+        storage = 'hash'
+        
+    def __str__(self):
+        return self.name
+    
+    
+class Counter(orm.StdModel):
+    '''A model with numeric fields incremented on the server'''
+    name  = orm.SymbolField(unique = True)
+    group = orm.SymbolField()
+    hits  = orm.IntegerField()
+    total = orm.FloatField(ordered = True, required = False)
+    
+    
+class Account(orm.StdModel):
+    '''A model with versioned instances'''
+    name    = orm.SymbolField(unique = True)
+    balance = orm.FloatField(index = False)
+    
+    class Meta:
+        version = 'version'
+        
+        
+class VersionedIssuer(orm.StdModel):
+    name   = orm.SymbolField(unique = True)
+    rating = orm.IntegerField(index = False)
+    
+    class Meta:
+        storage = 'hash'
+        version = 'version'
+        
     
 # Create the model for testing.
 class Node(orm.StdModel):
@@ -1,5 +1,6 @@
 import datetime
 import logging
+import cPickle as pickle
 from itertools import izip
 from random import randint
 
@@ -59,7 +60,8 @@ class TestFinanceApplication(TestCase):
             for dt in dates:
                 for inst in insts:
                     n += 1
-                    Position(instrument = inst, dt = dt, fund = f).save(False)
+                    Position(instrument = inst, dt = dt, fund = f,
+                             size = randint(-10,10), price = 100.0).save(False)
         Position.commit()
         return n
         
@@ -132,6 +134,49 @@ class TestFinanceApplication(TestCase):
         
         self.assertEqual(total_positions,totp)
         
+    def testSelectRelated(self):
+        '''Related objects are fetched with the queryset'''
+        N = self.makePositions()
+        def fail(*args):
+            self.fail('Related object not loaded')
+        cursors = set((Instrument._meta.cursor, Fund._meta.cursor))
+        for cursor in cursors:
+            cursor.get_object = fail
+        try:
+            positions = list(Position.objects.all().select_related('instrument','fund'))
+            self.assertEqual(len(positions),N)
+            for p in positions:
+                self.assertTrue(isinstance(p.instrument,Instrument))
+                self.assertTrue(isinstance(p.fund,Fund))
+                self.assertEqual(p.instrument.id,p.instrument_id)
+                self.assertEqual(p.fund.id,p.fund_id)
+        finally:
+            for cursor in cursors:
+                del cursor.get_object
+        for p in positions[:10]:
+            self.assertEqual(p.instrument,Instrument.objects.get(id = p.instrument_id))
+        qs = Position.objects.filter(fund = positions[0].fund).select_related('fund')
+        self.assertEqual(qs.related,('fund',))
+        for p in qs.order_by('dt').iterator(7):
+            self.assertEqual(p.__dict__['_fund_cache'],positions[0].fund)
+        self.assertRaises(QuerySetError,Position.objects.select_related,'size')
+        
+    def testSelectRelatedMissing(self):
+        self.makePositions()
+        fund = Position.objects.all()[0].fund
+        # remove the fund row only
+        Fund._meta.cursor.redispy.hdel(Fund._meta.basekey(),fund.id)
+        qs = Position.objects.filter(fund = fund).select_related('fund')
+        positions = list(qs)
+        self.assertTrue(positions)
+        for p in positions:
+            self.assertEqual(p.fund_id,fund.id)
+            self.assertEqual(p.fund,None)
+        p = positions[0]
+        p.size = 7.0
+        p.save()
+        self.assertEqual(Position.objects.get(id = p.id).fund_id,fund.id)
+        
     def testRelatedManagerFilter(self):
         self.makePositions()
         instruments = Instrument.objects.all()
@@ -167,6 +212,79 @@ class TestFinanceApplication(TestCase):
         Ni = len(instruments)
         T = instruments.delete()
         self.assertEqual(T,Np+Ni)
+        self.assertEqual(instruments.deleted,{Instrument:Ni,Position:Np})
+        self.assertEqual(Position.objects.all().count(),0)
+        
+    def testDeleteFiltered(self):
+        '''Test delete of a filtered queryset with related models'''
+        self.makePositions()
+        Np = Position.objects.all().count()
+        instruments = Instrument.objects.filter(ccy = 'EUR')
+        Ni = instruments.count()
+        Nr = sum((inst.positions.all().count() for inst in instruments))
+        self.assertEqual(instruments.delete(),Ni+Nr)
+        self.assertEqual(instruments.deleted,{Instrument:Ni,Position:Nr})
+        self.assertEqual(Instrument.objects.filter(ccy = 'EUR').count(),0)
+        self.assertEqual(Position.objects.all().count(),Np-Nr)
+        # index sets do not refer to deleted objects
+        for fund in Fund.objects.all():
+            positions = fund.position_set.all()
+            self.assertEqual(len(list(positions)),positions.count())
+            for pos in positions:
+                self.assertNotEqual(pos.instrument.ccy,'EUR')
+        
+    def testDeleteInstance(self):
+        '''Test delete of an instance with related objects'''
+        self.makePositions()
+        fund = Fund.objects.get(id = 1)
+        N = fund.position_set.all().count()
+        self.assertTrue(N)
+        self.assertEqual(fund.delete(),N+1)
+        self.assertEqual(Position.objects.filter(fund = 1).count(),0)
+        cursor = Position._meta.cursor
+        self.assertFalse(cursor.has_key(Position._meta.basekey('fund',1)))
+        
+    def checkIndexes(self, model, ids):
+        '''Check that index sets and unique keys of *model* do not refer to *ids*'''
+        meta    = model._meta
+        redispy = meta.cursor.redispy
+        ids     = set((str(id) for id in ids))
+        for key in redispy.keys(meta.basekey() + ':*'):
+            typ = redispy.type(key)
+            if typ == 'set' and key.split(':')[-2] != 'queries':
+                self.assertFalse(ids.intersection(redispy.smembers(key)))
+            elif typ == 'string' and key != meta.basekey('id'):
+                self.assertFalse(redispy.get(key) in ids)
+    
+    def deleteFiltered(self, pickled = False):
+        self.makePositions()
+        instruments = Instrument.objects.filter(ccy = 'EUR')
+        iids = [inst.id for inst in instruments]
+        pids = [pos.id for pos in Position.objects.filter(instrument__in = iids)]
+        self.assertTrue(iids)
+        cursor = Instrument._meta.cursor
+        if pickled:
+            for meta in (Instrument._meta,Position._meta):
+                for id,row in meta.table().items():
+                    cursor.redispy.hset(meta.basekey(),id,pickle.dumps(row))
+        else:
+            def get_rows(*args):
+                raise AssertionError('rows read before delete')
+            cursor.get_rows = get_rows
+        try:
+            self.assertEqual(instruments.delete(),len(iids)+len(pids))
+        finally:
+            cursor.__dict__.pop('get_rows',None)
+        self.checkIndexes(Instrument,iids)
+        self.checkIndexes(Position,pids)
+        
+    def testDeleteDecoded(self):
+        '''Index values of rows are decoded by the delete script'''
+        self.deleteFiltered()
+        
+    def testDeletePickledRows(self):
+        '''Rows pickled by previous versions are read before delete'''
+        self.deleteFiltered(pickled = True)
         
     def __testNestedLookUp(self):
         # Create Portfolio views
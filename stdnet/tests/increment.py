@@ -0,0 +1,111 @@
+from threading import Thread
+
+from stdnet import FieldError, QuerySetError, StaleObjectError
+from stdnet.test import TestCase
+
+from examples.models import Counter, Account, Issuer
+
+
+class TestIncrement(TestCase):
+    
+    def setUp(self):
+        self.orm.register(Counter)
+        self.orm.register(Account)
+        self.orm.register(Issuer)
+        for n in range(10):
+            Counter(name = 'c%s' % n, group = 'ab'[n % 2], hits = n, total = n*0.5).save(False)
+        Counter.commit()
+        
+    def unregister(self):
+        self.orm.unregister(Counter)
+        self.orm.unregister(Account)
+        self.orm.unregister(Issuer)
+        
+    def testInstance(self):
+        c = Counter.objects.get(name = 'c3')
+        self.assertEqual(c.increment('hits'),4)
+        self.assertEqual(c.hits,4)
+        self.assertEqual(c.increment('hits',10),14)
+        self.assertEqual(c.increment('total',0.25),1.75)
+        c = Counter.objects.get(name = 'c3')
+        self.assertEqual(c.hits,14)
+        self.assertEqual(c.total,1.75)
+        # nothing to save
+        self.assertFalse(c.save()._dbdata is None)
+        
+    def testIndexes(self):
+        c = Counter.objects.get(name = 'c3')
+        c.increment('hits',100)
+        self.assertEqual(Counter.objects.filter(hits = 3).count(),0)
+        self.assertEqual([o.name for o in Counter.objects.filter(hits = 103)],['c3'])
+        c.increment('total',10)
+        top = Counter.objects.all().order_by('-total')[0]
+        self.assertEqual(top.name,'c3')
+        self.assertEqual([o.name for o in Counter.objects.filter(total__gt = 5)],['c3'])
+        
+    def testQuerySet(self):
+        values = Counter.objects.filter(group = 'a').increment(hits = 2)
+        self.assertEqual(len(values),5)
+        for c in Counter.objects.all():
+            n = int(c.name[1:])
+            if c.group == 'a':
+                self.assertEqual(c.hits,n+2)
+                self.assertEqual(values[c.id],n+2)
+            else:
+                self.assertEqual(c.hits,n)
+        values = Counter.objects.all().increment(total = 1)
+        self.assertEqual(len(values),10)
+        values = Counter.objects.filter(name = 'c1').increment(total = 1)
+        self.assertEqual(values.values(),[2.5])
+        
+    def testNoneAndLarge(self):
+        c = Counter(name = 'new', group = 'c', hits = 0).save()
+        self.assertEqual(c.total,None)
+        self.assertEqual(c.increment('total',2.5),2.5)
+        self.assertEqual(c.increment('hits',2**40),2**40)
+        c = Counter.objects.get(name = 'new')
+        self.assertEqual(c.hits,2**40)
+        self.assertEqual(Counter.objects.filter(hits = 2**40).count(),1)
+        
+    def testConcurrent(self):
+        c = Counter.objects.get(name = 'c0')
+        def worker():
+            for i in range(50):
+                Counter.objects.filter(name = 'c0').increment(hits = 1)
+        threads = [Thread(target = worker) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(Counter.objects.get(name = 'c0').hits,200)
+        
+    def testVersioned(self):
+        acc = Account(name = 'pippo', balance = 10).save()
+        other = Account.objects.get(id = acc.id)
+        self.assertEqual(acc.increment('balance',5),15)
+        self.assertEqual(acc.version,2)
+        other.balance = 0
+        self.assertRaises(StaleObjectError, other.save, check_version = True)
+        acc.balance = 20
+        acc.save(check_version = True)
+        acc = Account.objects.get(id = acc.id)
+        self.assertEqual(acc.balance,20)
+        self.assertEqual(acc.version,3)
+        
+    def testHashStorage(self):
+        issuer = Issuer(name = 'pippo', ccy = 'EUR', rating = 3).save()
+        self.assertEqual(issuer.increment('rating',2),5)
+        issuer = Issuer.objects.get(id = issuer.id)
+        self.assertEqual(issuer.rating,5)
+        self.assertEqual(issuer.ccy,'EUR')
+        self.assertEqual(Issuer.objects.all().order_by('-rating')[0].rating,5)
+        
+    def testErrors(self):
+        c = Counter.objects.get(name = 'c3')
+        self.assertRaises(FieldError, c.increment, 'name')
+        self.assertRaises(FieldError, c.increment, 'id')
+        self.assertRaises(FieldError, c.increment, 'foo')
+        self.assertRaises(QuerySetError, Counter.objects.all().increment,
+                          hits = 1, total = 1)
+        self.assertRaises(FieldError, Account(name = 'a', balance = 1).save().increment,
+                          'version')
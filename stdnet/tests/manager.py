@@ -2,6 +2,7 @@ import random
 from itertools import izip
 
 from stdnet.test import TestCase
+from stdnet.exceptions import QuerySetError
 from examples.models import SimpleModel
     
 
@@ -19,4 +20,59 @@ class TestManager(TestCase):
         self.assertEqual(v.code,'test')
         v2,created = SimpleModel.objects.get_or_create(code = 'test')
         self.assertFalse(created)
-        self.assertEqual(v,v2)
\ No newline at end of file
+        self.assertEqual(v,v2)
+        
+    def testBulkCreate(self):
+        cursor = SimpleModel._meta.cursor
+        codes = ['bulk%s' % n for n in range(25)]
+        N = SimpleModel.objects.bulk_create(SimpleModel(code = code) for code in codes)
+        self.assertEqual(N,len(codes))
+        self.assertEqual(int(cursor._get(SimpleModel._meta.autoid())),len(codes))
+        self.assertEqual(SimpleModel.objects.all().count(),len(codes))
+        for n,code in enumerate(codes):
+            self.assertEqual(SimpleModel.objects.get(code = code).id,str(n+1))
+            
+    def testBulkCreateBatches(self):
+        cursor = SimpleModel._meta.cursor
+        calls = []
+        original = cursor.incr
+        def incr(key, delta = 1):
+            calls.append(delta)
+            return original(key, delta)
+        cursor.incr = incr
+        try:
+            codes = ['bulk%s' % n for n in range(25)]
+            objs = [SimpleModel(code = code) for code in codes]
+            objs[3].id = 1000
+            N = SimpleModel.objects.bulk_create(objs, batch_size = 10)
+        finally:
+            # the backend is shared by all models with the same uri
+            cursor.incr = original
+        self.assertEqual(N,len(codes))
+        self.assertEqual(calls,[9,10,5])
+        self.assertEqual(SimpleModel.objects.all().count(),len(codes))
+        self.assertEqual(SimpleModel.objects.get(id = 1000).code,codes[3])
+            
+    def testInBulk(self):
+        codes = ['bulk%s' % n for n in range(10)]
+        SimpleModel.objects.bulk_create(SimpleModel(code = code) for code in codes)
+        cursor = SimpleModel._meta.cursor
+        calls = []
+        get = cursor._get
+        def _get(id):
+            calls.append(id)
+            return get(id)
+        cursor._get = _get
+        try:
+            objs = SimpleModel.objects.in_bulk(codes[:5] + ['missing'], 'code')
+        finally:
+            # the backend is shared by all models with the same uri
+            del cursor._get
+        self.assertEqual(calls,[])
+        self.assertEqual(sorted(objs),codes[:5])
+        for code,obj in objs.items():
+            self.assertEqual(obj.code,code)
+        objs = SimpleModel.objects.in_bulk([1,3,100])
+        self.assertEqual(sorted(objs),[1,3])
+        self.assertEqual(objs[3].code,codes[2])
+        self.assertRaises(QuerySetError,SimpleModel.objects.in_bulk,[1],'group')
@@ -0,0 +1,87 @@
+import datetime
+from itertools import izip
+
+from stdnet.test import TestCase
+from stdnet.utils import populate
+from stdnet.exceptions import QuerySetError
+
+from examples.models import Trade
+
+NUM_TRADES = 200
+codes = populate('choice', NUM_TRADES, choice_from = ['EUR','GBP','USD'])
+dates = populate('date', NUM_TRADES, start=datetime.date(2009,1,1), end=datetime.date(2010,6,1))
+sizes = populate('float', NUM_TRADES, start = -1000, end = 1000)
+
+
+class TestOrdering(TestCase):
+    
+    def setUp(self):
+        self.orm.register(Trade)
+        for code,dt,size in izip(codes,dates,sizes):
+            Trade(code = code, dt = dt, size = size).save(False)
+        Trade.commit()
+    
+    def unregister(self):
+        self.orm.unregister(Trade)
+        
+    def testOrderBy(self):
+        trades = list(Trade.objects.all().order_by('size'))
+        self.assertEqual(len(trades),NUM_TRADES)
+        self.assertEqual([t.size for t in trades],sorted(sizes))
+        trades = list(Trade.objects.order_by('-dt'))
+        self.assertEqual([t.dt for t in trades],sorted(dates,reverse = True))
+        
+    def testSlice(self):
+        qs = Trade.objects.all().order_by('-size')
+        top = qs[:50]
+        self.assertEqual(len(top),50)
+        self.assertEqual([t.size for t in top],sorted(sizes,reverse = True)[:50])
+        self.assertEqual(qs._seq,None)
+        self.assertEqual(qs[0].size,max(sizes))
+        self.assertEqual([t.size for t in qs[190:]],sorted(sizes,reverse = True)[190:])
+        self.assertRaises(IndexError,lambda : qs[NUM_TRADES])
+        
+    def testFilteredOrderBy(self):
+        qs = Trade.objects.filter(code = 'EUR').order_by('size')
+        expected = sorted((s for c,s in izip(codes,sizes) if c == 'EUR'))
+        self.assertEqual([t.size for t in qs[:10]],expected[:10])
+        self.assertEqual([t.size for t in qs],expected)
+        
+    def testOrderById(self):
+        qs = Trade.objects.filter(code__in = ('EUR','USD')).order_by('-id')
+        ids = [int(t.id) for t in qs[:20]]
+        self.assertEqual(ids,sorted(ids,reverse = True))
+        ids = [int(t.id) for t in Trade.objects.order_by('id')[5:10]]
+        self.assertEqual(ids,range(6,11))
+        
+    def testOrderByNonOrdered(self):
+        qs = Trade.objects.all().order_by('code')
+        self.assertEqual([t.code for t in qs[:100]],sorted(codes)[:100])
+        
+    def testDelete(self):
+        for t in Trade.objects.order_by('size')[:10]:
+            t.delete()
+        self.assertEqual([t.size for t in Trade.objects.order_by('size')],sorted(sizes)[10:])
+        
+    def testRange(self):
+        a,b = sorted(dates)[20],sorted(dates)[150]
+        qs = Trade.objects.filter(dt__gte = a, dt__lt = b)
+        expected = [dt for dt in dates if dt >= a and dt < b]
+        self.assertEqual(qs.count(),len(expected))
+        for t in qs:
+            self.assertTrue(t.dt >= a and t.dt < b)
+        qs = Trade.objects.filter(dt__range = (a,b))
+        self.assertEqual(qs.count(),len([dt for dt in dates if dt >= a and dt <= b]))
+        qs = Trade.objects.filter(dt__gt = a, dt__lte = b)
+        self.assertEqual(qs.count(),len([dt for dt in dates if dt > a and dt <= b]))
+        
+    def testRangeIntersection(self):
+        qs = Trade.objects.filter(code = 'EUR', size__gt = 0, size__lt = 500)
+        expected = [s for c,s in izip(codes,sizes) if c == 'EUR' and s > 0 and s < 500]
+        self.assertEqual(qs.count(),len(expected))
+        self.assertEqual([t.size for t in qs.order_by('size')],sorted(expected))
+        qs = Trade.objects.exclude(size__lte = 0)
+        self.assertEqual(qs.count(),len([s for s in sizes if s > 0]))
+        
+    def testRangeErrors(self):
+        self.assertRaises(QuerySetError,Trade.objects.filter(code__gt = 'EUR').count)
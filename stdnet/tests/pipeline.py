@@ -0,0 +1,88 @@
+from stdnet import FieldValueError
+from stdnet.test import TestCase
+from stdnet.utils import populate
+
+from examples.models import SimpleModel
+
+NUM_OBJECTS = 100
+codes = populate('string', NUM_OBJECTS, min_len = 10, max_len = 20)
+
+
+class TestPipelinedCommit(TestCase):
+    
+    def setUp(self):
+        self.orm.register(SimpleModel)
+        self.cursor = SimpleModel._meta.cursor
+        
+    def unregister(self):
+        self.orm.unregister(SimpleModel)
+        
+    def create(self):
+        for code in set(codes):
+            SimpleModel(code = code).save(False)
+        return SimpleModel.commit()
+        
+    def testCommit(self):
+        results = self.create()
+        self.assertTrue(results)
+        self.assertEqual(SimpleModel.objects.all().count(),len(set(codes)))
+        for code in codes:
+            self.assertEqual(SimpleModel.objects.get(code = code).code,code)
+        
+    def testChunkedCommit(self):
+        self.cursor.batch_size = 7
+        try:
+            self.create()
+        finally:
+            self.cursor.batch_size = 10000
+        self.assertEqual(SimpleModel.objects.all().count(),len(set(codes)))
+        
+    def testChunkedCommitTaken(self):
+        # the unique clash is in the first chunk
+        self.cursor.batch_size = 3
+        try:
+            SimpleModel(code = 'c0').save(False)
+            SimpleModel(code = 'c0').save(False)
+            for n in range(1,7):
+                SimpleModel(code = 'c%s' % n).save(False)
+            self.assertRaises(FieldValueError, SimpleModel.commit)
+        finally:
+            self.cursor.batch_size = 10000
+        self.assertEqual(SimpleModel.commit(),[])
+        self.assertEqual(SimpleModel.objects.all().count(),7)
+        for n in range(7):
+            self.assertEqual(SimpleModel.objects.get(code = 'c%s' % n).code,'c%s' % n)
+        
+    def testEmptyCommit(self):
+        self.assertEqual(SimpleModel.commit(),[])
+        
+        
+class TestVariadicWrites(TestCase):
+    
+    def setUp(self):
+        self.orm.register(SimpleModel)
+        self.cursor = SimpleModel._meta.cursor
+        self.cursor.variadic_size = 7
+        
+    def unregister(self):
+        self.cursor.variadic_size = 1000
+        self.orm.unregister(SimpleModel)
+        
+    def testSet(self):
+        s = self.cursor.unordered_set(SimpleModel._meta.basekey('set'))
+        s.update(codes)
+        self.assertEqual(s.save(),len(set(codes)))
+        self.assertEqual(s.size(),len(set(codes)))
+        
+    def testList(self):
+        l = self.cursor.list(SimpleModel._meta.basekey('list'))
+        for code in codes:
+            l.push_back(code)
+        self.assertEqual(l.save(),len(codes))
+        self.assertEqual(list(l),codes)
+        
+    def testHash(self):
+        h = self.cursor.hash(SimpleModel._meta.basekey('hash'))
+        h.update(dict(((c,n) for n,c in enumerate(codes))))
+        h.save()
+        self.assertEqual(h.size(),len(set(codes)))
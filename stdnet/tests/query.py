@@ -0,0 +1,211 @@
+import datetime
+from itertools import izip
+
+from stdnet.test import TestCase
+from stdnet.utils import populate
+from stdnet.orm.query import QuerySet
+
+from examples.models import TestDateModel, Instrument
+
+NUM_DATES = 100
+names = populate('string',NUM_DATES, min_len = 5, max_len = 20)
+dates = populate('date', NUM_DATES, start=datetime.date(2010,5,1), end=datetime.date(2010,6,1))
+
+
+class TestQuery(TestCase):
+    
+    def setUp(self):
+        self.orm.register(TestDateModel)
+        for na,dt in izip(names,dates):
+            TestDateModel(name = na, dt = dt).save(False)
+        TestDateModel.commit()
+    
+    def unregister(self):
+        self.orm.unregister(TestDateModel)
+        
+    def testIterator(self):
+        qs  = TestDateModel.objects.all()
+        ids = set()
+        for obj in qs.iterator(chunk_size = 7):
+            self.assertTrue(isinstance(obj,TestDateModel))
+            ids.add(obj.id)
+        self.assertEqual(len(ids),NUM_DATES)
+        self.assertEqual(qs._seq,None)
+        
+    def testFilteredIterator(self):
+        dt = dates[0]
+        qs = TestDateModel.objects.filter(dt = dt)
+        objs = list(qs.iterator(chunk_size = 1))
+        self.assertEqual(len(objs),qs.count())
+        for obj in objs:
+            self.assertEqual(obj.dt,dt)
+        
+    def testIn(self):
+        d1,d2 = dates[0],dates[1]
+        N = TestDateModel.objects.filter(dt = d1).count()
+        if d2 != d1:
+            N += TestDateModel.objects.filter(dt = d2).count()
+        qs = TestDateModel.objects.filter(dt__in = (d1,d2))
+        self.assertEqual(qs.count(),N)
+        for obj in qs:
+            self.assertTrue(obj.dt in (d1,d2))
+        self.assertEqual(TestDateModel.objects.filter(dt__in = ()).count(),0)
+            
+    def testExclude(self):
+        dt = dates[0]
+        N  = TestDateModel.objects.filter(dt = dt).count()
+        qs = TestDateModel.objects.exclude(dt = dt)
+        self.assertEqual(qs.count(),NUM_DATES-N)
+        for obj in qs:
+            self.assertNotEqual(obj.dt,dt)
+            
+    def testFilterExclude(self):
+        dt = dates[0]
+        obj = TestDateModel.objects.filter(dt = dt)[0]
+        qs = QuerySet(TestDateModel._meta, fargs = {'dt':dt}, eargs = {'name':obj.name})
+        self.assertFalse(obj in list(qs))
+        for o in qs:
+            self.assertEqual(o.dt,dt)
+            self.assertNotEqual(o.name,obj.name)
+            
+    def testCachedResult(self):
+        dt = dates[0]
+        qs1 = TestDateModel.objects.filter(dt = dt)
+        N  = qs1.count()
+        qs2 = TestDateModel.objects.filter(dt = dt)
+        self.assertEqual(qs2.count(),N)
+        self.assertEqual(qs1.qset.id,qs2.qset.id)
+        TestDateModel(name = 'newobject', dt = dt).save()
+        self.assertEqual(TestDateModel.objects.filter(dt = dt).count(),N+1)
+        qs2[0].delete()
+        self.assertEqual(TestDateModel.objects.filter(dt = dt).count(),N)
+        
+    def testWriteAfterCount(self):
+        dt = dates[0]
+        qs = TestDateModel.objects.filter(dt = dt)
+        N  = qs.count()
+        # writes to the model delete query results on the server
+        TestDateModel(name = 'newobject', dt = dates[-1]).save()
+        objs = list(qs)
+        self.assertEqual(len(objs),N)
+        for obj in objs:
+            self.assertEqual(obj.dt,dt)
+        self.assertEqual(len(qs),N)
+        qs = TestDateModel.objects.filter(dt = dt).order_by('id')
+        self.assertEqual(qs.count(),N)
+        TestDateModel(name = 'newobject2', dt = dates[-1]).save()
+        self.assertEqual(len(qs[0:N]),N)
+        
+    def commands(self):
+        '''Number of commands processed by the server, the INFO
+command used for measuring excluded.'''
+        info = TestDateModel._meta.cursor.redispy.info()
+        self.info_commands = getattr(self,'info_commands',-1) + 1
+        return int(info['total_commands_processed']) - self.info_commands
+    
+    def testChainedFilters(self):
+        d1,d2 = dates[0],dates[1]
+        qs = TestDateModel.objects.filter(dt__in = (d1,d2))
+        qs1 = qs.filter(dt = d1)
+        self.assertEqual(qs.fargs,(('dt__in',(d1,d2)),))
+        self.assertEqual(qs1.count(),TestDateModel.objects.filter(dt = d1).count())
+        self.assertEqual(qs.filter(dt = d1).filter(dt = d2).count(),
+                         TestDateModel.objects.filter(dt = d1).count() if d1 == d2 else 0)
+        for obj in qs1:
+            self.assertEqual(obj.dt,d1)
+        
+    def testExcludeAfterAll(self):
+        dt = dates[0]
+        N  = TestDateModel.objects.filter(dt = dt).count()
+        qs = TestDateModel.objects.all().exclude(dt = dt)
+        self.assertEqual(qs.count(),NUM_DATES-N)
+        qs = QuerySet(TestDateModel._meta).filter(dt = dt).exclude(name = 'foo')
+        self.assertEqual(qs.count(),N)
+        
+    def testExists(self):
+        self.assertTrue(TestDateModel.objects.all().exists())
+        self.assertTrue(TestDateModel.objects.filter(dt = dates[0]).exists())
+        self.assertFalse(TestDateModel.objects.filter(name = 'foo').exists())
+        qs = TestDateModel.objects.filter(dt__in = ())
+        self.assertFalse(qs.exists())
+        self.assertEqual(list(qs),[])
+        
+    def testExistsAndWrite(self):
+        dt = dates[0]
+        qs = TestDateModel.objects.filter(dt = dt)
+        N  = TestDateModel.objects.filter(dt = dt).count()
+        self.assertTrue(qs.exists())
+        TestDateModel(name = 'newobject', dt = dates[-1]).save()
+        objs = list(qs)
+        self.assertEqual(len(objs),N)
+        self.assertTrue(qs.exists())
+        
+    def testOneRoundTrip(self):
+        qs = TestDateModel.objects.filter(dt = dates[0])
+        N = qs.count()
+        c = self.commands()
+        self.assertEqual(qs.count(),N)
+        self.assertEqual(len(qs),N)
+        self.assertTrue(qs.exists())
+        self.assertEqual(self.commands(),c)
+        objs = list(qs)
+        c = self.commands()
+        self.assertEqual(len(qs),N)
+        self.assertEqual(qs.count(),N)
+        self.assertEqual(list(qs),objs)
+        self.assertEqual(self.commands(),c)
+
+
+class TestUniqueLookups(TestCase):
+    
+    def setUp(self):
+        self.orm.register(Instrument)
+        Instrument(name = 'a', ccy = 'USD', type = 'equity').save(False)
+        Instrument(name = 'b', ccy = 'EUR', type = 'equity').save(False)
+        Instrument(name = 'c', ccy = 'EUR', type = 'equity').save(False)
+        Instrument.commit()
+    
+    def unregister(self):
+        self.orm.unregister(Instrument)
+        
+    def names(self, qs):
+        return sorted((obj.name for obj in qs))
+        
+    def testIn(self):
+        qs = Instrument.objects.filter(name__in = ('a','c','foo'))
+        self.assertEqual(qs.count(),2)
+        self.assertEqual(self.names(qs),['a','c'])
+        self.assertEqual(Instrument.objects.filter(name__in = ()).count(),0)
+        qs = Instrument.objects.filter(name__in = ('a','b'), ccy = 'EUR')
+        self.assertEqual(self.names(qs),['b'])
+        
+    def testExclude(self):
+        qs = Instrument.objects.exclude(name = 'a')
+        self.assertEqual(self.names(qs),['b','c'])
+        qs = Instrument.objects.filter(ccy = 'EUR').exclude(name__in = ('b','foo'))
+        self.assertEqual(self.names(qs),['c'])
+        
+    def testRename(self):
+        self.assertEqual(Instrument.objects.exclude(name = 'a').count(),2)
+        obj = Instrument.objects.get(name = 'b')
+        obj.name = 'a2'
+        obj.save()
+        self.assertEqual(self.names(Instrument.objects.filter(name__in = ('a2','b'))),['a2'])
+        
+    def testChainedUnique(self):
+        self.assertEqual(Instrument.objects.filter(name = 'a', ccy = 'USD').count(),1)
+        self.assertEqual(Instrument.objects.filter(name = 'a', ccy = 'EUR').count(),0)
+        self.assertEqual(self.names(Instrument.objects.filter(name = 'a', ccy = 'EUR')),[])
+        self.assertEqual(Instrument.objects.filter(name = 'a').exclude(ccy = 'EUR').count(),1)
+        self.assertEqual(Instrument.objects.filter(name = 'a').exclude(ccy = 'USD').count(),0)
+        self.assertEqual(self.names(Instrument.objects.filter(name = 'a').filter(name = 'b')),[])
+        self.assertEqual(self.names(Instrument.objects.filter(name = 'a').filter(name = 'a')),['a'])
+        self.assertEqual(self.names(Instrument.objects.filter(name = 'a').exclude(name = 'a')),[])
+        self.assertEqual(self.names(Instrument.objects.filter(name = 'foo', ccy = 'USD')),[])
+        
+    def testDeleteChainedUnique(self):
+        self.assertEqual(Instrument.objects.filter(name = 'a', ccy = 'EUR').delete(),0)
+        self.assertEqual(Instrument.objects.filter(name = 'b').exclude(ccy = 'EUR').delete(),0)
+        self.assertEqual(Instrument.objects.all().count(),3)
+        self.assertEqual(Instrument.objects.filter(name = 'b').exclude(ccy = 'USD').delete(),1)
+        self.assertEqual(self.names(Instrument.objects.all()),['a','c'])
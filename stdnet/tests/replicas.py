@@ -0,0 +1,84 @@
+from stdnet.test import TestCase
+
+from examples.models import SimpleModel
+from connections import backend_uri
+
+
+class CountingClient(object):
+    '''Wrap a redis client and record the commands it executes'''
+    def __init__(self, client):
+        self.client   = client
+        self.commands = []
+        
+    def execute_command(self, *args):
+        self.commands.append(args[0])
+        return self.client.execute_command(*args)
+    
+    def pipeline(self, *args, **kwargs):
+        self.commands.append('PIPELINE')
+        return self.client.pipeline(*args, **kwargs)
+    
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+    
+
+class TestReplicas(TestCase):
+    # The replicas are the server itself, under two names
+    routing = 'round_robin'
+    
+    def setUp(self):
+        self.uri = backend_uri(replicas = '127.0.0.1:6379,localhost:6379',
+                               replica_routing = self.routing)
+        self.orm.register(SimpleModel, self.uri)
+        replicas = SimpleModel._meta.cursor.replicas
+        replicas.clients = [CountingClient(c) for c in replicas.clients]
+        self.clients = replicas.clients
+        
+    def unregister(self):
+        self.orm.unregister(SimpleModel)
+        
+    def reads(self):
+        return [len(c.commands) for c in self.clients]
+        
+    def testReplicas(self):
+        cursor = SimpleModel._meta.cursor
+        self.assertEqual(len(cursor.replicas),2)
+        self.assertEqual(self.reads(),[0,0])
+        SimpleModel(code = 'a').save()
+        SimpleModel(code = 'b').save()
+        # writes do not go to replicas
+        self.assertEqual(self.reads(),[0,0])
+        self.assertEqual(SimpleModel.objects.all().count(),2)
+        self.assertEqual(SimpleModel.objects.get(code = 'a').code,'a')
+        self.assertEqual(sum(self.reads()),3)
+        
+    def testRoundRobin(self):
+        SimpleModel(code = 'a').save()
+        for i in range(4):
+            SimpleModel.objects.all().count()
+        self.assertEqual(self.reads(),[2,2])
+        
+    def testUsingPrimary(self):
+        SimpleModel(code = 'a').save()
+        with SimpleModel.objects.using_primary():
+            self.assertEqual(SimpleModel.objects.get(code = 'a').code,'a')
+            with SimpleModel.objects.using_primary():
+                self.assertEqual(SimpleModel.objects.all().count(),1)
+            self.assertEqual(SimpleModel.objects.all().count(),1)
+        self.assertEqual(self.reads(),[0,0])
+        self.assertEqual(SimpleModel.objects.all().count(),1)
+        self.assertEqual(sum(self.reads()),1)
+        
+        
+class TestLatencyReplicas(TestReplicas):
+    routing = 'latency'
+    
+    def testRoundRobin(self):
+        pass
+    
+    def testLatency(self):
+        replicas = SimpleModel._meta.cursor.replicas
+        replicas.latency = [0.5,0.1]
+        SimpleModel.objects.all().count()
+        self.assertEqual(self.reads(),[0,1])
+        self.assertTrue(replicas.latency[1] < 0.1)
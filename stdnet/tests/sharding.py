@@ -0,0 +1,64 @@
+from stdnet import getdb
+from stdnet.conf import settings
+from stdnet.test import TestCase
+from stdnet.utils import HashRing
+from stdnet.backends.main import parse_backend_uri, shard_uri
+
+from examples.models import SimpleModel, Trade
+
+
+def sharded_uri():
+    # two names for the same server, so that the test runs on a single redis
+    scheme, host, params = parse_backend_uri(settings.DEFAULT_BACKEND)
+    port = host.split(':')[1] if ':' in host else 6379
+    uri  = settings.DEFAULT_BACKEND
+    return uri.replace(host,'127.0.0.1:%s,localhost:%s' % (port,port),1)
+
+
+class TestHashRing(TestCase):
+    
+    def testDistribution(self):
+        ring = HashRing(['a','b','c'])
+        keys = ['key%s' % n for n in range(3000)]
+        nodes = [ring.get_node(key) for key in keys]
+        for node in ('a','b','c'):
+            self.assertTrue(nodes.count(node) > 700)
+        
+    def testRemoveNode(self):
+        ring  = HashRing(['a','b','c'])
+        ring2 = HashRing(['a','b'])
+        for n in range(1000):
+            key = 'key%s' % n
+            node = ring.get_node(key)
+            if node != 'c':
+                self.assertEqual(ring2.get_node(key),node)
+                
+
+class TestSharding(TestCase):
+    
+    def setUp(self):
+        self.uri = sharded_uri()
+        self.orm.register(SimpleModel, self.uri)
+        self.orm.register(Trade, self.uri)
+        
+    def unregister(self):
+        self.orm.unregister(SimpleModel)
+        self.orm.unregister(Trade)
+        
+    def testShardUri(self):
+        self.assertEqual(shard_uri(settings.DEFAULT_BACKEND,'foo'),settings.DEFAULT_BACKEND)
+        uri = shard_uri(self.uri,'foo')
+        self.assertFalse(',' in uri)
+        self.assertEqual(shard_uri(self.uri,'foo'),uri)
+        
+    def testRegister(self):
+        for model in (SimpleModel,Trade):
+            meta = model._meta
+            self.assertTrue(meta.cursor is getdb(self.uri, key = meta.basekey()))
+            self.assertTrue(meta.cursor is getdb(shard_uri(self.uri,meta.basekey())))
+        
+    def testSaveAndQuery(self):
+        SimpleModel(code = 'a').save()
+        SimpleModel(code = 'b').save()
+        self.assertEqual(SimpleModel.objects.all().count(),2)
+        self.assertEqual(SimpleModel.objects.get(code = 'b').code,'b')
@@ -0,0 +1,114 @@
+from itertools import izip
+
+from stdnet.test import TestCase
+from stdnet.exceptions import QuerySetError, ObjectNotFund
+from stdnet.utils import populate
+
+from examples.models import Issuer
+
+NUM_OBJECTS = 60
+ccys    = ['EUR','GBP','USD','JPY']
+names   = list(set(populate('string', NUM_OBJECTS, min_len = 8, max_len = 14)))
+iccys   = populate('choice', len(names), choice_from = ccys)
+ratings = populate('integer', len(names), start = 1, end = 10)
+
+
+class TestHashStorage(TestCase):
+    
+    def setUp(self):
+        self.orm.register(Issuer)
+        self.meta = Issuer._meta
+        for name,ccy,rating in izip(names,iccys,ratings):
+            Issuer(name = name, ccy = ccy, rating = rating,
+                   description = 'issuer %s' % name).save(False)
+        Issuer.commit()
+        
+    def unregister(self):
+        self.orm.unregister(Issuer)
+        
+    def server_value(self, obj, name):
+        data = self.meta.cursor.redispy.hget(self.meta.objkey(obj.id),name)
+        return self.meta.codec.loads_value(data)
+        
+    def testStorage(self):
+        self.assertEqual(Issuer.objects.all().count(),len(names))
+        obj = Issuer.objects.get(name = names[0])
+        self.assertEqual(obj.ccy,iccys[0])
+        self.assertEqual(obj.rating,ratings[0])
+        self.assertEqual(self.server_value(obj,'description'),'issuer %s' % names[0])
+        for ccy in ccys:
+            qs = Issuer.objects.filter(ccy = ccy)
+            self.assertEqual(qs.count(),len([c for c in iccys if c == ccy]))
+            for obj in qs:
+                self.assertEqual(obj.ccy,ccy)
+        objs = list(Issuer.objects.all().order_by('-rating')[:10])
+        self.assertEqual([obj.rating for obj in objs],sorted(ratings,reverse=True)[:10])
+        self.assertEqual(len(list(Issuer.objects.all().iterator(7))),len(names))
+        
+    def testOnly(self):
+        qs = Issuer.objects.filter(ccy = iccys[0]).only('name','rating')
+        self.assertEqual(set(qs.fields),set(('name','rating')))
+        for obj in qs:
+            self.assertTrue('name' in obj.__dict__)
+            self.assertTrue('rating' in obj.__dict__)
+            self.assertFalse('ccy' in obj.__dict__)
+            self.assertFalse('description' in obj.__dict__)
+            # loaded when accessed
+            self.assertEqual(obj.ccy,iccys[0])
+            self.assertTrue('ccy' in obj.__dict__)
+        qs = Issuer.objects.defer('description')
+        self.assertEqual(set(qs.fields),set(('name','ccy','rating')))
+        for obj in qs:
+            self.assertFalse('description' in obj.__dict__)
+        self.assertRaises(QuerySetError,Issuer.objects.only,'foo')
+        self.assertRaises(QuerySetError,Issuer.objects.defer,'foo')
+        
+    def testUpdateFields(self):
+        obj = Issuer.objects.get(name = names[0])
+        other = Issuer.objects.get(name = names[0])
+        other.description = 'changed'
+        other.save()
+        obj.rating = 100
+        obj.description = 'not saved'
+        obj.save(update_fields = ['rating'])
+        self.assertEqual(self.server_value(obj,'rating'),100)
+        self.assertEqual(self.server_value(obj,'description'),'changed')
+        self.assertEqual(Issuer.objects.all().order_by('-rating')[0],obj)
+        
+    def testSavePartial(self):
+        obj = Issuer.objects.all().only('rating').order_by('id')[0]
+        obj.rating = 50
+        obj.save()
+        obj = Issuer.objects.get(id = obj.id)
+        self.assertEqual(obj.rating,50)
+        self.assertTrue(obj.name)
+        self.assertTrue(obj.description)
+        
+    def testDelete(self):
+        obj = Issuer.objects.get(name = names[0])
+        key = self.meta.objkey(obj.id)
+        self.assertTrue(self.meta.cursor.redispy.exists(key))
+        obj.delete()
+        self.assertFalse(self.meta.cursor.redispy.exists(key))
+        self.assertRaises(ObjectNotFund,Issuer.objects.get,id = obj.id)
+        self.assertEqual(Issuer.objects.all().count(),len(names)-1)
+        
+    def testDeleteQuery(self):
+        cursor = self.meta.cursor
+        qs  = Issuer.objects.filter(ccy = ccys[0])
+        ids = set((str(obj.id) for obj in qs))
+        self.assertTrue(ids)
+        unique = [self.meta.basekey('name',obj.name) for obj in qs]
+        def get_rows(*args):
+            raise AssertionError('rows read before delete')
+        cursor.get_rows = get_rows
+        try:
+            self.assertEqual(qs.delete(),len(ids))
+        finally:
+            del cursor.get_rows
+        self.assertFalse(cursor.redispy.exists(self.meta.basekey('ccy',ccys[0])))
+        for key in unique:
+            self.assertFalse(cursor.redispy.exists(key))
+        for id in ids:
+            self.assertFalse(cursor.redispy.exists(self.meta.objkey(id)))
+        self.assertEqual(Issuer.objects.all().count(),len(names)-len(ids))
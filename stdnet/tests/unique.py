@@ -0,0 +1,103 @@
+from stdnet import FieldValueError
+from stdnet.test import TestCase
+
+from examples.models import SimpleModel, Instrument
+
+
+class TestUniqueConstraint(TestCase):
+    
+    def setUp(self):
+        self.orm.register(SimpleModel)
+        self.orm.register(Instrument)
+        self.cursor = SimpleModel._meta.cursor
+        
+    def unregister(self):
+        self.orm.unregister(SimpleModel)
+        self.orm.unregister(Instrument)
+        
+    def testSaveTaken(self):
+        obj = SimpleModel(code = 'pippo').save()
+        self.assertRaises(FieldValueError, SimpleModel(code = 'pippo').save)
+        self.assertEqual(SimpleModel.objects.all().count(),1)
+        self.assertEqual(SimpleModel.objects.get(code = 'pippo'),obj)
+        # saving the same object again is fine
+        obj.save()
+        
+    def testChangeUnique(self):
+        obj = SimpleModel(code = 'pippo').save()
+        obj.code = 'pluto'
+        obj.save()
+        self.assertEqual(SimpleModel.objects.get(code = 'pluto'),obj)
+        self.assertFalse(self.cursor.has_key(SimpleModel._meta.basekey('code','pippo')))
+        obj2 = SimpleModel(code = 'pippo').save()
+        self.assertNotEqual(obj2.id,obj.id)
+        self.assertRaises(FieldValueError, SimpleModel(code = 'pluto').save)
+        
+    def testCommitTaken(self):
+        SimpleModel(code = 'pippo').save(False)
+        SimpleModel(code = 'pluto').save(False)
+        SimpleModel(code = 'pippo').save(False)
+        SimpleModel(code = 'paperino').save(False)
+        self.assertRaises(FieldValueError, SimpleModel.commit)
+        codes = sorted((obj.code for obj in SimpleModel.objects.all()))
+        self.assertEqual(codes,['paperino','pippo','pluto'])
+        self.assertEqual(SimpleModel.commit(),[])
+        
+    def testSaveAfterFailedCommit(self):
+        obj = SimpleModel(code = 'pippo').save()
+        SimpleModel(code = 'pluto').save()
+        obj.code = 'pluto'
+        obj.save(False)
+        new = SimpleModel(code = 'pluto').save(False)
+        self.assertRaises(FieldValueError, SimpleModel.commit)
+        obj.code = 'paperino'
+        obj.save()
+        new.code = 'topolino'
+        new.save()
+        self.assertEqual(SimpleModel.objects.get(code = 'paperino'),obj)
+        self.assertEqual(SimpleModel.objects.get(code = 'topolino'),new)
+        self.assertEqual(SimpleModel.objects.filter(code = 'pippo').count(),0)
+        self.assertEqual(SimpleModel.objects.all().count(),3)
+        
+    def testCommitRenamed(self):
+        # objects of a commit are saved by a single script call
+        obj = SimpleModel(code = 'pippo').save()
+        obj.code = 'pluto'
+        obj.save(False)
+        SimpleModel(code = 'pippo').save(False)
+        SimpleModel.commit()
+        self.assertEqual(SimpleModel.objects.get(code = 'pluto'),obj)
+        self.assertNotEqual(SimpleModel.objects.get(code = 'pippo').id,obj.id)
+        
+    def testCommitTwice(self):
+        inst = Instrument(name = 'eurusd', ccy = 'EUR', type = 'fx').save(False)
+        inst.ccy = 'USD'
+        inst.save(False)
+        inst.ccy = 'EUR'
+        inst.save(False)
+        Instrument(name = 'gbpusd', ccy = 'GBP', type = 'fx').save(False)
+        Instrument.commit()
+        self.assertEqual(Instrument.objects.filter(ccy = 'EUR').count(),1)
+        self.assertEqual(Instrument.objects.filter(ccy = 'USD').count(),0)
+        self.assertEqual(Instrument.objects.filter(ccy = 'GBP').count(),1)
+        self.assertEqual(Instrument.objects.filter(type = 'fx').count(),2)
+        
+    def testScriptNotCached(self):
+        SimpleModel(code = 'pippo').save()
+        self.cursor.redispy.script_flush()
+        SimpleModel(code = 'pluto').save()
+        self.assertRaises(FieldValueError, SimpleModel(code = 'pippo').save)
+        self.assertEqual(SimpleModel.objects.all().count(),2)
+        
+    def testDelete(self):
+        inst = Instrument(name = 'eurusd', ccy = 'EUR', type = 'fx').save()
+        meta = Instrument._meta
+        self.assertEqual(Instrument.objects.filter(ccy = 'EUR').count(),1)
+        self.assertEqual(inst.delete(),1)
+        # only the id counter is left
+        keys = self.cursor.keys(meta.basekey('*'))
+        self.assertEqual(keys,[meta.basekey('ids')])
+        self.assertEqual(Instrument.objects.filter(ccy = 'EUR').count(),0)
+        self.assertEqual(inst.delete(),0)
+        Instrument(name = 'eurusd', ccy = 'USD', type = 'fx').save()
+        self.assertEqual(Instrument.objects.get(name = 'eurusd').ccy,'USD')
@@ -0,0 +1,94 @@
+from stdnet.test import TestCase
+from stdnet.exceptions import ObjectNotFund
+from stdnet.utils import populate
+
+from examples.models import Instrument, Issuer
+
+NUM_OBJECTS = 30
+names = list(set(populate('string', NUM_OBJECTS, min_len = 8, max_len = 14)))
+
+
+class TestDirtyFields(TestCase):
+    
+    def setUp(self):
+        self.orm.register(Instrument)
+        self.orm.register(Issuer)
+        for name in names:
+            Instrument(name = name, ccy = 'EUR', type = 'bond').save(False)
+            Issuer(name = name, ccy = 'EUR', rating = 1, description = name).save(False)
+        Instrument.commit()
+        Issuer.commit()
+        
+    def unregister(self):
+        self.orm.unregister(Instrument)
+        self.orm.unregister(Issuer)
+        
+    def calls(self, model):
+        cursor = model._meta.cursor
+        calls  = []
+        add_object = cursor.add_object
+        def add(obj, data, indexes, **kwargs):
+            calls.append((data,indexes,kwargs['discards']))
+            return add_object(obj, data, indexes, **kwargs)
+        cursor.add_object = add
+        return calls
+        
+    def testIndexUpdate(self):
+        inst = Instrument.objects.get(name = names[0])
+        inst.ccy = 'USD'
+        inst.save()
+        self.assertEqual(Instrument.objects.filter(ccy = 'EUR').count(),len(names)-1)
+        usd = list(Instrument.objects.filter(ccy = 'USD'))
+        self.assertEqual(usd,[inst])
+        self.assertEqual(usd[0].type,'bond')
+        
+    def testUniqueUpdate(self):
+        inst = Instrument.objects.get(name = names[0])
+        inst.name = 'renamed'
+        inst.save()
+        self.assertRaises(ObjectNotFund,Instrument.objects.get,name = names[0])
+        self.assertEqual(Instrument.objects.get(name = 'renamed'),inst)
+        # saved instances keep track of changes
+        inst.name = names[0]
+        inst.save()
+        self.assertRaises(ObjectNotFund,Instrument.objects.get,name = 'renamed')
+        self.assertEqual(Instrument.objects.get(name = names[0]),inst)
+        
+    def testUnchanged(self):
+        calls = self.calls(Instrument)
+        try:
+            inst = Instrument.objects.get(name = names[0])
+            inst.save()
+            self.assertEqual(calls,[])
+            inst.type = 'equity'
+            inst.save()
+            self.assertEqual(len(calls),1)
+            data,indexes,discards = calls[0]
+            self.assertEqual([f.name for f,v in indexes],['type'])
+            self.assertEqual([(f.name,v) for f,v in discards],[('type','bond')])
+        finally:
+            del Instrument._meta.cursor.add_object
+        self.assertEqual(Instrument.objects.filter(type = 'bond').count(),len(names)-1)
+        
+    def testHashStorageChangedFields(self):
+        calls = self.calls(Issuer)
+        try:
+            obj = Issuer.objects.get(name = names[0])
+            other = Issuer.objects.get(name = names[0])
+            other.description = 'changed'
+            other.save()
+            obj.rating = 5
+            obj.save()
+            self.assertEqual([data for data,i,d in calls],[['changed'],[5]])
+        finally:
+            del Issuer._meta.cursor.add_object
+        obj = Issuer.objects.get(name = names[0])
+        self.assertEqual(obj.description,'changed')
+        self.assertEqual(obj.rating,5)
+        self.assertEqual(Issuer.objects.all().order_by('-rating')[0],obj)
+        
+    def testDeleteChanged(self):
+        inst = Instrument.objects.get(name = names[0])
+        inst.ccy = 'USD'
+        inst.delete()
+        self.assertEqual(Instrument.objects.filter(ccy = 'EUR').count(),len(names)-1)
@@ -0,0 +1,114 @@
+from threading import Thread
+
+from stdnet import StaleObjectError, FieldError
+from stdnet.test import TestCase
+
+from examples.models import Account, VersionedIssuer, SimpleModel
+
+
+class TestVersionedModel(TestCase):
+    
+    def setUp(self):
+        self.orm.register(Account)
+        self.orm.register(VersionedIssuer)
+        self.orm.register(SimpleModel)
+        
+    def unregister(self):
+        self.orm.unregister(Account)
+        self.orm.unregister(VersionedIssuer)
+        self.orm.unregister(SimpleModel)
+        
+    def load(self, model, id):
+        # a fresh instance, as loaded by another worker
+        return model.objects.get(id = id)
+        
+    def testVersionField(self):
+        meta = Account._meta
+        self.assertEqual(meta.version,meta.dfields['version'])
+        self.assertTrue(meta.version in meta.fields)
+        self.assertFalse(meta.version.index)
+        self.assertEqual(SimpleModel._meta.version,None)
+        
+    def testVersionIncrements(self):
+        acc = Account(name = 'pippo', balance = 10).save()
+        self.assertEqual(acc.version,1)
+        acc.balance = 20
+        acc.save()
+        self.assertEqual(acc.version,2)
+        # nothing changed
+        acc.save()
+        self.assertEqual(acc.version,2)
+        self.assertEqual(Account.objects.get(name = 'pippo').version,2)
+        
+    def testStaleObject(self):
+        Account(name = 'pippo', balance = 10).save()
+        a = self.load(Account, 1)
+        b = self.load(Account, 1)
+        a.balance = 20
+        a.save(check_version = True)
+        b.balance = 30
+        self.assertRaises(StaleObjectError, b.save, check_version = True)
+        c = self.load(Account, 1)
+        self.assertEqual(c.balance,20)
+        self.assertEqual(c.version,2)
+        # saving without check, the last writer wins
+        b.save()
+        self.assertEqual(self.load(Account, 1).balance,30)
+        
+    def testHashStorage(self):
+        VersionedIssuer(name = 'pippo', rating = 1).save()
+        a = VersionedIssuer.objects.all().only('rating')[0]
+        b = VersionedIssuer.objects.all().only('rating')[0]
+        a.rating = 2
+        a.save(check_version = True)
+        b.rating = 3
+        self.assertRaises(StaleObjectError, b.save, check_version = True)
+        obj = self.load(VersionedIssuer, 1)
+        self.assertEqual(obj.rating,2)
+        self.assertEqual(obj.version,2)
+        
+    def testUpdateAtomic(self):
+        acc = Account(name = 'pippo', balance = 0).save()
+        def deposit(account):
+            account.balance += 1
+        def worker():
+            for i in range(25):
+                Account.objects.update_atomic(acc.id, deposit, retries = 1000)
+        threads = [Thread(target = worker) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        acc = self.load(Account, acc.id)
+        self.assertEqual(acc.balance,100)
+        self.assertEqual(acc.version,101)
+        
+    def testRetriesExhausted(self):
+        acc = Account(name = 'pippo', balance = 0).save()
+        calls = []
+        def concurrent(account):
+            calls.append(account)
+            other = self.load(Account, acc.id)
+            other.balance += 1
+            other.save()
+            account.balance += 10
+        self.assertRaises(StaleObjectError, Account.objects.update_atomic,
+                          acc.id, concurrent, retries = 2)
+        self.assertEqual(len(calls),3)
+        self.assertEqual(self.load(Account, acc.id).balance,3)
+        
+    def testNotVersioned(self):
+        obj = SimpleModel(code = 'pippo')
+        self.assertRaises(FieldError, obj.save, check_version = True)
+        self.assertRaises(FieldError, SimpleModel.objects.update_atomic, 1, lambda obj : obj)
+        
+    def testDelete(self):
+        acc = Account(name = 'pippo', balance = 0).save()
+        meta = Account._meta
+        cursor = meta.cursor
+        self.assertTrue(cursor.has_key(meta.basekey('versions')))
+        acc.delete()
+        self.assertFalse(cursor.has_key(meta.basekey('versions')))
+        Account(name = 'pippo', balance = 0).save()
+        Account.objects.all().delete()
+        self.assertFalse(cursor.has_key(meta.basekey('versions')))
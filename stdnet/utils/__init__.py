@@ -6,6 +6,8 @@ from rwlock import *
 from importlib import *
 from anyjson import *
 from odict import *
+from lru import *
+from hashring import *
 from populate import populate
 from fields import *
 
@@ -17,3 +19,16 @@ def date2timestamp(dte):
 def timestamp2date(tstamp):
     "Converts a unix timestamp to a Python datetime object"
     return datetime.fromtimestamp(0.001*int(tstamp))
+
+
+def chunks(values, size):
+    '''Generator of lists with at most *size* elements taken from *values*.'''
+    size  = max(size,1)
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -4,10 +4,10 @@ class ModelFieldPickler(object):
     
     def __init__(self, model):
         self.model = model
-        self.get   = model.objects.get
         
     def loads(self, s):
-        return self.get(id = s)
+        # the model manager is available once the model is registered
+        return self.model.objects.get(id = s)
     
     def dumps(self, obj):
         return obj.id
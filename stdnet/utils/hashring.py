@@ -0,0 +1,33 @@
+from bisect import bisect
+from hashlib import md5
+
+__all__ = ['HashRing']
+
+
+class HashRing(object):
+    '''Consistent hashing of keys over a list of *nodes*. Each node is
+placed on the ring at *replicas* points, so that keys are evenly spread
+and adding or removing a node only moves the keys of that node.'''
+    def __init__(self, nodes, replicas = 160):
+        self.nodes    = list(nodes)
+        self.replicas = replicas
+        ring = []
+        for node in self.nodes:
+            for i in xrange(replicas):
+                ring.append((self.hash('%s-%s' % (node,i)),node))
+        ring.sort()
+        self._points = [p for p,node in ring]
+        self._nodes  = [node for p,node in ring]
+        
+    def __len__(self):
+        return len(self.nodes)
+        
+    def hash(self, key):
+        return long(md5(key).hexdigest()[:16],16)
+    
+    def get_node(self, key):
+        '''Return the node *key* is mapped to.'''
+        if not self._nodes:
+            raise ValueError('No nodes in the ring')
+        pos = bisect(self._points,self.hash(key))
+        return self._nodes[pos % len(self._nodes)]
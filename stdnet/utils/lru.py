@@ -0,0 +1,108 @@
+from threading import Lock
+
+__all__ = ['LRUCache']
+
+
+class LRUCache(object):
+    '''A size-bounded dictionary which discards the least recently used
+items when more than *size* items are stored. A *size* of ``0`` disables
+the cache. Lookups update the :attr:`hits` and :attr:`misses` counters.
+It is safe to use it from several threads.'''
+    def __init__(self, size = 0):
+        self.size   = max(int(size),0)
+        self.hits   = 0
+        self.misses = 0
+        self._lock  = Lock()
+        self.clear()
+        
+    def __len__(self):
+        return len(self._map)
+    
+    def __contains__(self, key):
+        return key in self._map
+    
+    def clear(self):
+        '''Remove all items from the cache. Counters are not reset.'''
+        # circular doubly linked list of [prev, next, key, value]
+        root = []
+        root[:] = [root, root, None, None]
+        self._root = root
+        self._map  = {}
+        
+    def get(self, key, default = None):
+        '''Return the value for *key*, marking it as the most recently used,
+or *default* if *key* is not in the cache.'''
+        self._lock.acquire()
+        try:
+            link = self._map.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            prev, next, _, value = link
+            prev[1] = next
+            next[0] = prev
+            self._append(link)
+            return value
+        finally:
+            self._lock.release()
+        
+    def set(self, key, value):
+        '''Store *value* for *key*, discarding the least recently used
+item if the cache is full.'''
+        if not self.size:
+            return
+        self._lock.acquire()
+        try:
+            self._discard(key)
+            if len(self._map) >= self.size:
+                oldest = self._root[1]
+                self._discard(oldest[2])
+            link = [None, None, key, value]
+            self._map[key] = link
+            self._append(link)
+        finally:
+            self._lock.release()
+            
+    def discard(self, key):
+        '''Remove *key* from the cache if present.'''
+        self._lock.acquire()
+        try:
+            self._discard(key)
+        finally:
+            self._lock.release()
+        
+    def keys(self):
+        '''List of keys in the cache, from the least to the most recently used.'''
+        self._lock.acquire()
+        try:
+            keys = []
+            link = self._root[1]
+            while link is not self._root:
+                keys.append(link[2])
+                link = link[1]
+            return keys
+        finally:
+            self._lock.release()
+        
+    def stats(self):
+        '''Dictionary with the cache ``size``, number of stored ``items``,
+``hits`` and ``misses``.'''
+        return {'size': self.size,
+                'items': len(self._map),
+                'hits': self.hits,
+                'misses': self.misses}
+        
+    def _append(self, link):
+        root = self._root
+        last = root[0]
+        link[0] = last
+        link[1] = root
+        last[1] = root[0] = link
+        
+    def _discard(self, key):
+        link = self._map.pop(key,None)
+        if link is not None:
+            prev, next = link[0], link[1]
+            prev[1] = next
+            next[0] = prev